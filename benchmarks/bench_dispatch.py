@@ -0,0 +1,79 @@
+"""
+Benchmark dispatching the lines of large rstx files to many registered directives.
+
+A synthetic rstx file is generated in a temporary directory, with one directive call every
+--directive-every lines, and --directives trivial directives are registered. The time spent in
+embed_file is then dominated by matching lines against directives.
+
+Usage: python benchmarks/bench_dispatch.py [--lines N] [--directives M] [--repeat R]
+"""
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+from sphinx_auto_embed.directive import Directive
+from sphinx_auto_embed.main import embed_file
+
+
+class DirectiveBenchmark(Directive):
+
+    NUM_ARGS = 1
+
+    def run(self, file_dir, file_name, embed_num_indent, args):
+        return [' ' * embed_num_indent + args[0] + '\n']
+
+
+def get_benchmark_directives(num_directives):
+    """
+    Create trivial directives named 'bench-0', 'bench-1', and so on.
+    """
+    return [
+        type('DirectiveBenchmark%i' % i, (DirectiveBenchmark,), {'NAME': 'bench-%i' % i})()
+        for i in range(num_directives)
+    ]
+
+
+def write_rstx_file(file_path, num_lines, num_directives, directive_every):
+    with open(file_path, 'w') as f:
+        for iline in range(num_lines):
+            if iline % directive_every == 0:
+                f.write('.. bench-%i :: line%i\n' % (iline % num_directives, iline))
+            elif iline % 3 == 0:
+                f.write('.. note:: regular rst directives are passed through untouched\n')
+            else:
+                f.write('Some ordinary text in the document, line %i.\n' % iline)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark line dispatch in embed_file.')
+    parser.add_argument('--lines', type=int, default=200000)
+    parser.add_argument('--directives', type=int, default=200)
+    parser.add_argument('--directive-every', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args(args)
+
+    directives_list = get_benchmark_directives(options.directives)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        write_rstx_file(
+            tmp_dir + '/bench.rstx', options.lines, options.directives, options.directive_every)
+
+        times = []
+        for i in range(options.repeat):
+            start_time = time.time()
+            embed_file(tmp_dir, 'bench.rstx', directives_list)
+            times.append(time.time() - start_time)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    best_time = min(times)
+    print('dispatch: {} lines, {} directives: {:.3f} s ({:.0f} lines/s)'.format(
+        options.lines, options.directives, best_time, options.lines / best_time))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
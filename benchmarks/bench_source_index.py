@@ -0,0 +1,102 @@
+"""
+Benchmark extracting method bodies from a test module with many methods.
+
+A test module with --methods methods is generated in a temporary directory, and the body of
+every method is extracted through get_method_lines, as a page embedding many methods from the
+same module would. This is compared to extracting each body with inspect.getsource, which reads
+and tokenizes the file again for every method.
+
+Usage: python benchmarks/bench_source_index.py [--methods N] [--repeat R]
+"""
+import os
+import sys
+import time
+import shutil
+import inspect
+import argparse
+import tempfile
+import importlib
+
+from sphinx_auto_embed.directives.directive_embed_test import DirectiveEmbedTest
+
+
+def write_test_module(file_path, num_methods):
+    with open(file_path, 'w') as f:
+        f.write('import unittest\n\n\nclass Test(unittest.TestCase):\n')
+        for imethod in range(num_methods):
+            f.write('\n    def test_%i(self):\n' % imethod)
+            f.write('        """Example number %i."""\n' % imethod)
+            f.write('        # Compute something\n')
+            for iline in range(10):
+                f.write('        x%i = %i * %i\n' % (iline, iline, imethod))
+            f.write('        print(x9)\n')
+
+
+def get_method_lines_inspect(module, class_name, method_name):
+    """
+    Extract a method body with inspect.getsource, as get_method_lines did before the index.
+    """
+    method = getattr(getattr(module, class_name), method_name)
+
+    method_lines = inspect.getsource(method).split('\n')
+    for imethod_line, method_line in enumerate(method_lines):
+        if 'def' in method_line and method_name in method_line:
+            imethod_line += 1
+            break
+    method_lines = method_lines[imethod_line:]
+
+    first_line = method_lines[0]
+    py_num_indent = first_line.find(first_line.strip())
+    return [method_line[py_num_indent:] for method_line in method_lines]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark method source extraction.')
+    parser.add_argument('--methods', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args(args)
+
+    tmp_dir = tempfile.mkdtemp()
+    sys.path.insert(0, tmp_dir)
+    try:
+        write_test_module(tmp_dir + '/bench_test_module.py', options.methods)
+        module = importlib.import_module('bench_test_module')
+        method_names = ['test_%i' % imethod for imethod in range(options.methods)]
+
+        directive = DirectiveEmbedTest()
+        directive.dependencies = {}
+        directive.get_method_lines(['bench_test_module', 'Test', method_names[0]])
+
+        index_times = []
+        inspect_times = []
+        for i in range(options.repeat):
+            # Touching the file invalidates the index, so every repetition parses it once
+            os.utime(tmp_dir + '/bench_test_module.py', None)
+
+            start_time = time.time()
+            index_lines = [
+                directive.get_method_lines(['bench_test_module', 'Test', method_name])
+                for method_name in method_names
+            ]
+            index_times.append(time.time() - start_time)
+
+            start_time = time.time()
+            inspect_lines = [
+                get_method_lines_inspect(module, 'Test', method_name)
+                for method_name in method_names
+            ]
+            inspect_times.append(time.time() - start_time)
+
+        if index_lines != inspect_lines:
+            raise Exception('The source index and inspect extracted different method bodies.')
+    finally:
+        sys.path.remove(tmp_dir)
+        shutil.rmtree(tmp_dir)
+
+    print('source extraction: {} methods: index {:.3f} s, inspect {:.3f} s'.format(
+        options.methods, min(index_times), min(inspect_times)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
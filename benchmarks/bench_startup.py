@@ -0,0 +1,64 @@
+"""
+Benchmark the time it takes sphinx_auto_embed to start up and find its directives.
+
+Each repetition runs in a fresh interpreter so that nothing is already imported. The benchmark
+fails if finding the directives imports matplotlib or any directive module, or if the median
+time exceeds --max-seconds.
+
+Usage: python benchmarks/bench_startup.py [--repeat N] [--max-seconds T]
+"""
+import sys
+import time
+import argparse
+import subprocess
+
+
+STARTUP_CODE = '''
+import sys
+from sphinx_auto_embed.utils import get_directives
+get_directives(None)
+loaded = [name for name in sys.modules
+          if name.startswith('matplotlib') or name.startswith('sphinx_auto_embed.directives.')]
+sys.exit(1 if loaded else 0)
+'''
+
+
+def time_startup():
+    """
+    Time a single startup in a fresh interpreter.
+
+    Returns
+    -------
+    float
+        Wall time in seconds.
+    """
+    start_time = time.time()
+    return_code = subprocess.call([sys.executable, '-c', STARTUP_CODE])
+    elapsed_time = time.time() - start_time
+
+    if return_code != 0:
+        raise Exception('Finding the directives imported matplotlib or a directive module.')
+
+    return elapsed_time
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark sphinx_auto_embed startup time.')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--max-seconds', type=float, default=None)
+    options = parser.parse_args(args)
+
+    times = sorted(time_startup() for i in range(options.repeat))
+    median_time = times[len(times) // 2]
+
+    print('startup: min {:.3f} s, median {:.3f} s over {} runs'.format(
+        times[0], median_time, options.repeat))
+
+    if options.max_seconds is not None and median_time > options.max_seconds:
+        print('startup regression: median exceeds {:.3f} s'.format(options.max_seconds))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
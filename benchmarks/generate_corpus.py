@@ -0,0 +1,157 @@
+"""
+Generate a synthetic documentation tree for benchmarking sphinx_auto_embed.
+
+The tree contains --files rstx files spread over directories nested --depth levels deep, each
+with --directives embed-* directive calls mixed with ordinary rst, and a package of --modules
+large test modules with --methods methods each for the directives to embed. An '.embedrc'
+enabling the execution cache is written at the root, so the tool can be run on the tree as is:
+
+    cd OUT_DIR && PYTHONPATH=. sphinx_auto_embed
+
+Usage: python benchmarks/generate_corpus.py OUT_DIR [--files N] [--depth D] [--directives M]
+       [--modules K] [--methods L] [--plot-every P] [--seed S]
+"""
+import os
+import sys
+import random
+import argparse
+
+
+PACKAGE_NAME = 'bench_pkg'
+
+# Directives embedding code only, and directives executing it
+CODE_DIRECTIVES = ['embed-test', 'embed-test-print']
+PLOT_DIRECTIVES = ['embed-test-plot', 'embed-test-print-plot']
+
+
+def write_test_module(file_path, imodule, num_methods):
+    """
+    Write a test module with a class of num_methods print methods and a few plot methods.
+    """
+    with open(file_path, 'w') as f:
+        f.write('import unittest\n\n\nclass Test(unittest.TestCase):\n')
+        for imethod in range(num_methods):
+            f.write('\n    def test_%i(self):\n' % imethod)
+            f.write('        """Example number %i of module %i."""\n' % (imethod, imodule))
+            f.write('        # Compute something\n')
+            f.write('        values = []\n')
+            for iline in range(15):
+                f.write('        values.append(%i * %i + %i)\n' % (iline, imethod, imodule))
+            f.write('        print(sum(values))\n')
+
+        f.write('\n    def test_plot(self):\n')
+        f.write('        import matplotlib.pyplot as plt\n')
+        f.write('        plt.plot([0, 1, 2], [0, %i, 4])\n' % imodule)
+
+
+def get_rstx_dir(root_dir, ifile, depth, fan_out):
+    """
+    Get the directory of the ifile-th rstx file, nesting directories depth levels deep.
+    """
+    path = root_dir + '/docs'
+    index = ifile
+    for ilevel in range(depth):
+        index //= fan_out
+        path += '/section_%i_%i' % (ilevel, index % fan_out)
+    return path
+
+
+def write_rstx_file(file_path, ifile, num_directives, num_modules, num_methods, plot_every,
+                    rand):
+    """
+    Write an rstx file with num_directives embed-* directive calls mixed with ordinary rst.
+    """
+    with open(file_path, 'w') as f:
+        title = 'Page %i' % ifile
+        f.write(title + '\n' + '=' * len(title) + '\n\n')
+
+        for idirective in range(num_directives):
+            f.write('Paragraph %i of the page, with some *emphasis* and ``literals``.\n' % (
+                idirective))
+            f.write('It spans a few lines like ordinary documentation does.\n\n')
+            f.write('.. note:: regular rst directives are passed through untouched\n\n')
+
+            module_name = '%s.test_module_%i' % (PACKAGE_NAME, rand.randrange(num_modules))
+            if plot_every and idirective % plot_every == plot_every - 1:
+                f.write('.. %s :: %s , Test , test_plot , 50\n\n' % (
+                    rand.choice(PLOT_DIRECTIVES), module_name))
+            else:
+                f.write('.. %s :: %s , Test , test_%i\n\n' % (
+                    rand.choice(CODE_DIRECTIVES), module_name, rand.randrange(num_methods)))
+
+
+def generate_corpus(root_dir, num_files=2000, depth=4, num_directives=20, num_modules=20,
+                    num_methods=200, plot_every=0, seed=0):
+    """
+    Generate a synthetic documentation tree.
+
+    Parameters
+    ----------
+    root_dir : str
+        Directory in which to generate the tree; created if it does not exist.
+    num_files : int
+        Number of rstx files.
+    depth : int
+        Number of directory levels the rstx files are nested in under 'docs'.
+    num_directives : int
+        Number of directive calls in each rstx file.
+    num_modules : int
+        Number of test modules embedded by the directives.
+    num_methods : int
+        Number of methods in each test module.
+    plot_every : int
+        Make every plot_every-th directive call in each file a plot directive; 0 for none.
+    seed : int
+        Seed for the random choice of directives, modules, and methods, so that the same
+        parameters always generate the same tree.
+    """
+    rand = random.Random(seed)
+
+    package_dir = root_dir + '/' + PACKAGE_NAME
+    if not os.path.isdir(package_dir):
+        os.makedirs(package_dir)
+    with open(package_dir + '/__init__.py', 'w') as f:
+        f.write('')
+    for imodule in range(num_modules):
+        write_test_module(package_dir + '/test_module_%i.py' % imodule, imodule, num_methods)
+
+    with open(root_dir + '/.embedrc', 'w') as f:
+        f.write('cache_dir = .embed_cache\n')
+
+    # Spread the files evenly, with at most fan_out subdirectories per directory
+    fan_out = 2
+    while fan_out ** depth < num_files // 10 + 1:
+        fan_out += 1
+
+    for ifile in range(num_files):
+        rstx_dir = get_rstx_dir(root_dir, ifile, depth, fan_out)
+        if not os.path.isdir(rstx_dir):
+            os.makedirs(rstx_dir)
+        write_rstx_file(
+            rstx_dir + '/page_%i.rstx' % ifile, ifile, num_directives, num_modules, num_methods,
+            plot_every, rand)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic documentation tree.')
+    parser.add_argument('out_dir')
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--directives', type=int, default=20)
+    parser.add_argument('--modules', type=int, default=20)
+    parser.add_argument('--methods', type=int, default=200)
+    parser.add_argument('--plot-every', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args(args)
+
+    generate_corpus(
+        os.path.abspath(options.out_dir), options.files, options.depth, options.directives,
+        options.modules, options.methods, options.plot_every, options.seed)
+
+    print('corpus: {} rstx files with {} directives each in {}'.format(
+        options.files, options.directives, options.out_dir))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""
+Run the benchmark suite on a synthetic corpus and save the results.
+
+A corpus is generated with generate_corpus in a temporary directory, and the main stages of
+sphinx_auto_embed are timed on it:
+
+- discovery: finding the rstx files with get_rstx_file_paths.
+- startup: finding the directives with get_directives in a fresh interpreter.
+- dispatch: matching the lines of a large rstx file against many directives in embed_file.
+- source: extracting the body of every method of the corpus test modules.
+- build_cold: a full build from the command line with an empty execution cache.
+- build_warm: a full build (--force) with the execution cache filled by the cold build.
+- build_noop: a build in which the manifest shows that every file is up to date.
+
+The results are written as JSON to --output, by default benchmarks/results/LABEL.json where
+LABEL is the current git commit. Passing the results of another version with --compare prints
+the ratio of each stage's time to that version's and fails if any stage is slower by more than
+--max-regression.
+
+Usage: python benchmarks/run_benchmarks.py [--files N] [--directives M] [--repeat R]
+       [--stages S1,S2,...] [--label LABEL] [--output PATH] [--compare PATH]
+       [--max-regression F]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import importlib
+import subprocess
+
+from sphinx_auto_embed.utils import get_rstx_file_paths, get_directives
+from sphinx_auto_embed.main import embed_file
+from sphinx_auto_embed.directives.directive_embed_test import DirectiveEmbedTest
+
+from generate_corpus import generate_corpus, PACKAGE_NAME
+from bench_startup import time_startup
+from bench_dispatch import get_benchmark_directives, write_rstx_file
+
+STAGES = [
+    'discovery', 'startup', 'dispatch', 'source', 'build_cold', 'build_warm', 'build_noop',
+]
+
+BUILD_CODE = 'import sys; from sphinx_auto_embed.main import main; sys.exit(main())'
+
+
+def time_repeated(func, repeat):
+    """
+    Call a function repeatedly and time each call.
+
+    Returns
+    -------
+    list of float
+        Wall time of each call in seconds.
+    """
+    times = []
+    for i in range(repeat):
+        start_time = time.time()
+        func()
+        times.append(time.time() - start_time)
+    return times
+
+
+def bench_discovery(corpus_dir, repeat):
+    return time_repeated(lambda: get_rstx_file_paths(corpus_dir), repeat)
+
+
+def bench_startup(corpus_dir, repeat):
+    return [time_startup() for i in range(repeat)]
+
+
+def bench_dispatch(corpus_dir, repeat):
+    directives_list = get_directives(None) + get_benchmark_directives(200)
+    dispatch_dir = corpus_dir + '/dispatch'
+    os.makedirs(dispatch_dir)
+    write_rstx_file(dispatch_dir + '/bench.rstx', 100000, 200, 20)
+    return time_repeated(lambda: embed_file(dispatch_dir, 'bench.rstx', directives_list), repeat)
+
+
+def bench_source(corpus_dir, repeat):
+    directive = DirectiveEmbedTest()
+    directive.dependencies = {}
+
+    method_args = []
+    for file_name in sorted(os.listdir(corpus_dir + '/' + PACKAGE_NAME)):
+        if file_name.startswith('test_module_'):
+            module_name = PACKAGE_NAME + '.' + file_name[:-3]
+            module = importlib.import_module(module_name)
+            method_args.extend(
+                [module_name, 'Test', method_name] for method_name in sorted(vars(module.Test))
+                if method_name.startswith('test_'))
+
+    def extract():
+        # Touching the modules invalidates their indices, so every repetition parses them once
+        for file_name in os.listdir(corpus_dir + '/' + PACKAGE_NAME):
+            os.utime(corpus_dir + '/' + PACKAGE_NAME + '/' + file_name, None)
+        for args in method_args:
+            directive.get_method_lines(args)
+
+    return time_repeated(extract, repeat)
+
+
+def run_build(corpus_dir, args):
+    """
+    Run sphinx_auto_embed from the command line in the corpus and time it.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [corpus_dir] + [path for path in [env.get('PYTHONPATH')] if path])
+
+    start_time = time.time()
+    with open(os.devnull, 'w') as devnull:
+        return_code = subprocess.call(
+            [sys.executable, '-c', BUILD_CODE] + args, cwd=corpus_dir, env=env, stdout=devnull)
+    elapsed_time = time.time() - start_time
+
+    if return_code != 0:
+        raise Exception('sphinx_auto_embed failed on the corpus with code {}.'.format(
+            return_code))
+    return elapsed_time
+
+
+def bench_build_cold(corpus_dir, repeat):
+    times = []
+    for i in range(repeat):
+        shutil.rmtree(corpus_dir + '/.embed_cache', ignore_errors=True)
+        times.append(run_build(corpus_dir, ['--force']))
+    return times
+
+
+def bench_build_warm(corpus_dir, repeat):
+    run_build(corpus_dir, [])
+    return [run_build(corpus_dir, ['--force']) for i in range(repeat)]
+
+
+def bench_build_noop(corpus_dir, repeat):
+    run_build(corpus_dir, [])
+    return [run_build(corpus_dir, []) for i in range(repeat)]
+
+
+STAGE_FUNCTIONS = {
+    'discovery': bench_discovery,
+    'startup': bench_startup,
+    'dispatch': bench_dispatch,
+    'source': bench_source,
+    'build_cold': bench_build_cold,
+    'build_warm': bench_build_warm,
+    'build_noop': bench_build_noop,
+}
+
+
+def get_git_commit():
+    """
+    Get the short hash of the current git commit of sphinx_auto_embed, if known.
+    """
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        with open(os.devnull, 'w') as devnull:
+            commit = subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit.decode('ascii').strip()
+
+
+def compare_results(results, baseline, max_regression):
+    """
+    Print the ratio of each stage's time to the baseline's and check for regressions.
+
+    Returns
+    -------
+    bool
+        Whether any stage is slower than the baseline by more than max_regression.
+    """
+    regressed = False
+    print('compared to {}:'.format(baseline['label']))
+    for stage in STAGES:
+        if stage not in results['stages'] or stage not in baseline['stages']:
+            continue
+
+        ratio = results['stages'][stage]['median'] / baseline['stages'][stage]['median']
+        flag = ''
+        if ratio > 1 + max_regression:
+            flag = '  REGRESSION'
+            regressed = True
+        print('  {:12} {:6.2f}x{}'.format(stage, ratio, flag))
+    return regressed
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Run the sphinx_auto_embed benchmark suite.')
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--directives', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--label', default=None)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None)
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    options = parser.parse_args(args)
+
+    stages = options.stages.split(',')
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error('unknown stage {}; choose from {}'.format(stage, ', '.join(STAGES)))
+
+    commit = get_git_commit()
+    label = options.label or commit or 'unknown'
+    results = {
+        'label': label,
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus': {'files': options.files, 'directives': options.directives},
+        'stages': {},
+    }
+
+    corpus_dir = tempfile.mkdtemp()
+    sys.path.insert(0, corpus_dir)
+    try:
+        generate_corpus(corpus_dir, num_files=options.files, num_directives=options.directives)
+
+        # Stages run in the order of STAGES, since the warm and no-op builds reuse the cold one
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+
+            times = sorted(STAGE_FUNCTIONS[stage](corpus_dir, options.repeat))
+            results['stages'][stage] = {
+                'times': times,
+                'min': times[0],
+                'median': times[len(times) // 2],
+            }
+            print('{:12} min {:8.3f} s, median {:8.3f} s'.format(
+                stage, times[0], times[len(times) // 2]))
+    finally:
+        sys.path.remove(corpus_dir)
+        shutil.rmtree(corpus_dir)
+
+    output_path = options.output
+    if output_path is None:
+        output_dir = os.path.dirname(os.path.abspath(__file__)) + '/results'
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        output_path = output_dir + '/' + label + '.json'
+
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print('results written to {}'.format(output_path))
+
+    if options.compare is not None:
+        with open(options.compare, 'r') as f:
+            baseline = json.load(f)
+        if compare_results(results, baseline, options.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,213 @@
+import os
+import sys
+import time
+import pickle
+import hashlib
+
+from sphinx_auto_embed.manifest import hash_file
+from sphinx_auto_embed.execution import get_loaded_module_paths, get_project_modules
+
+
+class ExecutionCache(object):
+    """
+    On-disk cache of the results of executing code snippets.
+
+    Entries are keyed by the code that was executed. Each entry also stores the hash of every
+    project module that was loaded when the code ran, and it is only used if none of those
+    modules have changed since. Project modules are those whose source file is under the
+    project directory; installed packages are not tracked.
+    """
+
+    def __init__(self, cache_dir, project_dir, max_size=None, max_age=None):
+        """
+        Parameters
+        ----------
+        cache_dir : str
+            Absolute path to the directory holding the cache entries.
+        project_dir : str
+            Absolute path to the root directory of the project being documented.
+        max_size : float or None
+            Maximum total size of the cache entries in MB; None for no limit.
+        max_age : float or None
+            Number of days after which an entry that has not been used is evicted;
+            None for no limit.
+        """
+        self.cache_dir = cache_dir
+        self.project_dir = project_dir
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._hashes = {}
+
+    def get_stats(self):
+        """
+        Get the hit and miss counts of this cache instance.
+
+        Returns
+        -------
+        dict
+            Number of 'hits' and 'misses'.
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def get_key(self, method_lines, *options):
+        """
+        Compute the cache key for a code snippet.
+
+        Parameters
+        ----------
+        method_lines : list of str
+            Lines of code to execute.
+        *options
+            Any other values that affect the result of the execution.
+
+        Returns
+        -------
+        str
+            Hexadecimal digest identifying the execution.
+        """
+        hasher = hashlib.sha1()
+        hasher.update(repr(sys.version_info[:2]).encode('utf-8'))
+        hasher.update(repr(options).encode('utf-8'))
+        hasher.update('\n'.join(method_lines).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def _get_entry_path(self, key):
+        return self.cache_dir + '/' + key + '.pickle'
+
+    def _get_hash(self, file_path):
+        # Keyed on the modification time so that edits made during a long run are noticed.
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+
+        memo_key = (file_path, stat.st_mtime, stat.st_size)
+        if memo_key not in self._hashes:
+            self._hashes[memo_key] = hash_file(file_path)
+        return self._hashes[memo_key]
+
+    def _get_project_module_hashes(self, module_paths):
+        project_prefix = self.project_dir + os.sep
+        return dict(
+            (file_path, self._get_hash(file_path))
+            for file_path in module_paths if file_path.startswith(project_prefix)
+        )
+
+    def load(self, key):
+        """
+        Get the stored result of an execution if it is still valid.
+
+        Parameters
+        ----------
+        key : str
+            Cache key from get_key.
+
+        Returns
+        -------
+        dict or None
+            The stored 'stdout' str, 'figures' list of bytes, and 'project_modules' dict, as
+            returned by get_project_modules; None on a miss.
+        """
+        entry_path = self._get_entry_path(key)
+
+        try:
+            with open(entry_path, 'rb') as f:
+                entry = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+
+        # Entries written before the project modules were stored cannot report them
+        if 'project_modules' not in entry:
+            self.misses += 1
+            return None
+
+        for file_path, file_hash in entry['modules'].items():
+            if self._get_hash(file_path) != file_hash:
+                self.misses += 1
+                return None
+
+        # Mark the entry as recently used for eviction
+        os.utime(entry_path, None)
+
+        self.hits += 1
+        return entry
+
+    def store(self, key, stdout, figures, module_paths=None, project_modules=None):
+        """
+        Store the result of an execution, along with the project modules loaded at the time.
+
+        Parameters
+        ----------
+        key : str
+            Cache key from get_key.
+        stdout : str
+            Everything the code printed.
+        figures : list of bytes
+            Rendered figures.
+        module_paths : list of str or None
+            Source files of the modules loaded when the code ran, if it ran in another process;
+            None to use the modules loaded in this process.
+        project_modules : dict or None
+            Project modules loaded when the code ran, as returned by get_project_modules, to
+            report as dependencies on a hit; None to use those loaded in this process.
+        """
+        if module_paths is None:
+            module_paths = get_loaded_module_paths()
+        if project_modules is None:
+            project_modules = get_project_modules()
+
+        try:
+            os.makedirs(self.cache_dir)
+        except OSError:
+            # Already created, possibly by another worker process
+            pass
+
+        entry = {
+            'stdout': stdout,
+            'figures': figures,
+            'modules': self._get_project_module_hashes(module_paths),
+            'project_modules': project_modules,
+        }
+
+        # Write to a temporary file first so that concurrent workers never read partial entries.
+        entry_path = self._get_entry_path(key)
+        tmp_entry_path = '{}.{}.tmp'.format(entry_path, os.getpid())
+        with open(tmp_entry_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=2)
+        os.rename(tmp_entry_path, entry_path)
+
+    def evict(self):
+        """
+        Remove entries that have not been used within max_age, then the least recently used
+        entries until the total size is within max_size.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith('.pickle'):
+                entry_path = self.cache_dir + '/' + file_name
+                stat = os.stat(entry_path)
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+        # Oldest first
+        entries.sort()
+
+        if self.max_age is not None:
+            min_mtime = time.time() - self.max_age * 86400.
+            while entries and entries[0][0] < min_mtime:
+                os.remove(entries.pop(0)[2])
+                self.evictions += 1
+
+        if self.max_size is not None:
+            total_size = sum(size for mtime, size, entry_path in entries)
+            while entries and total_size > self.max_size * 1e6:
+                mtime, size, entry_path = entries.pop(0)
+                os.remove(entry_path)
+                total_size -= size
+                self.evictions += 1
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+
+from sphinx_auto_embed.utils import write_lines_if_changed
+
+
+CHECKPOINT_FILE_NAME = '.embed_checkpoint.json'
+
+# Minimum number of seconds between two writes of the checkpoint during a run
+SAVE_INTERVAL = 10.
+
+
+class Checkpoint(object):
+    """
+    Record of the rstx files a run set out to process, and of those completed and failed so far.
+
+    The checkpoint is written now and then while files are processed and whenever the run ends
+    early or with failures, so that a run resumed from it only processes the files that failed or
+    were not reached, rather than every file that was selected. It is removed once a run
+    completes without failures.
+    """
+
+    VERSION = 1
+
+    def __init__(self, checkpoint_path, save_interval=SAVE_INTERVAL):
+        """
+        Parameters
+        ----------
+        checkpoint_path : str
+            Absolute path to the checkpoint file; rstx paths are stored relative to the
+            directory containing it.
+        save_interval : float
+            Minimum number of seconds between two writes of the checkpoint by record.
+        """
+        self.checkpoint_path = checkpoint_path
+        self.base_dir = os.path.dirname(checkpoint_path)
+        self.save_interval = save_interval
+        self.pending = set()
+        self.completed = set()
+        self.failed = {}
+        self._last_save_time = time.time()
+
+    def _get_rel_path(self, abs_path):
+        return os.path.relpath(abs_path, self.base_dir)
+
+    def load(self):
+        """
+        Read the checkpoint from disk, if it exists and was written by a compatible version.
+
+        Returns
+        -------
+        bool
+            True if a checkpoint was read.
+        """
+        if not os.path.isfile(self.checkpoint_path):
+            return False
+
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                data = json.load(f)
+        except ValueError:
+            return False
+
+        if data.get('version') != self.VERSION:
+            return False
+
+        self.pending = set(data['pending'])
+        self.completed = set(data['completed'])
+        self.failed = data['failed']
+        return True
+
+    def save(self):
+        """
+        Write the checkpoint to disk.
+        """
+        data = {
+            'version': self.VERSION,
+            'pending': sorted(self.pending),
+            'completed': sorted(self.completed),
+            'failed': self.failed,
+        }
+        write_lines_if_changed(self.checkpoint_path, [json.dumps(data, indent=1, sort_keys=True)])
+        self._last_save_time = time.time()
+
+    def remove(self):
+        """
+        Remove the checkpoint from disk, if it exists.
+        """
+        if os.path.isfile(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def add_pending(self, rstx_file_paths):
+        """
+        Record that rstx files are to be processed.
+
+        Parameters
+        ----------
+        rstx_file_paths : list of str
+            Absolute paths to the rstx files.
+        """
+        for rstx_file_path in rstx_file_paths:
+            rel_path = self._get_rel_path(rstx_file_path)
+            self.pending.add(rel_path)
+            self.completed.discard(rel_path)
+
+    def is_remaining(self, rstx_file_path):
+        """
+        Check whether an rstx file was to be processed, but failed or was not reached.
+
+        Parameters
+        ----------
+        rstx_file_path : str
+            Absolute path to the rstx file.
+
+        Returns
+        -------
+        bool
+            True if the rstx file remains to be processed.
+        """
+        rel_path = self._get_rel_path(rstx_file_path)
+        return rel_path in self.pending and rel_path not in self.completed
+
+    def record(self, rstx_file_path, failures):
+        """
+        Record that an rstx file was processed, and write the checkpoint if it is due.
+
+        Parameters
+        ----------
+        rstx_file_path : str
+            Absolute path to the rstx file.
+        failures : list of dict
+            Failures while processing the file, as in EmbedResult; empty if it was completed.
+        """
+        rel_path = self._get_rel_path(rstx_file_path)
+        if failures:
+            self.completed.discard(rel_path)
+            self.failed[rel_path] = failures
+        else:
+            self.completed.add(rel_path)
+            self.failed.pop(rel_path, None)
+
+        if time.time() - self._last_save_time >= self.save_interval:
+            self.save()
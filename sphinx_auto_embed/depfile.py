@@ -0,0 +1,98 @@
+import os
+
+from sphinx_auto_embed.utils import write_lines_if_changed
+
+
+# Appended to the path of each rst file to get the path of its dependency file
+DEPFILE_EXTENSION = '.d'
+
+
+def escape_depfile_path(path):
+    """
+    Escape a path for use in a dependency file, as read by Make and Ninja.
+
+    Parameters
+    ----------
+    path : str
+        The path.
+
+    Returns
+    -------
+    str
+        The path with spaces, '#', and '$' escaped.
+    """
+    return path.replace('\\', '/').replace(' ', '\\ ').replace('#', '\\#').replace('$', '$$')
+
+
+def get_depfile_lines(target_path, dependency_paths, output_paths, base_dir):
+    """
+    Get the lines of a dependency file, in the format written by 'gcc -MD -MP'.
+
+    The only target is the rst file, so that Ninja accepts the file for a build edge with the rst
+    file as its output. Other outputs, such as images, are listed as dependencies, with an empty
+    rule each, so that removing one makes Make and Ninja run sphinx_auto_embed again.
+
+    Parameters
+    ----------
+    target_path : str
+        Absolute path to the rst file.
+    dependency_paths : list of str
+        Absolute paths to the files the rst file was produced from.
+    output_paths : list of str
+        Absolute paths to the other files produced along with the rst file.
+    base_dir : str
+        Absolute path to the directory the paths in the file are relative to, i.e., the one the
+        build system runs sphinx_auto_embed from; paths outside of it are kept absolute.
+
+    Returns
+    -------
+    list of str
+        Lines of the dependency file, including end-of-line characters.
+    """
+    def get_path(abs_path):
+        rel_path = os.path.relpath(abs_path, base_dir)
+        if rel_path == '..' or rel_path.startswith('..' + os.sep):
+            return escape_depfile_path(abs_path)
+        return escape_depfile_path(rel_path)
+
+    lines = [get_path(target_path) + ':']
+    for dependency_path in list(dependency_paths) + list(output_paths):
+        lines[-1] += ' \\\n'
+        lines.append('  ' + get_path(dependency_path))
+    lines[-1] += '\n'
+
+    for output_path in output_paths:
+        lines.append('\n')
+        lines.append(get_path(output_path) + ':\n')
+    return lines
+
+
+def write_depfile(rst_file_path, dependency_paths, output_paths, base_dir):
+    """
+    Write the dependency file of an rst file next to it, if its contents changed.
+
+    The rst file is not rewritten when its contents would not change, and the manifest skips it
+    when its inputs were touched without changing, so its modification time is updated if any
+    of the files listed is newer; otherwise, Make and Ninja would consider it out of date on
+    every run.
+
+    Parameters
+    ----------
+    rst_file_path : str
+        Absolute path to the rst file; the dependency file has the same path with '.d' appended.
+    dependency_paths : list of str
+        Absolute paths to the files the rst file was produced from.
+    output_paths : list of str
+        Absolute paths to the other files produced along with the rst file.
+    base_dir : str
+        Absolute path to the directory the paths in the file are relative to.
+    """
+    write_lines_if_changed(
+        rst_file_path + DEPFILE_EXTENSION,
+        get_depfile_lines(rst_file_path, dependency_paths, output_paths, base_dir))
+
+    mtimes = [
+        os.path.getmtime(file_path) for file_path in list(dependency_paths) + list(output_paths)
+        if os.path.exists(file_path)]
+    if mtimes and os.path.exists(rst_file_path) and os.path.getmtime(rst_file_path) < max(mtimes):
+        os.utime(rst_file_path, None)
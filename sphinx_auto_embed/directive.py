@@ -1,5 +1,86 @@
+import os
+import re
+import sys
+import inspect
+import importlib
+import six
+
+from sphinx_auto_embed.utils import write_bytes_if_changed
+from sphinx_auto_embed.image_store import get_image_store
+from sphinx_auto_embed.execution import format_snippet_traceback
+
+
+# Matches a directive call anywhere in a line, capturing the directive name and the arguments.
+# Lines are dispatched by looking the name up in a dict, so the cost does not grow with the
+# number of directives.
+DIRECTIVE_PATTERN = re.compile(r'\.\.\s*([\w-]+)\s*::(.*)')
+
+
+# Map from (module name, class path) to the (class, instance) created by Directive.get_instance,
+# shared by all directives so that each object is only constructed once per process.
+_instances = {}
+
+
+def clear_instances(module_names=None):
+    """
+    Forget the instances created by Directive.get_instance, e.g., after modules are reloaded.
+
+    Parameters
+    ----------
+    module_names : iterable of str or None
+        Names of the modules whose classes' instances are forgotten, whether the classes were
+        requested from or are defined in them; None to forget every instance.
+    """
+    if module_names is None:
+        _instances.clear()
+        return
+
+    module_names = set(module_names)
+    for key, (cls, instance) in list(_instances.items()):
+        if key[0] in module_names or cls.__module__ in module_names:
+            del _instances[key]
+
+
+class EmbedError(Exception):
+    """
+    Error raised when a directive call fails, with the file name and line number in the message.
+
+    Attributes
+    ----------
+    reason : str
+        The message without the file name and line number.
+    """
+    reason = None
+
+
 class Directive(object):
 
+    # Map from the name of each keyword option the directive accepts, given as 'name=value'
+    # after the positional arguments, to the function converting its value from a string.
+    OPTIONS = {}
+
+    # File name the code executed by the current directive call was compiled with, as returned
+    # by get_snippet_file_path; None if the call has not executed code
+    snippet_file_path = None
+
+    def get_exception(self, msg):
+        """
+        Create the exception raised because a directive call was made incorrectly.
+
+        Parameters
+        ----------
+        msg : str
+            Descriptive error message to show in addition to the file name and line number.
+
+        Returns
+        -------
+        EmbedError
+            The exception.
+        """
+        error = EmbedError('In file {} line {}: {}'.format(self.file_path, self.iline + 1, msg))
+        error.reason = msg
+        return error
+
     def exception(self, msg):
         """
         Raise an exception because a directive call was made incorrectly.
@@ -9,9 +90,136 @@ class Directive(object):
         msg : str
             Descriptive error message to show in addition to the file name and line number.
         """
-        raise Exception('In file {} line {}: {}'.format(self.file_path, self.iline + 1, msg))
+        raise self.get_exception(msg)
+
+    def add_dependency(self, module):
+        """
+        Record that the output of the current directive call depends on the given module.
+
+        Parameters
+        ----------
+        module : module
+            Module whose source was read or executed to produce the output.
+        """
+        try:
+            source_path = inspect.getsourcefile(module)
+        except TypeError:
+            # Built-in modules have no source file to track.
+            return
+
+        if source_path is not None:
+            self.dependencies[module.__name__] = os.path.abspath(source_path)
+
+    def resolve(self, module_name, attribute_path):
+        """
+        Import a module and get an object from it, recording the dependencies of the output.
+
+        Parameters
+        ----------
+        module_name : str
+            Name of the module, e.g., 'package.module'.
+        attribute_path : str
+            Name of the object within the module, which may be dotted, e.g., 'Class.method'.
+
+        Returns
+        -------
+        object
+            The object.
+        """
+        module = importlib.import_module(module_name)
+        self.add_dependency(module)
+
+        obj = module
+        for attribute_name in attribute_path.split('.'):
+            obj = getattr(obj, attribute_name)
+
+        # The object may be defined in another module than the one it is imported from
+        defining_module = sys.modules.get(getattr(obj, '__module__', None) or '')
+        if defining_module is not None and defining_module is not module:
+            self.add_dependency(defining_module)
+
+        return obj
+
+    def get_instance(self, module_name, class_path):
+        """
+        Get an instance of a class, constructing it only the first time it is requested.
+
+        Instances are shared by all directives, so reference pages rendering many tables from
+        the same object construct it once. An instance is constructed again if the class was
+        reloaded since.
+
+        Parameters
+        ----------
+        module_name : str
+            Name of the module, e.g., 'package.module'.
+        class_path : str
+            Name of the class within the module, which may be dotted, e.g., 'Outer.Inner'.
+
+        Returns
+        -------
+        object
+            The instance, constructed without arguments.
+        """
+        cls = self.resolve(module_name, class_path)
+
+        key = (module_name, class_path)
+        cached = _instances.get(key)
+        if cached is None or cached[0] is not cls:
+            cached = (cls, cls())
+            _instances[key] = cached
+
+        return cached[1]
+
+    def write_image(self, file_dir, rel_image_path, data):
+        """
+        Write an image produced by the current directive call and record it as an output.
+
+        Without an image store, the image is written at the given path. With one, the image is
+        added to the store, linked to from the given path, and referenced by its path in the
+        store, so identical images embedded in several documents are only stored once.
+
+        Parameters
+        ----------
+        file_dir : str
+            Absolute path to the directory containing the rstx file being parsed.
+        rel_image_path : str
+            Path of the image relative to that directory, if there is no image store.
+        data : bytes
+            Contents of the image.
+
+        Returns
+        -------
+        str
+            Path relative to file_dir by which the document should reference the image.
+        """
+        abs_image_path = file_dir + '/' + rel_image_path
+
+        image_store = get_image_store()
+        if image_store is None:
+            write_bytes_if_changed(abs_image_path, data)
+            self.add_output(abs_image_path)
+            return rel_image_path
+
+        store_path = image_store.add(data, os.path.splitext(rel_image_path)[1][1:])
+        image_store.link(store_path, abs_image_path, data)
+        self.add_output(store_path)
+        if image_store.link_mode != 'none':
+            self.add_output(abs_image_path)
 
-    def __call__(self, file_dir, file_name, iline, line):
+        return os.path.relpath(store_path, file_dir).replace(os.sep, '/')
+
+    def add_output(self, abs_path):
+        """
+        Record that the current directive call wrote a file other than the rst file.
+
+        Parameters
+        ----------
+        abs_path : str
+            Absolute path to the file that was written.
+        """
+        self.outputs.append(abs_path)
+
+    def __call__(self, file_dir, file_name, iline, line, match=None):
         """
         Perform the task associated with the current directives.
 
@@ -29,6 +237,8 @@ class Directive(object):
         line : str
             A single string representing the raw line from the rstx file.
             This contains leading spaces and the end-of-line character, '\n'.
+        match : re.MatchObject or None
+            Match of DIRECTIVE_PATTERN in the line, if already computed by the caller.
 
         Returns
         -------
@@ -38,26 +248,50 @@ class Directive(object):
         self.file_path = file_path = file_dir + '/' + file_name
         self.iline = iline
 
+        # The directive's own module is always a dependency of its output
+        self.dependencies = {}
+        self.outputs = []
+        self.snippet_file_path = None
+        self.add_dependency(sys.modules[type(self).__module__])
+
+        if match is None:
+            match = DIRECTIVE_PATTERN.search(line)
+
         # Compute indentation
-        embed_num_indent = line.find('.. %s' % self.NAME)
+        embed_num_indent = match.start()
 
         # Make sure there are no characters before the directive call
         if line[:embed_num_indent] != ' ' * embed_num_indent:
             self.exception('there should only be white spaces before the directive.')
 
-        # Remove spaces and newline character
-        stripped_line = line.replace(' ', '').replace('\n', '')
-
-        # Split out directive and args
-        split_line = stripped_line.split('::')
-        if len(split_line) > 2:
+        # Split out args
+        args_string = match.group(2).strip()
+        if '::' in args_string:
             self.exception('"::" should only appear once.')
 
         # Read args
-        if split_line[1] == '':
+        if args_string == '':
             args = []
         else:
-            args = split_line[1].split(',')
+            args = [arg.strip() for arg in args_string.split(',')]
+
+        # Separate keyword options from positional args
+        options = {}
+        positional_args = []
+        for arg in args:
+            if '=' not in arg:
+                positional_args.append(arg)
+                continue
+
+            name, value = [part.strip() for part in arg.split('=', 1)]
+            if name not in self.OPTIONS:
+                self.exception('unknown option "{}" for directive "{}".'.format(name, self.NAME))
+            try:
+                options[name] = self.OPTIONS[name](value)
+            except ValueError as e:
+                self.exception('invalid value "{}" for option "{}": {}'.format(value, name, e))
+        args = positional_args
+        self.options = options
 
         # Get number of arguments
         num_args = len(args)
@@ -66,4 +300,17 @@ class Directive(object):
                 'there should be {} arguments for directive "{}", separated by commas.'.format(
                     self.NUM_ARGS, self.NAME))
 
-        return self.run(file_dir, file_name, embed_num_indent, args)
+        try:
+            return self.run(file_dir, file_name, embed_num_indent, args)
+        except EmbedError:
+            raise
+        except Exception as e:
+            # Errors from the embedded code itself get the same file and line context, and the
+            # frames of that code, leaving out those of sphinx_auto_embed
+            msg = '{}: {}'.format(type(e).__name__, e)
+            if self.snippet_file_path is not None:
+                snippet_traceback = format_snippet_traceback(
+                    sys.exc_info()[2], self.snippet_file_path)
+                if snippet_traceback:
+                    msg += '\n' + snippet_traceback
+            six.raise_from(self.get_exception(msg), None)
@@ -1,17 +1,14 @@
-import os, sys
+import os
 import inspect
 import importlib
-import contextlib
-try:
-    from StringIO import StringIO
-except:
-    from io import StringIO
-
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 
 from sphinx_auto_embed.directive import Directive
+from sphinx_auto_embed.execution import stdoutIO, execute_snippet, get_plot_options, \
+    get_print_options, get_snippet_file_path, PLOT_OPTIONS, PRINT_OPTIONS, Session, \
+    set_session, get_session
+from sphinx_auto_embed.source_index import get_source_index, get_code_options, \
+    get_literalinclude_lines, CODE_OPTIONS
+from sphinx_auto_embed.profiling import profiled, profile_phase
 
 
 class BaseDirectiveEmbedModule(Directive):
@@ -19,25 +16,52 @@ class BaseDirectiveEmbedModule(Directive):
     Directive for embedding all the code from a module and optionally the print output and plot.
     """
 
-    @contextlib.contextmanager
-    def stdoutIO(self, stdout=None):
-        old = sys.stdout
-        if stdout is None:
-            stdout = StringIO()
-        sys.stdout = stdout
-        yield stdout
-        sys.stdout = old
+    stdoutIO = staticmethod(stdoutIO)
+
+    # (source file path, span or None) of the code returned by the last call of get_method_lines,
+    # for referencing it instead of copying it; None if it cannot be referenced
+    source_reference = None
 
+    @profiled('source')
     def get_method_lines(self, args):
         py_file_path = args
 
         py_module = importlib.import_module(py_file_path)
+        self.add_dependency(py_module)
 
-        method_lines = inspect.getsource(py_module).split('\n')
+        source_index = get_source_index(py_module)
+        if source_index is not None:
+            method_lines = list(source_index.lines)
+            self.source_reference = (source_index.file_path, None)
+        else:
+            method_lines = inspect.getsource(py_module).split('\n')
+            self.source_reference = None
 
         return method_lines
 
+    def get_source_location(self):
+        """
+        Get where the code returned by the last call of get_method_lines starts in its file.
+
+        Returns
+        -------
+        (str, int) or None
+            Absolute path to the source file and index of the first line of the code in it, as
+            passed to compile_snippet; None if the code cannot be referenced.
+        """
+        if self.source_reference is None:
+            return None
+
+        file_path, span = self.source_reference
+        return file_path, span[0] if span is not None else 0
+
     def get_code_block(self, embed_num_indent, method_lines):
+        if get_code_options(self.options)['code'] == 'include' \
+                and self.source_reference is not None:
+            file_path, span = self.source_reference
+            return get_literalinclude_lines(
+                embed_num_indent, os.path.dirname(self.file_path), file_path, span)
+
         lines = []
         lines.append(' ' * embed_num_indent + '.. code-block:: python\n')
         lines.append('\n')
@@ -47,12 +71,28 @@ class BaseDirectiveEmbedModule(Directive):
         ])
         return lines
 
-    def get_print_block(self, embed_num_indent, method_lines):
-        joined_method_lines = '\n'.join(method_lines)
-        with self.stdoutIO() as s:
-            exec(joined_method_lines)
-
-        output_lines = s.getvalue().split('\n')
+    def execute(self, method_lines, plot=False):
+        """
+        Execute the code once, capturing the print output and, if requested, the plot.
+
+        The result can be passed to both get_print_block and get_plot_block so that directives
+        embedding both only run the code a single time. The plot and print options given in
+        the directive call, if any, override the defaults. The project modules loaded when
+        the code ran are recorded as dependencies, since the code may import them itself.
+        """
+        source_location = self.get_source_location()
+        self.snippet_file_path = get_snippet_file_path(source_location)
+        result = execute_snippet(
+            method_lines, plot, get_plot_options(self.options) if plot else None,
+            get_print_options(self.options), source_location)
+        self.dependencies.update(result.modules or {})
+        return result
+
+    def get_print_block(self, embed_num_indent, method_lines, result=None):
+        if result is None:
+            result = self.execute(method_lines)
+
+        output_lines = result.stdout.split('\n')
 
         lines = []
         if len(output_lines) > 1:
@@ -64,22 +104,27 @@ class BaseDirectiveEmbedModule(Directive):
             ])
         return lines
 
-    def get_plot_block(self, embed_num_indent, method_lines, file_dir, file_name, size):
-        joined_method_lines = '\n'.join(method_lines)
-        plt.close()
-        plt.figure(figsize=(8, 6))
-        with self.stdoutIO() as s:
-            exec(joined_method_lines)
-
-        rel_plot_name = '{}.png'.format(file_name[:-5])
+    def get_plot_block(self, embed_num_indent, method_lines, file_dir, file_name, size,
+            result=None):
+        if result is None:
+            result = self.execute(method_lines, plot=True)
 
-        abs_plot_name = file_dir + '/' + rel_plot_name
-        plt.savefig(abs_plot_name)
+        plot_name = file_name[:-5]
 
+        # The first figure keeps the original name; any others are numbered from 2
         lines = []
-        lines.append(' ' * embed_num_indent + '.. figure:: {}\n'.format(rel_plot_name))
-        lines.append(' ' * embed_num_indent + '  :scale: {} %\n'.format(size))
-        lines.append(' ' * embed_num_indent + '  :align: center\n')
+        for ifigure, figure in enumerate(result.figures):
+            rel_plot_name = '{}{}.{}'.format(
+                plot_name, '_{}'.format(ifigure + 1) if ifigure else '', result.figure_format)
+
+            with profile_phase('write'):
+                rel_plot_name = self.write_image(file_dir, rel_plot_name, figure)
+
+            if ifigure:
+                lines.append('\n')
+            lines.append(' ' * embed_num_indent + '.. figure:: {}\n'.format(rel_plot_name))
+            lines.append(' ' * embed_num_indent + '  :scale: {} %\n'.format(size))
+            lines.append(' ' * embed_num_indent + '  :align: center\n')
         return lines
 
 
@@ -87,6 +132,7 @@ class DirectiveEmbedModule(BaseDirectiveEmbedModule):
 
     NAME = 'embed-module'
     NUM_ARGS = 1
+    OPTIONS = CODE_OPTIONS
 
     def run(self, file_dir, file_name, embed_num_indent, args):
         method_lines = self.get_method_lines(args[0])
@@ -98,6 +144,7 @@ class DirectiveEmbedModulePrint(BaseDirectiveEmbedModule):
 
     NAME = 'embed-module-print'
     NUM_ARGS = 1
+    OPTIONS = dict(CODE_OPTIONS, **PRINT_OPTIONS)
 
     def run(self, file_dir, file_name, embed_num_indent, args):
         method_lines = self.get_method_lines(args[0])
@@ -111,6 +158,7 @@ class DirectiveEmbedModulePlot(BaseDirectiveEmbedModule):
 
     NAME = 'embed-module-plot'
     NUM_ARGS = 2
+    OPTIONS = dict(CODE_OPTIONS, **PLOT_OPTIONS)
 
     def run(self, file_dir, file_name, embed_num_indent, args):
         method_lines = self.get_method_lines(args[0])
@@ -124,13 +172,15 @@ class DirectiveEmbedModulePrintPlot(BaseDirectiveEmbedModule):
 
     NAME = 'embed-module-print-plot'
     NUM_ARGS = 2
+    OPTIONS = dict(CODE_OPTIONS, **dict(PLOT_OPTIONS, **PRINT_OPTIONS))
 
     def run(self, file_dir, file_name, embed_num_indent, args):
         method_lines = self.get_method_lines(args[0])
+        result = self.execute(method_lines, plot=True)
         lines = []
         lines.extend(self.get_code_block(embed_num_indent, method_lines))
-        lines.extend(self.get_print_block(embed_num_indent, method_lines))
-        lines.extend(self.get_plot_block(embed_num_indent, method_lines, file_dir, file_name, args[1]))
+        lines.extend(self.get_print_block(embed_num_indent, method_lines, result))
+        lines.extend(self.get_plot_block(embed_num_indent, method_lines, file_dir, file_name, args[1], result))
         return lines
 
 
@@ -138,11 +188,36 @@ class DirectiveEmbedModulePlotPrint(BaseDirectiveEmbedModule):
 
     NAME = 'embed-module-plot-print'
     NUM_ARGS = 2
+    OPTIONS = dict(CODE_OPTIONS, **dict(PLOT_OPTIONS, **PRINT_OPTIONS))
 
     def run(self, file_dir, file_name, embed_num_indent, args):
         method_lines = self.get_method_lines(args[0])
+        result = self.execute(method_lines, plot=True)
         lines = []
         lines.extend(self.get_code_block(embed_num_indent, method_lines))
-        lines.extend(self.get_plot_block(embed_num_indent, method_lines, file_dir, file_name, args[1]))
-        lines.extend(self.get_print_block(embed_num_indent, method_lines))
+        lines.extend(self.get_plot_block(embed_num_indent, method_lines, file_dir, file_name, args[1], result))
+        lines.extend(self.get_print_block(embed_num_indent, method_lines, result))
         return lines
+
+
+class DirectiveEmbedModuleSetup(BaseDirectiveEmbedModule):
+    """
+    Directive running the code of a module at the start of the document's session, without
+    embedding it.
+
+    The argument is the module name. The following directives of the document that execute
+    code share a namespace in which the setup code has run.
+    """
+
+    NAME = 'embed-module-setup'
+    NUM_ARGS = 1
+
+    def run(self, file_dir, file_name, embed_num_indent, args):
+        method_lines = self.get_method_lines(args[0])
+
+        session = get_session()
+        if session is None:
+            session = Session()
+            set_session(session)
+        session.add(method_lines, executed=False, source_location=self.get_source_location())
+        return []
@@ -0,0 +1,19 @@
+from sphinx_auto_embed.directive import Directive
+from sphinx_auto_embed.execution import Session, set_session
+
+
+class DirectiveEmbedSession(Directive):
+    """
+    Directive starting a session for the rest of the document, without embedding anything.
+
+    The following directives of the document that execute code share a namespace, so that
+    each example can use the variables defined by the ones before it. Their print output and
+    figures are still captured separately.
+    """
+
+    NAME = 'embed-session'
+    NUM_ARGS = 0
+
+    def run(self, file_dir, file_name, embed_num_indent, args):
+        set_session(Session())
+        return []
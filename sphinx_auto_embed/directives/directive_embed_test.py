@@ -1,17 +1,13 @@
 import os, sys
 import inspect
-import importlib
-import contextlib
-try:
-    from StringIO import StringIO
-except:
-    from io import StringIO
-
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 
 from sphinx_auto_embed.directive import Directive
+from sphinx_auto_embed.execution import stdoutIO, execute_snippet, get_plot_options, \
+    get_print_options, get_snippet_file_path, PLOT_OPTIONS, PRINT_OPTIONS, Session, \
+    set_session, get_session
+from sphinx_auto_embed.source_index import get_source_index, get_code_options, \
+    get_literalinclude_lines, CODE_OPTIONS
+from sphinx_auto_embed.profiling import profiled, profile_phase
 
 
 class BaseDirectiveEmbedTest(Directive):
@@ -21,21 +17,32 @@ class BaseDirectiveEmbedTest(Directive):
     The 3 arguments are the module name, class name, and method name.
     """
 
-    @contextlib.contextmanager
-    def stdoutIO(self, stdout=None):
-        old = sys.stdout
-        if stdout is None:
-            stdout = StringIO()
-        sys.stdout = stdout
-        yield stdout
-        sys.stdout = old
+    stdoutIO = staticmethod(stdoutIO)
+
+    # (source file path, span or None) of the code returned by the last call of get_method_lines,
+    # for referencing it instead of copying it; None if it cannot be referenced
+    source_reference = None
 
+    @profiled('source')
     def get_method_lines(self, args):
         py_file_path, class_name, method_name = args
 
-        py_module = importlib.import_module(py_file_path)
+        obj = self.resolve(py_file_path, class_name)
+
+        # Serve the body from the parsed source of the module defining the class, if possible
+        obj_module = sys.modules[obj.__module__]
+        source_index = get_source_index(obj_module)
+        if source_index is not None:
+            qualified_name = '{}.{}'.format(
+                getattr(obj, '__qualname__', obj.__name__), method_name)
+            span = source_index.get_body_span(qualified_name)
+            if span is not None:
+                self.source_reference = (source_index.file_path, span)
+                return source_index.get_body_lines(qualified_name)
+
+        self.source_reference = None
 
-        obj = getattr(py_module, class_name)
+        # Otherwise, e.g., for an inherited method, fall back on inspect
         method = getattr(obj, method_name)
 
         method_lines = inspect.getsource(method).split('\n')
@@ -53,7 +60,29 @@ class BaseDirectiveEmbedTest(Directive):
 
         return method_lines
 
+    def get_source_location(self):
+        """
+        Get where the code returned by the last call of get_method_lines starts in its file.
+
+        Returns
+        -------
+        (str, int) or None
+            Absolute path to the source file and index of the first line of the code in it, as
+            passed to compile_snippet; None if the code cannot be referenced.
+        """
+        if self.source_reference is None:
+            return None
+
+        file_path, span = self.source_reference
+        return file_path, span[0] if span is not None else 0
+
     def get_code_block(self, embed_num_indent, method_lines):
+        if get_code_options(self.options)['code'] == 'include' \
+                and self.source_reference is not None:
+            file_path, span = self.source_reference
+            return get_literalinclude_lines(
+                embed_num_indent, os.path.dirname(self.file_path), file_path, span)
+
         lines = []
         lines.append(' ' * embed_num_indent + '.. code-block:: python\n')
         lines.append('\n')
@@ -63,12 +92,28 @@ class BaseDirectiveEmbedTest(Directive):
         ])
         return lines
 
-    def get_print_block(self, embed_num_indent, method_lines):
-        joined_method_lines = '\n'.join(method_lines)
-        with self.stdoutIO() as s:
-            exec(joined_method_lines)
-
-        output_lines = s.getvalue().split('\n')
+    def execute(self, method_lines, plot=False):
+        """
+        Execute the code once, capturing the print output and, if requested, the plot.
+
+        The result can be passed to both get_print_block and get_plot_block so that directives
+        embedding both only run the code a single time. The plot and print options given in
+        the directive call, if any, override the defaults. The project modules loaded when
+        the code ran are recorded as dependencies, since the code may import them itself.
+        """
+        source_location = self.get_source_location()
+        self.snippet_file_path = get_snippet_file_path(source_location)
+        result = execute_snippet(
+            method_lines, plot, get_plot_options(self.options) if plot else None,
+            get_print_options(self.options), source_location)
+        self.dependencies.update(result.modules or {})
+        return result
+
+    def get_print_block(self, embed_num_indent, method_lines, result=None):
+        if result is None:
+            result = self.execute(method_lines)
+
+        output_lines = result.stdout.split('\n')
 
         lines = []
         if len(output_lines) > 1:
@@ -81,22 +126,26 @@ class BaseDirectiveEmbedTest(Directive):
         return lines
 
     def get_plot_block(self, embed_num_indent, method_lines, file_dir, file_name,
-            class_name, method_name, size):
-        joined_method_lines = '\n'.join(method_lines)
-        plt.close()
-        plt.figure(figsize=(8, 6))
-        with self.stdoutIO() as s:
-            exec(joined_method_lines)
-
-        rel_plot_name = '{}_{}_{}.png'.format(file_name[:-5], class_name, method_name)
+            class_name, method_name, size, result=None):
+        if result is None:
+            result = self.execute(method_lines, plot=True)
 
-        abs_plot_name = file_dir + '/' + rel_plot_name
-        plt.savefig(abs_plot_name)
+        plot_name = '{}_{}_{}'.format(file_name[:-5], class_name, method_name)
 
+        # The first figure keeps the original name; any others are numbered from 2
         lines = []
-        lines.append(' ' * embed_num_indent + '.. figure:: {}\n'.format(rel_plot_name))
-        lines.append(' ' * embed_num_indent + '  :scale: {} %\n'.format(size))
-        lines.append(' ' * embed_num_indent + '  :align: center\n')
+        for ifigure, figure in enumerate(result.figures):
+            rel_plot_name = '{}{}.{}'.format(
+                plot_name, '_{}'.format(ifigure + 1) if ifigure else '', result.figure_format)
+
+            with profile_phase('write'):
+                rel_plot_name = self.write_image(file_dir, rel_plot_name, figure)
+
+            if ifigure:
+                lines.append('\n')
+            lines.append(' ' * embed_num_indent + '.. figure:: {}\n'.format(rel_plot_name))
+            lines.append(' ' * embed_num_indent + '  :scale: {} %\n'.format(size))
+            lines.append(' ' * embed_num_indent + '  :align: center\n')
         return lines
 
 
@@ -104,6 +153,7 @@ class DirectiveEmbedTest(BaseDirectiveEmbedTest):
 
     NAME = 'embed-test'
     NUM_ARGS = 3
+    OPTIONS = CODE_OPTIONS
 
     def run(self, file_dir, file_name, embed_num_indent, args):
         method_lines = self.get_method_lines(args)
@@ -115,6 +165,7 @@ class DirectiveEmbedPlot(BaseDirectiveEmbedTest):
 
     NAME = 'embed-plot'
     NUM_ARGS = 4
+    OPTIONS = PLOT_OPTIONS
 
     def run(self, file_dir, file_name, embed_num_indent, args):
         method_lines = self.get_method_lines(args[:3])
@@ -126,6 +177,7 @@ class DirectiveEmbedTestPrint(BaseDirectiveEmbedTest):
 
     NAME = 'embed-test-print'
     NUM_ARGS = 3
+    OPTIONS = dict(CODE_OPTIONS, **PRINT_OPTIONS)
 
     def run(self, file_dir, file_name, embed_num_indent, args):
         method_lines = self.get_method_lines(args)
@@ -139,6 +191,7 @@ class DirectiveEmbedTestPlot(BaseDirectiveEmbedTest):
 
     NAME = 'embed-test-plot'
     NUM_ARGS = 4
+    OPTIONS = dict(CODE_OPTIONS, **PLOT_OPTIONS)
 
     def run(self, file_dir, file_name, embed_num_indent, args):
         method_lines = self.get_method_lines(args[:3])
@@ -152,13 +205,15 @@ class DirectiveEmbedTestPrintPlot(BaseDirectiveEmbedTest):
 
     NAME = 'embed-test-print-plot'
     NUM_ARGS = 4
+    OPTIONS = dict(CODE_OPTIONS, **dict(PLOT_OPTIONS, **PRINT_OPTIONS))
 
     def run(self, file_dir, file_name, embed_num_indent, args):
         method_lines = self.get_method_lines(args[:3])
+        result = self.execute(method_lines, plot=True)
         lines = []
         lines.extend(self.get_code_block(embed_num_indent, method_lines))
-        lines.extend(self.get_print_block(embed_num_indent, method_lines))
-        lines.extend(self.get_plot_block(embed_num_indent, method_lines, file_dir, file_name, args[1], args[2], args[3]))
+        lines.extend(self.get_print_block(embed_num_indent, method_lines, result))
+        lines.extend(self.get_plot_block(embed_num_indent, method_lines, file_dir, file_name, args[1], args[2], args[3], result))
         return lines
 
 
@@ -166,11 +221,35 @@ class DirectiveEmbedTestPlotPrint(BaseDirectiveEmbedTest):
 
     NAME = 'embed-test-plot-print'
     NUM_ARGS = 4
+    OPTIONS = dict(CODE_OPTIONS, **dict(PLOT_OPTIONS, **PRINT_OPTIONS))
 
     def run(self, file_dir, file_name, embed_num_indent, args):
         method_lines = self.get_method_lines(args[:3])
+        result = self.execute(method_lines, plot=True)
         lines = []
         lines.extend(self.get_code_block(embed_num_indent, method_lines))
-        lines.extend(self.get_plot_block(embed_num_indent, method_lines, file_dir, file_name, args[1], args[2], args[3]))
-        lines.extend(self.get_print_block(embed_num_indent, method_lines))
+        lines.extend(self.get_plot_block(embed_num_indent, method_lines, file_dir, file_name, args[1], args[2], args[3], result))
+        lines.extend(self.get_print_block(embed_num_indent, method_lines, result))
         return lines
+
+
+class DirectiveEmbedTestSetup(BaseDirectiveEmbedTest):
+    """
+    Directive running test code at the start of the document's session, without embedding it.
+
+    The 3 arguments are the module name, class name, and method name. The following directives
+    of the document that execute code share a namespace in which the setup code has run.
+    """
+
+    NAME = 'embed-test-setup'
+    NUM_ARGS = 3
+
+    def run(self, file_dir, file_name, embed_num_indent, args):
+        method_lines = self.get_method_lines(args)
+
+        session = get_session()
+        if session is None:
+            session = Session()
+            set_session(session)
+        session.add(method_lines, executed=False, source_location=self.get_source_location())
+        return []
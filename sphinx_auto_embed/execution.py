@@ -0,0 +1,893 @@
+import os
+import sys
+import gc
+import ast
+import types
+import inspect
+import hashlib
+import importlib
+import tempfile
+import traceback
+import contextlib
+import collections
+from io import BytesIO
+import six
+try:
+    from StringIO import StringIO
+except:
+    from io import StringIO
+
+from sphinx_auto_embed.profiling import profile_phase
+
+
+# Cache of execution results used by execute_snippet, if enabled
+_execution_cache = None
+
+
+def set_execution_cache(execution_cache):
+    """
+    Set the cache used by execute_snippet in this process.
+
+    Parameters
+    ----------
+    execution_cache : ExecutionCache or None
+        The cache to use; None to disable caching.
+    """
+    global _execution_cache
+    _execution_cache = execution_cache
+
+
+def get_execution_cache():
+    """
+    Get the cache used by execute_snippet in this process.
+
+    Returns
+    -------
+    ExecutionCache or None
+        The cache in use; None if caching is disabled.
+    """
+    return _execution_cache
+
+
+# Backend that executes code for execute_snippet in another process, if enabled
+_executor = None
+
+
+def set_executor(executor):
+    """
+    Set the backend used by execute_snippet in this process.
+
+    Parameters
+    ----------
+    executor : object or None
+        Object with an execute method taking the same arguments as execute_snippet and returning
+        a SnippetResult, such as a ForkServerExecutor; None to execute code in this process.
+    """
+    global _executor
+    _executor = executor
+
+
+def get_executor():
+    """
+    Get the backend used by execute_snippet in this process.
+
+    Returns
+    -------
+    object or None
+        The backend in use; None if code is executed in this process.
+    """
+    return _executor
+
+
+# Plot options used when a directive does not set them
+_default_plot_options = {
+    'format': 'png',
+    'dpi': None,
+    'figsize': (8., 6.),
+}
+
+
+def parse_figsize(value):
+    """
+    Convert a figure size given as 'WIDTHxHEIGHT' in inches, e.g., '8x6', to a tuple.
+    """
+    sizes = value.lower().split('x')
+    if len(sizes) != 2:
+        raise ValueError('the figure size should be given as WIDTHxHEIGHT, e.g., 8x6')
+    return (float(sizes[0]), float(sizes[1]))
+
+
+def parse_figure_format(value):
+    """
+    Check that a figure format is one of those that can be embedded in the documentation.
+    """
+    value = value.lower()
+    if value not in ('png', 'svg', 'webp'):
+        raise ValueError('the figure format should be png, svg, or webp, not {}'.format(value))
+    return value
+
+
+# Keyword options accepted by plot directives, mapped to the functions converting their values
+PLOT_OPTIONS = {
+    'format': parse_figure_format,
+    'dpi': float,
+    'figsize': parse_figsize,
+}
+
+
+def set_default_plot_options(plot_options):
+    """
+    Set the plot options used in this process when a directive does not set them.
+
+    Parameters
+    ----------
+    plot_options : dict
+        Any of 'format' ('png', 'svg', or 'webp'), 'dpi' (float, or None for the matplotlib
+        default), and 'figsize' ((width, height) in inches).
+    """
+    _default_plot_options.update(plot_options)
+
+
+def get_plot_options(options):
+    """
+    Get the complete plot options for a directive call.
+
+    Parameters
+    ----------
+    options : dict
+        Plot options given in the directive call.
+
+    Returns
+    -------
+    dict
+        The given options, completed with the default plot options.
+    """
+    plot_options = dict(_default_plot_options)
+    plot_options.update(
+        (name, value) for name, value in options.items() if name in PLOT_OPTIONS)
+    return plot_options
+
+
+# Print options used when a directive does not set them; None means no limit
+_default_print_options = {
+    'head': None,
+    'tail': None,
+}
+
+
+def parse_line_count(value):
+    """
+    Convert a number of lines to an int, checking that it is not negative.
+    """
+    value = int(value)
+    if value < 0:
+        raise ValueError('the number of lines should not be negative')
+    return value
+
+
+# Keyword options accepted by print directives, mapped to the functions converting their values
+PRINT_OPTIONS = {
+    'head': parse_line_count,
+    'tail': parse_line_count,
+}
+
+
+def set_default_print_options(print_options):
+    """
+    Set the print options used in this process when a directive does not set them.
+
+    Parameters
+    ----------
+    print_options : dict
+        Any of 'head' and 'tail', the numbers of lines of print output to keep at the start and
+        at the end when the output is longer than both combined; None for no limit.
+    """
+    _default_print_options.update(print_options)
+
+
+def get_print_options(options):
+    """
+    Get the complete print options for a directive call.
+
+    Parameters
+    ----------
+    options : dict
+        Print options given in the directive call.
+
+    Returns
+    -------
+    dict
+        The given options, completed with the default print options.
+    """
+    print_options = dict(_default_print_options)
+    print_options.update(
+        (name, value) for name, value in options.items() if name in PRINT_OPTIONS)
+    return print_options
+
+
+# Root directory of the project being documented; None for the current working directory
+_project_dir = None
+
+
+def set_project_dir(project_dir):
+    """
+    Set the root directory of the project being documented in this process.
+
+    Parameters
+    ----------
+    project_dir : str or None
+        Absolute path to the directory; None for the current working directory.
+    """
+    global _project_dir
+    _project_dir = project_dir
+
+
+def get_project_dir():
+    """
+    Get the root directory of the project being documented in this process.
+
+    Returns
+    -------
+    str
+        Absolute path to the directory.
+    """
+    return _project_dir if _project_dir is not None else os.getcwd()
+
+
+def get_loaded_modules():
+    """
+    Get the names and source files of all modules loaded in this process.
+
+    Returns
+    -------
+    dict
+        Map from the name of each module with a source file to the absolute path to it.
+    """
+    modules = {}
+    for module_name, module in list(sys.modules.items()):
+        file_path = getattr(module, '__file__', None)
+        if file_path is None:
+            continue
+
+        file_path = os.path.abspath(file_path)
+        if file_path.endswith('.pyc'):
+            file_path = file_path[:-1]
+        modules[module_name] = file_path
+    return modules
+
+
+def get_loaded_module_paths():
+    """
+    Get the source files of all modules loaded in this process.
+
+    Returns
+    -------
+    list of str
+        Absolute paths to the source files.
+    """
+    return list(get_loaded_modules().values())
+
+
+def get_project_modules(modules=None):
+    """
+    Keep the modules of the project being documented, leaving out installed packages.
+
+    Parameters
+    ----------
+    modules : dict or None
+        Map from module names to source files, as returned by get_loaded_modules; None for the
+        modules loaded in this process.
+
+    Returns
+    -------
+    dict
+        The modules whose source file is under the project directory, other than __main__,
+        those of sphinx_auto_embed itself, and those installed in a virtualenv in the project.
+    """
+    if modules is None:
+        modules = get_loaded_modules()
+
+    project_prefix = get_project_dir() + os.sep
+    installed_prefixes = tuple(set(
+        os.path.abspath(prefix) + os.sep
+        for prefix in (sys.prefix, sys.exec_prefix, getattr(sys, 'base_prefix', sys.prefix))))
+    return dict(
+        (module_name, file_path) for module_name, file_path in modules.items()
+        if file_path.startswith(project_prefix) and not file_path.startswith(installed_prefixes)
+        and module_name != '__main__' and module_name.split('.')[0] != 'sphinx_auto_embed'
+    )
+
+
+def use_agg_backend():
+    """
+    Make matplotlib draw off-screen with the Agg backend, without importing it if not needed.
+
+    Setting MPLBACKEND applies whenever the code being executed first imports matplotlib.
+    """
+    if 'matplotlib' in sys.modules:
+        sys.modules['matplotlib'].use('Agg')
+    else:
+        os.environ['MPLBACKEND'] = 'Agg'
+
+
+class SnippetResult(object):
+    """
+    Everything captured from a single execution of a code snippet.
+    """
+
+    def __init__(self, stdout, figures, module_paths=None, figure_format='png', modules=None):
+        """
+        Parameters
+        ----------
+        stdout : str
+            Everything the code printed.
+        figures : list of bytes
+            Rendered images of every figure produced by the code; empty if no plot was requested.
+        module_paths : list of str or None
+            Source files of the modules loaded when the code ran, if it ran in another process;
+            None if it ran in this process.
+        figure_format : str
+            Image format of the figures, which is also their file extension.
+        modules : dict or None
+            Project modules loaded when the code ran, as returned by get_project_modules, which
+            the output depends on whether or not the code imported them itself; None if unknown.
+        """
+        self.stdout = stdout
+        self.figures = figures
+        self.module_paths = module_paths
+        self.figure_format = figure_format
+        self.modules = modules
+
+
+@contextlib.contextmanager
+def stdoutIO(stdout=None):
+    old = sys.stdout
+    if stdout is None:
+        stdout = StringIO()
+    sys.stdout = stdout
+    try:
+        yield stdout
+    finally:
+        sys.stdout = old
+
+
+# Number of bytes of print output held in memory before the rest is spooled to disk
+SPOOL_SIZE = 1024 * 1024
+
+
+class OutputCapture(object):
+    """
+    File-like object capturing print output in bounded memory.
+
+    Output is held in memory up to SPOOL_SIZE and written to a temporary file beyond that. When
+    the output is read back, it can be truncated to its first and last lines, with a line in
+    between saying how many lines were left out, so that very long logs neither fill the memory
+    nor the documentation.
+    """
+
+    def __init__(self, head=None, tail=None, spool_size=SPOOL_SIZE):
+        """
+        Parameters
+        ----------
+        head : int or None
+            Number of lines to keep at the start of truncated output.
+        tail : int or None
+            Number of lines to keep at the end of truncated output.
+        spool_size : int
+            Number of bytes held in memory before spooling to disk.
+        """
+        self.head = head
+        self.tail = tail
+        if six.PY2:
+            self._file = tempfile.SpooledTemporaryFile(max_size=spool_size, mode='w+')
+        else:
+            # Not the locale encoding, so that any output can be spooled to disk
+            self._file = tempfile.SpooledTemporaryFile(
+                max_size=spool_size, mode='w+', encoding='utf-8')
+
+    # Code that inspects sys.stdout sees the same attributes as on a regular text stream
+    @property
+    def encoding(self):
+        return getattr(self._file, 'encoding', None) or 'utf-8'
+
+    @property
+    def errors(self):
+        return getattr(self._file, 'errors', None) or 'strict'
+
+    def write(self, text):
+        self._file.write(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self._file.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return self._file.isatty()
+
+    def getvalue(self):
+        """
+        Read back the captured output.
+
+        Returns
+        -------
+        str
+            The output, truncated if it has more lines than head and tail combined.
+        """
+        self._file.seek(0)
+
+        if self.head is None and self.tail is None:
+            return self._file.read()
+
+        head = self.head or 0
+        tail = self.tail or 0
+
+        head_lines = []
+        tail_lines = collections.deque(maxlen=tail)
+        num_lines = 0
+        for line in self._file:
+            num_lines += 1
+            if len(head_lines) < head:
+                head_lines.append(line)
+            elif tail:
+                tail_lines.append(line)
+
+        num_elided_lines = num_lines - len(head_lines) - len(tail_lines)
+        if num_elided_lines == 0:
+            return ''.join(head_lines) + ''.join(tail_lines)
+
+        marker = '... [{} line{} elided] ...\n'.format(
+            num_elided_lines, 's' if num_elided_lines > 1 else '')
+        return ''.join(head_lines) + marker + ''.join(tail_lines)
+
+    def close(self):
+        """
+        Discard the captured output, deleting the temporary file if any.
+        """
+        self._file.close()
+
+
+def render_figure(figure, plot_options):
+    """
+    Render a matplotlib figure to bytes.
+
+    Parameters
+    ----------
+    figure : matplotlib.figure.Figure
+        The figure.
+    plot_options : dict
+        Complete plot options, as returned by get_plot_options.
+
+    Returns
+    -------
+    bytes
+        The rendered image.
+    """
+    kwargs = {}
+    if plot_options['dpi'] is not None:
+        kwargs['dpi'] = plot_options['dpi']
+    if plot_options['format'] == 'svg':
+        # Leave out the date so that unchanged figures render to identical bytes
+        kwargs['metadata'] = {'Date': None}
+
+    figure_bytes = BytesIO()
+    figure.savefig(figure_bytes, format=plot_options['format'], **kwargs)
+    return figure_bytes.getvalue()
+
+
+def render_figures(figures, plot_options):
+    """
+    Render matplotlib figures to bytes, one after another.
+
+    pyplot and the Agg backend share the font cache, rcParams, and the figure manager between
+    threads, so figures are not rendered concurrently.
+
+    Parameters
+    ----------
+    figures : list of matplotlib.figure.Figure
+        The figures.
+    plot_options : dict
+        Complete plot options, as returned by get_plot_options.
+
+    Returns
+    -------
+    list of bytes
+        The rendered images, in the same order.
+    """
+    return [render_figure(figure, plot_options) for figure in figures]
+
+
+def _get_code_names(code):
+    """
+    Get the names of the globals and attributes used by compiled code, including nested code.
+    """
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names.update(_get_code_names(constant))
+    return names
+
+
+def get_snippet_file_path(source_location):
+    """
+    Get the file name code is compiled with by compile_snippet.
+
+    Parameters
+    ----------
+    source_location : (str, int) or None
+        Location of the code in its source file, as passed to compile_snippet.
+
+    Returns
+    -------
+    str
+        The path to the source file, or '<string>' if the code is not read from a file.
+    """
+    return source_location[0] if source_location is not None else '<string>'
+
+
+def format_snippet_traceback(tb, file_path):
+    """
+    Format the frames of a traceback from the first one executing code of a snippet onward.
+
+    Parameters
+    ----------
+    tb : traceback
+        Traceback of an exception raised while a snippet ran.
+    file_path : str
+        File name the snippet was compiled with, as returned by get_snippet_file_path.
+
+    Returns
+    -------
+    str
+        The formatted frames, without a trailing newline; empty if no frame executes the code.
+    """
+    frames = traceback.extract_tb(tb)
+    for iframe, frame in enumerate(frames):
+        if frame[0] == file_path:
+            return 'Traceback (most recent call last):\n' + \
+                ''.join(traceback.format_list(frames[iframe:])).rstrip()
+    return ''
+
+
+def compile_snippet(method_lines, namespace, source_location=None):
+    """
+    Compile a code snippet, adding the globals it may expect to the namespace it will run in.
+
+    If the location of the code in its source file is given, the code is compiled with the path
+    to that file and the numbers of its lines there, so that tracebacks point at the real lines.
+
+    Snippets used to be executed in the globals of the directive modules, so existing code
+    may use the modules imported there without importing them itself: os, sys, inspect,
+    importlib, contextlib, StringIO, matplotlib, and matplotlib.pyplot as plt. Those are added
+    unless the namespace already defines them, with matplotlib only imported if the code uses
+    it.
+
+    Parameters
+    ----------
+    method_lines : list of str
+        Lines of code.
+    namespace : dict
+        Globals the code will be executed in.
+    source_location : (str, int) or None
+        Absolute path to the source file and index of the line of the file the code starts at;
+        None if the code is not read from a file.
+
+    Returns
+    -------
+    code
+        The compiled code.
+    """
+    file_path = get_snippet_file_path(source_location)
+    if source_location is None:
+        code = compile('\n'.join(method_lines), file_path, 'exec')
+    else:
+        tree = ast.parse('\n'.join(method_lines), file_path)
+        ast.increment_lineno(tree, source_location[1])
+        code = compile(tree, file_path, 'exec')
+
+    for name, value in [('os', os), ('sys', sys), ('inspect', inspect),
+                        ('importlib', importlib), ('contextlib', contextlib),
+                        ('StringIO', StringIO)]:
+        namespace.setdefault(name, value)
+
+    if not ('matplotlib' in namespace and 'plt' in namespace) \
+            and _get_code_names(code) & set(['matplotlib', 'plt']):
+        use_agg_backend()
+        import matplotlib
+        import matplotlib.pyplot as plt
+        namespace.setdefault('matplotlib', matplotlib)
+        namespace.setdefault('plt', plt)
+
+    return code
+
+
+class Session(object):
+    """
+    Namespace shared by the snippets executed for a single document, like a notebook kernel.
+
+    Each snippet sees the variables defined by the setup code and the snippets before it. The
+    code of the session is only executed when needed: snippets whose results come from the
+    execution cache are queued instead, and the queue is replayed, with its output discarded,
+    before the next snippet that actually has to run. A document whose snippets are all cached
+    therefore executes nothing, not even its setup code.
+    """
+
+    def __init__(self):
+        self.namespace = {'__name__': '__main__'}
+        # Digest of all the code of the session so far, which results depend on
+        self.key = hashlib.sha1().hexdigest()
+        self._pending_lines = []
+
+    def add(self, method_lines, executed, source_location=None):
+        """
+        Add code to the session.
+
+        Parameters
+        ----------
+        method_lines : list of str
+            Lines of code.
+        executed : bool
+            Whether the code was executed in the namespace already; otherwise, it is executed
+            before the next snippet that runs.
+        source_location : (str, int) or None
+            Location of the code in its source file, as passed to compile_snippet.
+        """
+        hasher = hashlib.sha1(self.key.encode('utf-8'))
+        hasher.update('\n'.join(method_lines).encode('utf-8'))
+        self.key = hasher.hexdigest()
+
+        if not executed:
+            self._pending_lines.append((method_lines, source_location))
+
+    def replay(self):
+        """
+        Execute the queued code in the namespace, discarding its print output.
+        """
+        with profile_phase('session replay'):
+            while self._pending_lines:
+                method_lines, source_location = self._pending_lines.pop(0)
+                code = compile_snippet(method_lines, self.namespace, source_location)
+                capture = OutputCapture()
+                try:
+                    with stdoutIO(capture):
+                        exec(code, self.namespace)
+                finally:
+                    capture.close()
+
+
+# Session of the document being processed in this process; None if its snippets are independent
+_session = None
+
+
+def set_session(session):
+    """
+    Set the session in which execute_snippet executes code in this process.
+
+    Parameters
+    ----------
+    session : Session or None
+        The session; None to execute each snippet in a fresh namespace.
+    """
+    global _session
+    _session = session
+
+
+def get_session():
+    """
+    Get the session in which execute_snippet executes code in this process.
+
+    Returns
+    -------
+    Session or None
+        The session; None if each snippet is executed in a fresh namespace.
+    """
+    return _session
+
+
+# Number of snippets executed in this process since the last full garbage collection
+_num_uncollected_snippets = 0
+
+# Number of snippets executed in this process so far
+_num_executed_snippets = 0
+
+
+def get_num_executed_snippets():
+    """
+    Get the number of snippets executed in this process so far, in any namespace.
+
+    Returns
+    -------
+    int
+        The number of snippets; code executed by an executor in another process is not counted.
+    """
+    return _num_executed_snippets
+
+
+def release_snippet_memory(namespace=None):
+    """
+    Release what a snippet that just ran left behind: its figures, namespace, and young garbage.
+
+    Parameters
+    ----------
+    namespace : dict or None
+        Globals the snippet ran in, which are cleared, breaking the reference cycles between
+        them and the functions and classes the snippet defined; None to keep them.
+    """
+    global _num_uncollected_snippets, _num_executed_snippets
+
+    # Snippets that do not request a plot may still have opened figures
+    if 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].close('all')
+
+    if namespace is not None:
+        namespace.clear()
+
+    # A full collection takes milliseconds once matplotlib is loaded, so it is left to
+    # collect_snippet_garbage, and only the young generations are collected here.
+    gc.collect(1)
+    _num_uncollected_snippets += 1
+    _num_executed_snippets += 1
+
+
+def collect_snippet_garbage():
+    """
+    Run a full garbage collection if any snippet ran in this process since the last one.
+
+    This is done after each document, rather than after each snippet, to keep its cost low.
+    """
+    global _num_uncollected_snippets
+
+    if _num_uncollected_snippets:
+        gc.collect()
+        _num_uncollected_snippets = 0
+
+
+def run_snippet(method_lines, plot=False, plot_options=None, print_options=None,
+                namespace=None, source_location=None):
+    """
+    Execute a code snippet in this process, capturing its print output and, optionally, its plot.
+
+    Parameters
+    ----------
+    method_lines : list of str
+        Lines of code to execute.
+    plot : bool
+        Whether to set up a new figure before executing and render every figure afterwards.
+    plot_options : dict or None
+        Complete plot options, as returned by get_plot_options; None for the defaults.
+    print_options : dict or None
+        Complete print options, as returned by get_print_options; None for the defaults.
+    namespace : dict or None
+        Globals to execute the code in, which it may modify; None for a fresh namespace.
+    source_location : (str, int) or None
+        Location of the code in its source file, as passed to compile_snippet.
+
+    Returns
+    -------
+    SnippetResult
+        The captured print output and rendered figures.
+    """
+    if plot_options is None:
+        plot_options = get_plot_options({})
+    if print_options is None:
+        print_options = get_print_options({})
+
+    # A namespace shared with other snippets is theirs to keep
+    owned_namespace = namespace is None
+    if owned_namespace:
+        namespace = {'__name__': '__main__'}
+
+    use_agg_backend()
+    try:
+        code = compile_snippet(method_lines, namespace, source_location)
+
+        if plot:
+            with profile_phase('figure setup'):
+                import matplotlib
+                import matplotlib.pyplot as plt
+                plt.close('all')
+                # Makes the ids in SVG files deterministic
+                matplotlib.rcParams['svg.hashsalt'] = 'sphinx_auto_embed'
+                default_figure = plt.figure(figsize=plot_options['figsize'])
+
+        capture = OutputCapture(print_options['head'], print_options['tail'])
+        try:
+            with profile_phase('exec'), stdoutIO(capture):
+                exec(code, namespace)
+            stdout = capture.getvalue()
+        finally:
+            capture.close()
+
+        figures = []
+        if plot:
+            open_figures = [plt.figure(number) for number in plt.get_fignums()]
+
+            # The figure created beforehand is left out if the code drew on its own figures
+            if len(open_figures) > 1 and default_figure in open_figures \
+                    and not default_figure.get_axes():
+                open_figures.remove(default_figure)
+
+            with profile_phase('savefig'):
+                figures = render_figures(open_figures, plot_options)
+    finally:
+        release_snippet_memory(namespace if owned_namespace else None)
+
+    return SnippetResult(
+        stdout, figures, figure_format=plot_options['format'], modules=get_project_modules())
+
+
+def execute_snippet(method_lines, plot=False, plot_options=None, print_options=None,
+                    source_location=None):
+    """
+    Execute a code snippet once, capturing its print output and, optionally, its plot.
+
+    If an execution cache is set and holds a valid result for the same code, that result is
+    returned without executing anything. If an executor is set, the code is executed by it
+    instead of in this process. If a session is set, the code is executed in its namespace,
+    always in this process, and cached results also depend on the code executed before it.
+
+    Parameters
+    ----------
+    method_lines : list of str
+        Lines of code to execute.
+    plot : bool
+        Whether to set up a new figure before executing and render every figure afterwards.
+    plot_options : dict or None
+        Complete plot options, as returned by get_plot_options; None for the defaults.
+    print_options : dict or None
+        Complete print options, as returned by get_print_options; None for the defaults.
+    source_location : (str, int) or None
+        Location of the code in its source file, as passed to compile_snippet.
+
+    Returns
+    -------
+    SnippetResult
+        The captured print output and rendered figures.
+    """
+    if plot_options is None:
+        plot_options = get_plot_options({})
+    if print_options is None:
+        print_options = get_print_options({})
+
+    if _execution_cache is not None:
+        key_options = [plot, sorted(plot_options.items()) if plot else None]
+        # Untruncated output has the same key as before truncation was an option
+        if print_options != {'head': None, 'tail': None}:
+            key_options.append(sorted(print_options.items()))
+        if _session is not None:
+            key_options.append(['session', _session.key])
+        key = _execution_cache.get_key(method_lines, *key_options)
+        with profile_phase('cache'):
+            entry = _execution_cache.load(key)
+        if entry is not None:
+            if _session is not None:
+                _session.add(method_lines, executed=False, source_location=source_location)
+            return SnippetResult(
+                entry['stdout'], entry['figures'], figure_format=plot_options['format'],
+                modules=entry['project_modules'])
+
+    if _session is not None:
+        # The namespace lives in this process, so the executor cannot be used
+        _session.replay()
+        try:
+            result = run_snippet(
+                method_lines, plot, plot_options, print_options, _session.namespace,
+                source_location)
+        finally:
+            _session.add(method_lines, executed=True)
+    elif _executor is not None:
+        with profile_phase('executor'):
+            result = _executor.execute(
+                method_lines, plot, plot_options, print_options, source_location)
+    else:
+        result = run_snippet(
+            method_lines, plot, plot_options, print_options, source_location=source_location)
+
+    if _execution_cache is not None:
+        with profile_phase('cache'):
+            _execution_cache.store(
+                key, result.stdout, result.figures, result.module_paths, result.modules)
+
+    return result
@@ -0,0 +1,108 @@
+import os
+
+from sphinx.util import logging
+
+from sphinx_auto_embed.utils import get_directives, read_embedrc, read_embedrc_config
+from sphinx_auto_embed.execution import set_execution_cache, set_executor, \
+    set_default_plot_options, set_default_print_options, set_project_dir
+from sphinx_auto_embed.directive import EmbedError
+from sphinx_auto_embed.main import EmbedResult, iter_embedded_lines, \
+    get_execution_cache_from_config, get_executor_from_config, get_plot_options_from_config, \
+    get_print_options_from_config, get_code_options_from_config, get_image_store_from_config
+from sphinx_auto_embed.source_index import set_default_code_options
+from sphinx_auto_embed.image_store import set_image_store
+
+
+logger = logging.getLogger(__name__)
+
+# Directive instances for the current process, loaded on first use; with 'sphinx-build -j',
+# every reader process loads its own.
+_directives_list = None
+
+
+def get_extension_directives(srcdir):
+    """
+    Load the directives and set the execution cache, executor, default plot, print, and code
+    options, image store, and project directory for the project, if not done already.
+
+    Parameters
+    ----------
+    srcdir : str
+        Absolute path to the Sphinx source directory, from which '.embedrc' is looked up.
+
+    Returns
+    -------
+    list of Directive
+        The directives available to the project.
+    """
+    global _directives_list
+
+    if _directives_list is None:
+        embedrc_dir, config = read_embedrc_config(srcdir)
+        set_project_dir(embedrc_dir or srcdir)
+        set_execution_cache(get_execution_cache_from_config(embedrc_dir, config))
+        set_executor(get_executor_from_config(config))
+        set_default_plot_options(get_plot_options_from_config(config))
+        set_default_print_options(get_print_options_from_config(config))
+        set_default_code_options(get_code_options_from_config(config))
+        set_image_store(get_image_store_from_config(embedrc_dir, config))
+        _directives_list = get_directives(read_embedrc(srcdir))
+
+    return _directives_list
+
+
+def on_source_read(app, docname, source):
+    """
+    Apply the directives to the source of an rstx document.
+
+    The modules the document depends on are reported to Sphinx, so editing one of them makes
+    Sphinx read the documents that embed it again. A failed directive call is reported as a
+    warning at its line, which is left unchanged, like Sphinx reports errors in its directives.
+    """
+    file_path = str(app.env.doc2path(docname))
+    if not file_path.endswith('.rstx'):
+        return
+
+    file_dir, file_name = os.path.split(file_path)
+    directives_list = get_extension_directives(str(app.srcdir))
+
+    result = EmbedResult(file_dir, file_name)
+    new_lines = []
+    try:
+        for new_line in iter_embedded_lines(
+                file_dir, file_name, directives_list, result, source[0].splitlines(True),
+                keep_going=True):
+            new_lines.append(new_line)
+    except EmbedError:
+        # Raised after every line was generated, once the failures are recorded in the result
+        pass
+    source[0] = ''.join(new_lines)
+
+    for failure in result.failures:
+        logger.warning(failure['error'], location=(docname, failure['line']))
+
+    for source_path in sorted(result.dependencies.values()):
+        app.env.note_dependency(source_path)
+
+
+def setup(app):
+    """
+    Set up the Sphinx extension that embeds content while Sphinx reads rstx files.
+
+    Instead of running sphinx_auto_embed before Sphinx to write rst files, add the extension in
+    conf.py::
+
+        extensions = ['sphinx_auto_embed.extension']
+
+    rstx files are then read by Sphinx directly, and the directives are applied to their source
+    in memory during the 'source-read' event. Plot images are still written next to the rstx
+    files, or to the image_store set in '.embedrc'.
+    """
+    app.add_source_suffix('.rstx', 'restructuredtext')
+    app.connect('source-read', on_source_read)
+
+    return {
+        'version': '0.1',
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
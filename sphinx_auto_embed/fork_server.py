@@ -0,0 +1,223 @@
+import os
+import sys
+import signal
+import importlib
+import multiprocessing
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from sphinx_auto_embed.execution import SnippetResult, run_snippet, use_agg_backend, \
+    get_loaded_modules, get_project_modules, get_plot_options, get_snippet_file_path, \
+    format_snippet_traceback
+
+
+class SnippetError(Exception):
+    """
+    Error raised when a code snippet fails, times out, or crashes in a fork server child.
+    """
+    pass
+
+
+def _run_child(conn, method_lines, plot, plot_options, print_options, source_location,
+               memory_limit):
+    """
+    Execute a snippet in a freshly forked child and send the outcome back to the server.
+    """
+    try:
+        if memory_limit is not None and resource is not None:
+            memory_limit_bytes = int(memory_limit * 1e6)
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit_bytes, memory_limit_bytes))
+
+        result = run_snippet(
+            method_lines, plot, plot_options, print_options, source_location=source_location)
+        message = ('ok', result.stdout, result.figures, get_loaded_modules())
+    except MemoryError:
+        message = ('error', 'MemoryError: exceeded the memory limit of {} MB'.format(memory_limit))
+    except BaseException as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+        snippet_traceback = format_snippet_traceback(
+            sys.exc_info()[2], get_snippet_file_path(source_location))
+        if snippet_traceback:
+            error += '\n' + snippet_traceback
+        message = ('error', error)
+
+    try:
+        conn.send(message)
+    finally:
+        conn.close()
+
+
+def _serve(conn, preload_modules, timeout, memory_limit):
+    """
+    Main loop of the fork server: preload modules once, then fork a child for each request.
+    """
+    use_agg_backend()
+    for module_name in preload_modules:
+        try:
+            importlib.import_module(module_name)
+        except ImportError:
+            pass
+
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            # The client went away
+            return
+
+        if request is None:
+            return
+
+        method_lines, plot, plot_options, print_options, source_location = request
+
+        read_conn, write_conn = multiprocessing.Pipe(duplex=False)
+        pid = os.fork()
+        if pid == 0:
+            read_conn.close()
+            conn.close()
+            try:
+                _run_child(
+                    write_conn, method_lines, plot, plot_options, print_options,
+                    source_location, memory_limit)
+            finally:
+                os._exit(0)
+
+        write_conn.close()
+
+        if read_conn.poll(timeout):
+            try:
+                message = read_conn.recv()
+            except EOFError:
+                message = None
+        else:
+            os.kill(pid, signal.SIGKILL)
+            message = ('error', 'TimeoutError: execution took longer than {} s'.format(timeout))
+
+        read_conn.close()
+        pid, status = os.waitpid(pid, 0)
+
+        if message is None:
+            message = ('error', 'the process executing the code crashed with status {}'.format(
+                status))
+
+        conn.send(message)
+
+
+class ForkServerExecutor(object):
+    """
+    Execute code snippets in forked children of a server process with heavy modules preloaded.
+
+    The server process imports the preloaded modules once. Each snippet then runs in a child
+    forked from it, which shares the already imported modules copy-on-write, so there is no
+    interpreter startup cost, but any globals, figures, and memory left behind by the snippet
+    disappear with the child. Each child is killed if it runs longer than the timeout, and its
+    address space is limited to the memory limit. Only available on POSIX systems.
+    """
+
+    def __init__(self, preload_modules=(), timeout=None, memory_limit=None):
+        """
+        Parameters
+        ----------
+        preload_modules : list of str
+            Names of the modules to import in the server; those that fail to import are skipped.
+        timeout : float or None
+            Number of seconds after which a snippet is killed; None for no limit.
+        memory_limit : float or None
+            Maximum address space of each child in MB; None for no limit.
+        """
+        self.preload_modules = list(preload_modules)
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self._conn = None
+        self._pid = None
+
+    def __getstate__(self):
+        # The server belongs to the process that started it; copies start their own.
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_pid'] = None
+        return state
+
+    def start(self):
+        """
+        Start the server process, if not already running.
+        """
+        if self._pid is not None:
+            return
+
+        # Flush so that buffered output is not written again by the forked processes
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        client_conn, server_conn = multiprocessing.Pipe()
+        pid = os.fork()
+        if pid == 0:
+            client_conn.close()
+            try:
+                _serve(server_conn, self.preload_modules, self.timeout, self.memory_limit)
+            finally:
+                os._exit(0)
+
+        server_conn.close()
+        self._conn = client_conn
+        self._pid = pid
+
+    def stop(self):
+        """
+        Stop the server process, if running.
+        """
+        if self._pid is None:
+            return
+
+        try:
+            self._conn.send(None)
+        except (IOError, OSError):
+            pass
+        self._conn.close()
+        os.waitpid(self._pid, 0)
+
+        self._conn = None
+        self._pid = None
+
+    def execute(self, method_lines, plot=False, plot_options=None, print_options=None,
+                source_location=None):
+        """
+        Execute a code snippet in a forked child, capturing its print output and plot.
+
+        Parameters
+        ----------
+        method_lines : list of str
+            Lines of code to execute.
+        plot : bool
+            Whether to set up a new figure before executing and render every figure afterwards.
+        plot_options : dict or None
+            Complete plot options, as returned by get_plot_options; None for the defaults.
+        print_options : dict or None
+            Complete print options, as returned by get_print_options; None for the defaults.
+        source_location : (str, int) or None
+            Location of the code in its source file, as passed to compile_snippet.
+
+        Returns
+        -------
+        SnippetResult
+            The captured print output and rendered figures.
+        """
+        if plot_options is None:
+            plot_options = get_plot_options({})
+
+        self.start()
+
+        self._conn.send(
+            (list(method_lines), plot, plot_options, print_options, source_location))
+        message = self._conn.recv()
+
+        if message[0] == 'error':
+            raise SnippetError(message[1])
+
+        status, stdout, figures, modules = message
+        return SnippetResult(
+            stdout, figures, list(modules.values()), plot_options['format'],
+            get_project_modules(modules))
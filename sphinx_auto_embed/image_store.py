@@ -0,0 +1,176 @@
+import os
+import re
+import hashlib
+
+from sphinx_auto_embed.utils import write_bytes_if_changed, get_output_checker
+
+
+# Matches the path of an image referenced by a figure or image directive in an rst file
+IMAGE_REFERENCE_PATTERN = re.compile(r'\.\.\s+(?:figure|image)\s*::\s*(\S+)')
+
+LINK_MODES = ('hardlink', 'symlink', 'none')
+
+
+class ImageStore(object):
+    """
+    Directory of images named after the hash of their contents.
+
+    The same figure embedded in several documents is stored once, and documents reference it
+    by a path that only changes when the image does. Each image can also be linked to from the
+    path it would have without the store, so that links to those paths keep working.
+    """
+
+    def __init__(self, store_dir, link_mode='hardlink'):
+        """
+        Parameters
+        ----------
+        store_dir : str
+            Absolute path to the directory of the store; created when the first image is added.
+        link_mode : str
+            How images are made available at their legacy paths: 'hardlink', 'symlink', or
+            'none'. Hard links fall back to symbolic links, and both to copies, where the file
+            system does not support them.
+        """
+        if link_mode not in LINK_MODES:
+            raise ValueError('the image store link mode should be one of {}, not {}'.format(
+                ', '.join(LINK_MODES), link_mode))
+
+        self.store_dir = os.path.normpath(store_dir)
+        self.link_mode = link_mode
+
+    def add(self, data, extension):
+        """
+        Add an image to the store, if not already there.
+
+        Parameters
+        ----------
+        data : bytes
+            Contents of the image.
+        extension : str
+            File extension of the image, without the dot.
+
+        Returns
+        -------
+        str
+            Absolute path to the image in the store.
+        """
+        file_path = '{}/{}.{}'.format(
+            self.store_dir, hashlib.sha1(data).hexdigest()[:20], extension)
+
+        if get_output_checker() is not None:
+            write_bytes_if_changed(file_path, data)
+        elif not os.path.isfile(file_path):
+            try:
+                os.makedirs(self.store_dir)
+            except OSError:
+                # Created by another process in the meantime
+                pass
+            write_bytes_if_changed(file_path, data)
+
+        return file_path
+
+    def link(self, store_path, legacy_path, data):
+        """
+        Make an image in the store available at its legacy path.
+
+        Parameters
+        ----------
+        store_path : str
+            Absolute path to the image in the store.
+        legacy_path : str
+            Absolute path the image would have without the store.
+        data : bytes
+            Contents of the image, written as a copy if links are not possible.
+        """
+        if self.link_mode == 'none':
+            return
+
+        if get_output_checker() is not None:
+            write_bytes_if_changed(legacy_path, data)
+            return
+
+        if os.path.lexists(legacy_path):
+            if os.path.exists(legacy_path) and os.path.samefile(legacy_path, store_path):
+                return
+            os.remove(legacy_path)
+
+        if self.link_mode == 'hardlink' and hasattr(os, 'link'):
+            try:
+                os.link(store_path, legacy_path)
+                return
+            except OSError:
+                pass
+
+        if hasattr(os, 'symlink'):
+            try:
+                os.symlink(
+                    os.path.relpath(store_path, os.path.dirname(legacy_path)), legacy_path)
+                return
+            except OSError:
+                pass
+
+        write_bytes_if_changed(legacy_path, data)
+
+    def collect_garbage(self, rst_file_paths):
+        """
+        Remove the images in the store that no rst file references.
+
+        Parameters
+        ----------
+        rst_file_paths : list of str
+            Absolute paths to every rst file that may reference images in the store.
+
+        Returns
+        -------
+        list of str
+            Absolute paths to the images that were removed.
+        """
+        if not os.path.isdir(self.store_dir):
+            return []
+
+        referenced_paths = set()
+        for rst_file_path in rst_file_paths:
+            rst_dir = os.path.dirname(rst_file_path)
+            with open(rst_file_path, 'r') as f:
+                for line in f:
+                    match = IMAGE_REFERENCE_PATTERN.search(line)
+                    if match is not None:
+                        referenced_paths.add(
+                            os.path.normpath(os.path.join(rst_dir, match.group(1))))
+
+        removed_paths = []
+        for file_name in sorted(os.listdir(self.store_dir)):
+            file_path = self.store_dir + '/' + file_name
+            if file_path not in referenced_paths and os.path.isfile(file_path):
+                os.remove(file_path)
+                removed_paths.append(file_path)
+        return removed_paths
+
+
+# Image store used by the directives in this process; None to write images next to documents
+_image_store = None
+
+
+def set_image_store(image_store):
+    """
+    Set the image store used by the directives in this process.
+
+    Parameters
+    ----------
+    image_store : ImageStore or None
+        The image store; None to write images next to the documents.
+    """
+    global _image_store
+    _image_store = image_store
+
+
+def get_image_store():
+    """
+    Get the image store used by the directives in this process.
+
+    Returns
+    -------
+    ImageStore or None
+        The image store; None if images are written next to the documents.
+    """
+    return _image_store
@@ -1,7 +1,843 @@
 import os
 import sys
-import six
-from sphinx_auto_embed.utils import get_rstx_file_paths, get_directives, read_embedrc
+import argparse
+import functools
+import multiprocessing
+from sphinx_auto_embed.utils import get_rstx_file_paths, get_directives, read_embedrc, \
+    read_embedrc_config, write_lines_if_changed, get_exclude_rules, get_target_rstx_file_paths, \
+    OutputChecker, set_output_checker, get_output_checker
+from sphinx_auto_embed.manifest import BuildManifest, MANIFEST_FILE_NAME
+from sphinx_auto_embed.depfile import write_depfile
+from sphinx_auto_embed.checkpoint import Checkpoint, CHECKPOINT_FILE_NAME
+from sphinx_auto_embed.cache import ExecutionCache
+from sphinx_auto_embed.registry import REGISTRY_FILE_NAME
+from sphinx_auto_embed.directive import DIRECTIVE_PATTERN, EmbedError
+from sphinx_auto_embed.watch import Watcher
+from sphinx_auto_embed.execution import set_execution_cache, get_execution_cache, \
+    set_executor, get_executor, set_default_plot_options, get_plot_options, PLOT_OPTIONS, \
+    set_default_print_options, get_print_options, PRINT_OPTIONS, set_session, \
+    collect_snippet_garbage, set_project_dir, get_project_dir, get_num_executed_snippets
+from sphinx_auto_embed.fork_server import ForkServerExecutor
+from sphinx_auto_embed.worker_pool import RecyclingPool
+from sphinx_auto_embed.preview import PreviewCache, OutputCollector, serve
+from sphinx_auto_embed.source_index import set_default_code_options, get_code_options, \
+    CODE_OPTIONS
+from sphinx_auto_embed.image_store import ImageStore, set_image_store, get_image_store
+from sphinx_auto_embed.profiling import Profiler, set_profiler, get_profiler, profile_phase, \
+    profile_file, profile_directive, get_slowest_directives, write_report, get_rss
+
+
+def get_parser():
+    """
+    Create the parser for the command-line arguments.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        Parser for the arguments of the sphinx_auto_embed command.
+    """
+    parser = argparse.ArgumentParser(
+        prog='sphinx_auto_embed',
+        description='Generate rst files from rstx files with the requested content embedded.')
+    parser.add_argument(
+        'targets', nargs='*', metavar='TARGET',
+        help='rstx files, directories, or glob patterns to process; by default, every rstx '
+             'file under the current directory.')
+    parser.add_argument(
+        '--force', action='store_true',
+        help='process every rstx file, even those whose inputs have not changed.')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=None, metavar='N',
+        help='number of worker processes to spread the rstx files across; '
+             '0 means one per CPU (default: 1, or one per CPU with --check).')
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help='always execute embedded code, even if a cache_dir is set in .embedrc.')
+    parser.add_argument(
+        '--check', action='store_true',
+        help='write nothing; instead, check that the rst files and images are up to date and '
+             'exit with status 1 and a summary of the differences if not.')
+    parser.add_argument(
+        '--fail-fast', action='store_true',
+        help='with --check, stop at the first file that is not up to date.')
+    parser.add_argument(
+        '--keep-going', action='store_true',
+        help='when a directive call or an rstx file fails, go on with the others, leaving the '
+             'rst file of each failed rstx file untouched, and report every failure at the end.')
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='only process the rstx files the previous run failed on or did not reach, as '
+             'recorded in its checkpoint, and those whose inputs changed since; without a '
+             'checkpoint, select the files as usual.')
+    parser.add_argument(
+        '--watch', action='store_true',
+        help='keep running and re-embed documents whenever their rstx files or the modules '
+             'they embed change.')
+    parser.add_argument(
+        '--watch-interval', type=float, default=0.2, metavar='SECONDS',
+        help='number of seconds between checks for changes in watch mode (default: 0.2).')
+    parser.add_argument(
+        '--serve', action='store_true',
+        help='instead of processing every rstx file, run a local HTTP server rendering each '
+             'document in memory when requested; -j sets the number of rendering processes.')
+    parser.add_argument(
+        '--port', type=int, default=8000,
+        help='port of the --serve preview server (default: 8000).')
+    parser.add_argument(
+        '--bind', default='127.0.0.1', metavar='ADDRESS',
+        help='address the --serve preview server listens on (default: 127.0.0.1).')
+    parser.add_argument(
+        '--preview-cache-size', type=int, default=32, metavar='N',
+        help='number of rendered documents the --serve preview server keeps (default: 32).')
+    parser.add_argument(
+        '--executor', choices=['inline', 'fork-server'], default=None,
+        help='run embedded code in this process (inline) or in a forked child of a server with '
+             'heavy modules preloaded (fork-server); overrides executor in .embedrc.')
+    parser.add_argument(
+        '--timeout', type=float, default=None, metavar='SECONDS',
+        help='with the fork-server executor, kill embedded code running longer than this; '
+             'overrides timeout in .embedrc.')
+    parser.add_argument(
+        '--memory-limit', type=float, default=None, metavar='MB',
+        help='with the fork-server executor, limit the memory of embedded code; '
+             'overrides memory_limit in .embedrc.')
+    parser.add_argument(
+        '--memory-budget', type=float, default=None, metavar='MB',
+        help='process the rstx files in worker processes, replacing each worker once it uses '
+             'more memory than this; overrides memory_budget in .embedrc.')
+    parser.add_argument(
+        '-v', '--verbose', action='store_true',
+        help='print the peak memory use and the directive calls during which it grew the most, '
+             'which --profile also prints.')
+    parser.add_argument(
+        '--profile', nargs='?', const='embed_profile.json', default=None, metavar='PATH',
+        help='write a JSON report of the wall time, CPU time, and peak memory of each file and '
+             'directive call (default path: embed_profile.json), and print the slowest calls.')
+    parser.add_argument(
+        '--profile-top', type=int, default=10, metavar='N',
+        help='number of slowest directive calls to print with --profile (default: 10).')
+    parser.add_argument(
+        '--cprofile', default=None, metavar='FILE:LINE',
+        help='profile the directive call at the given line of an rstx file with cProfile and '
+             'dump the statistics next to the --profile report, with a .prof extension.')
+    parser.add_argument(
+        '--depfiles', action='store_true',
+        help='write a Make/Ninja dependency file next to each rst file, with .d appended, '
+             'listing the rstx file, module sources, .embedrc, and images it depends on.')
+    parser.add_argument(
+        '--gc-images', action='store_true',
+        help='remove the images in the image_store set in .embedrc that no rst file references, '
+             'instead of processing the rstx files.')
+    return parser
+
+
+def get_execution_cache_from_config(embedrc_dir, config):
+    """
+    Create the execution cache described by the settings in '.embedrc'.
+
+    Parameters
+    ----------
+    embedrc_dir : str or None
+        Absolute path to the directory containing '.embedrc'.
+    config : dict
+        Settings read from '.embedrc'.
+
+    Returns
+    -------
+    ExecutionCache or None
+        The execution cache; None if no cache_dir is set.
+    """
+    if 'cache_dir' not in config:
+        return None
+
+    max_size = config.get('cache_max_size')
+    max_age = config.get('cache_max_age')
+
+    return ExecutionCache(
+        embedrc_dir + '/' + config['cache_dir'], embedrc_dir,
+        max_size=float(max_size) if max_size is not None else None,
+        max_age=float(max_age) if max_age is not None else None)
+
+
+def get_executor_from_config(config, options=None):
+    """
+    Create the executor described by the settings in '.embedrc' and the command line.
+
+    Parameters
+    ----------
+    config : dict
+        Settings read from '.embedrc'.
+    options : argparse.Namespace or None
+        Parsed command-line arguments, which take precedence over the settings.
+
+    Returns
+    -------
+    ForkServerExecutor or None
+        The executor; None if code is executed inline.
+    """
+    executor = config.get('executor', 'inline')
+    timeout = config.get('timeout')
+    memory_limit = config.get('memory_limit')
+
+    if options is not None:
+        if options.executor is not None:
+            executor = options.executor
+        if options.timeout is not None:
+            timeout = options.timeout
+        if options.memory_limit is not None:
+            memory_limit = options.memory_limit
+
+    if executor != 'fork-server':
+        return None
+
+    preload_modules = ['numpy', 'matplotlib.pyplot']
+    if config.get('preload'):
+        preload_modules.extend(
+            module_name.strip() for module_name in config['preload'].split(','))
+
+    return ForkServerExecutor(
+        preload_modules,
+        timeout=float(timeout) if timeout is not None else None,
+        memory_limit=float(memory_limit) if memory_limit is not None else None)
+
+
+def get_plot_options_from_config(config):
+    """
+    Get the default plot options set in '.embedrc'.
+
+    Parameters
+    ----------
+    config : dict
+        Settings read from '.embedrc'.
+
+    Returns
+    -------
+    dict
+        The plot options that are set, converted to their values.
+    """
+    plot_options = {}
+    for name, convert in sorted(PLOT_OPTIONS.items()):
+        if 'plot_' + name in config:
+            plot_options[name] = convert(config['plot_' + name])
+    return plot_options
+
+
+def get_code_options_from_config(config):
+    """
+    Get the default code options set in '.embedrc'.
+
+    Parameters
+    ----------
+    config : dict
+        Settings read from '.embedrc'.
+
+    Returns
+    -------
+    dict
+        The code options that are set, converted to their values.
+    """
+    code_options = {}
+    for name, convert in sorted(CODE_OPTIONS.items()):
+        if name in config:
+            code_options[name] = convert(config[name])
+    return code_options
+
+
+def get_image_store_from_config(embedrc_dir, config):
+    """
+    Create the image store described by the settings in '.embedrc'.
+
+    Parameters
+    ----------
+    embedrc_dir : str or None
+        Absolute path to the directory containing '.embedrc'.
+    config : dict
+        Settings read from '.embedrc'.
+
+    Returns
+    -------
+    ImageStore or None
+        The image store; None if no image_store is set.
+    """
+    if not config.get('image_store'):
+        return None
+
+    return ImageStore(
+        embedrc_dir + '/' + config['image_store'], config.get('image_store_links', 'hardlink'))
+
+
+def get_print_options_from_config(config):
+    """
+    Get the default print options set in '.embedrc'.
+
+    Parameters
+    ----------
+    config : dict
+        Settings read from '.embedrc'.
+
+    Returns
+    -------
+    dict
+        The print options that are set, converted to their values.
+    """
+    print_options = {}
+    for name, convert in sorted(PRINT_OPTIONS.items()):
+        if 'print_' + name in config:
+            print_options[name] = convert(config['print_' + name])
+    return print_options
+
+
+class EmbedResult(object):
+    """
+    Everything produced by processing a single rstx file.
+
+    Attributes
+    ----------
+    file_dir : str
+        Absolute path to the directory containing the rstx file.
+    file_name : str
+        Name of the rstx file within that directory.
+    rst_written : bool
+        Whether the rst file was written; False if it already had the generated contents.
+    dependencies : dict
+        Map from the name of each module the directives depended on to its source file path.
+    outputs : list of str
+        Absolute paths to the files, other than the rst file, written by the directives.
+    cache_stats : dict or None
+        Execution cache hits and misses while processing the file; None if caching is disabled.
+    profile : dict or None
+        Timings of the file and its directive calls; None if not profiling.
+    mismatches : list of dict
+        Output files that are missing or out of date, if an output checker is set.
+    memory : list of dict
+        For each directive call that executed code in this process, its 'line' and 'directive'
+        name, the resident set size of the process after it ('rss') and how much it grew since
+        the previous such call or the start of the file ('rss_growth'), in bytes, and, if
+        profiling, the 'peak_memory' allocated by Python during it; empty if the resident set
+        size cannot be measured.
+    pid : int
+        Id of the process that processed the file.
+    failures : list of dict
+        With keep_going, the 'line', 'directive' name, and 'error' message of each failed
+        directive call, or a single failure with None as line and directive if the file failed
+        outside a directive call; the rst file is not written if there are any.
+    """
+
+    def __init__(self, file_dir, file_name):
+        self.file_dir = file_dir
+        self.file_name = file_name
+        self.rst_written = False
+        self.dependencies = {}
+        self.outputs = []
+        self.cache_stats = None
+        self.profile = None
+        self.mismatches = []
+        self.memory = []
+        self.pid = os.getpid()
+        self.failures = []
+
+
+def record_directive_memory(result, name, iline, rss_before):
+    """
+    Record the resident set size after a directive call and how much it grew since before it.
+
+    Parameters
+    ----------
+    result : EmbedResult
+        Result of the file containing the call, to whose memory records the record is added.
+    name : str
+        NAME of the directive.
+    iline : int
+        Index of the line of the call in the rstx file.
+    rss_before : int
+        Resident set size in bytes before the call.
+
+    Returns
+    -------
+    int
+        Resident set size in bytes after the call.
+    """
+    rss = get_rss()
+    record = {'line': iline + 1, 'directive': name, 'rss': rss, 'rss_growth': rss - rss_before}
+
+    if result.profile is not None:
+        profile_record = result.profile['directives'][-1]
+        profile_record['rss'] = record['rss']
+        profile_record['rss_growth'] = record['rss_growth']
+        record['peak_memory'] = profile_record['peak_memory']
+
+    result.memory.append(record)
+    return rss
+
+
+def get_failure(error, name=None, iline=None):
+    """
+    Describe an exception raised while processing an rstx file.
+
+    Parameters
+    ----------
+    error : Exception
+        The exception.
+    name : str or None
+        NAME of the directive whose call raised it; None if raised outside a directive call.
+    iline : int or None
+        Index of the line of the call in the rstx file; None if raised outside a directive call.
+
+    Returns
+    -------
+    dict
+        The 'line', 'directive' name, and 'error' message, as in EmbedResult.failures.
+    """
+    if isinstance(error, EmbedError) and error.reason is not None:
+        message = error.reason
+    else:
+        message = '{}: {}'.format(type(error).__name__, error)
+    return {'line': iline + 1 if iline is not None else None, 'directive': name, 'error': message}
+
+
+def iter_embedded_lines(file_dir, file_name, directives_list, result, lines=None,
+                        keep_going=False):
+    """
+    Generate the lines of the rst file for an rstx file, one at a time.
+
+    The rstx file is read lazily, so neither the rstx nor the rst file is ever held in memory
+    in full. Alternatively, the lines of the rstx file can be given directly. With keep_going,
+    a failed directive call is recorded in the result and the remaining calls are still made,
+    so that every failure in the file is found at once; an EmbedError is raised at the end.
+
+    Parameters
+    ----------
+    file_dir : str
+        Absolute path to the directory containing the rstx file.
+    file_name : str
+        Name of the rstx file within that directory.
+    directives_list : list of Directive
+        Directive instances to apply to the lines of the file.
+    result : EmbedResult
+        Result to which the dependencies and outputs of the directives are added.
+    lines : iterable of str or None
+        Lines of the rstx file, including end-of-line characters; read from the file if None.
+    keep_going : bool
+        Whether to go on with the other directive calls when one fails.
+
+    Yields
+    ------
+    str
+        Lines of the generated rst file.
+    """
+    file_path = file_dir + '/' + file_name
+
+    directives_dict = dict((directive.NAME, directive) for directive in directives_list)
+
+    if lines is None:
+        with open(file_path, 'r') as f:
+            for new_line in iter_embedded_lines(
+                    file_dir, file_name, directives_list, result, f, keep_going):
+                yield new_line
+        return
+
+    # Reading the resident set size costs about as much as dispatching a directive call, so it
+    # is only read again after calls that executed code, which is what makes it grow; growth
+    # during other calls, e.g., from importing modules, shows up in the next call executing code.
+    rss = get_rss()
+
+    # Sessions started by directives in the file end with it
+    set_session(None)
+    try:
+        for iline, line in enumerate(lines):
+
+            match = DIRECTIVE_PATTERN.search(line)
+            directive = directives_dict.get(match.group(1)) if match is not None else None
+
+            if directive is not None:
+                num_executed_snippets = get_num_executed_snippets()
+                try:
+                    with profile_directive(directive.NAME, result.profile, iline):
+                        new_lines = directive(file_dir, file_name, iline, line, match)
+                except Exception as e:
+                    if not keep_going:
+                        raise
+                    result.failures.append(get_failure(e, directive.NAME, iline))
+                    new_lines = [line]
+                else:
+                    result.dependencies.update(directive.dependencies)
+                    result.outputs.extend(directive.outputs)
+
+                if rss is not None and get_num_executed_snippets() != num_executed_snippets:
+                    rss = record_directive_memory(result, directive.NAME, iline, rss)
+            else:
+                new_lines = [line]
+
+            for new_line in new_lines:
+                yield new_line
+
+        # Raised so that the rst file is left as it was
+        if result.failures:
+            raise EmbedError('In file {}: {} directive calls failed'.format(
+                file_path, len(result.failures)))
+    finally:
+        set_session(None)
+        collect_snippet_garbage()
+
+
+def embed_file(file_dir, file_name, directives_list, keep_going=False):
+    """
+    Process a single rstx file and write the rst file, if its contents changed.
+
+    With keep_going, exceptions are recorded in the failures of the result instead of raised,
+    and the rst file is only written if there are none.
+
+    Parameters
+    ----------
+    file_dir : str
+        Absolute path to the directory containing the rstx file.
+    file_name : str
+        Name of the rstx file within that directory.
+    directives_list : list of Directive
+        Directive instances to apply to the lines of the file.
+    keep_going : bool
+        Whether to record failures instead of raising them.
+
+    Returns
+    -------
+    EmbedResult
+        Whether the rst file was written, and the dependencies and outputs of the file.
+    """
+    file_path = file_dir + '/' + file_name
+    new_file_path = file_path[:-5] + '.rst'
+
+    result = EmbedResult(file_dir, file_name)
+
+    execution_cache = get_execution_cache()
+    if execution_cache is not None:
+        old_cache_stats = execution_cache.get_stats()
+
+    if get_profiler() is not None:
+        result.profile = {}
+
+    try:
+        with profile_file(file_path, result.profile):
+            result.rst_written = write_lines_if_changed(new_file_path, iter_embedded_lines(
+                file_dir, file_name, directives_list, result, keep_going=keep_going))
+    except Exception as e:
+        if not keep_going:
+            raise
+        # Failed directive calls were already recorded, and raise an EmbedError at the end
+        if not (isinstance(e, EmbedError) and result.failures):
+            result.failures.append(get_failure(e))
+
+    output_checker = get_output_checker()
+    if output_checker is not None:
+        result.mismatches = output_checker.pop_mismatches()
+
+    if execution_cache is not None:
+        result.cache_stats = dict(
+            (key, value - old_cache_stats[key])
+            for key, value in execution_cache.get_stats().items()
+        )
+
+    return result
+
+
+# Directive instances owned by the current worker process when running with --jobs
+_worker_directives_list = None
+
+
+def _init_worker(custom_directives_dir, registry_path, execution_cache, executor, plot_options,
+                 print_options, code_options, image_store, profiler, output_checker,
+                 project_dir):
+    """
+    Load the directives and set the execution cache, executor, default plot, print, and code
+    options, image store, profiler, output checker, and project directory in a new worker
+    process.
+
+    Each worker gets its own directive instances, matplotlib state, and sys.stdout, so the
+    global state swapped in and out while executing code is never shared between processes.
+    """
+    global _worker_directives_list
+    _worker_directives_list = get_directives(custom_directives_dir, registry_path)
+    set_execution_cache(execution_cache)
+    set_executor(executor)
+    set_default_plot_options(plot_options)
+    set_default_print_options(print_options)
+    set_default_code_options(code_options)
+    set_image_store(image_store)
+    set_profiler(profiler)
+    set_output_checker(output_checker)
+    set_project_dir(project_dir)
+
+
+def _embed_file_worker(file_path_tuple, keep_going=False):
+    file_dir, file_name = file_path_tuple
+    return embed_file(file_dir, file_name, _worker_directives_list, keep_going)
+
+
+def embed_files(rstx_file_paths_list, directives_list, custom_directives_dir, registry_path,
+                num_jobs, ordered=True, memory_budget=None, keep_going=False):
+    """
+    Process rstx files, either in this process or spread across a pool of worker processes.
+
+    Results are yielded in the order of the given list, regardless of the number of workers or
+    the order in which they finish, unless ordered is False. With a memory budget, the files are
+    always processed in worker processes, even with a single job, and each worker is replaced
+    once its resident set size exceeds the budget, so that whatever embedded code leaves behind
+    cannot accumulate over a long run.
+
+    Parameters
+    ----------
+    rstx_file_paths_list : list of (str, str)
+        List of (file_dir, file_name) tuples for the rstx files to process.
+    directives_list : list of Directive
+        Directive instances to use when processing files in this process.
+    custom_directives_dir : str or None
+        Absolute path to the directory containing custom directives, loaded by each worker.
+    registry_path : str or None
+        Absolute path to the file caching the directive classes found in each module.
+    num_jobs : int
+        Number of worker processes; 1 processes the files in this process.
+    ordered : bool
+        Whether to yield the results in order; otherwise, each result is yielded as soon as it
+        is ready.
+    memory_budget : float or None
+        Resident set size in MB above which a worker process is replaced; None for no limit.
+    keep_going : bool
+        Whether to record the failures of each file in its result instead of raising them.
+
+    Yields
+    ------
+    EmbedResult
+        The result of embed_file for each file.
+    """
+    if memory_budget is None and (num_jobs == 1 or len(rstx_file_paths_list) <= 1):
+        for file_dir, file_name in rstx_file_paths_list:
+            yield embed_file(file_dir, file_name, directives_list, keep_going)
+        return
+
+    initargs = (custom_directives_dir, registry_path, get_execution_cache(), get_executor(),
+                get_plot_options({}), get_print_options({}), get_code_options({}),
+                get_image_store(), get_profiler(), get_output_checker(), get_project_dir())
+    embed_file_worker = functools.partial(_embed_file_worker, keep_going=keep_going)
+
+    if memory_budget is not None:
+        pool = RecyclingPool(
+            min(num_jobs, len(rstx_file_paths_list)), memory_budget * 1e6,
+            initializer=_init_worker, initargs=initargs)
+        for result in pool.imap(embed_file_worker, rstx_file_paths_list, ordered):
+            yield result
+        if pool.num_recycled:
+            print('Replaced {} worker processes that exceeded the memory budget.'.format(
+                pool.num_recycled))
+        return
+
+    pool = multiprocessing.Pool(
+        min(num_jobs, len(rstx_file_paths_list)), initializer=_init_worker, initargs=initargs)
+    try:
+        imap = pool.imap if ordered else pool.imap_unordered
+        for result in imap(embed_file_worker, rstx_file_paths_list, chunksize=1):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def print_mismatches(mismatches, num_files, fail_fast=False):
+    """
+    Print a summary of the output files that are missing or out of date.
+
+    Parameters
+    ----------
+    mismatches : list of dict
+        Mismatches recorded by the output checker.
+    num_files : int
+        Number of rstx files found, including those the manifest shows to be up to date.
+    fail_fast : bool
+        Whether checking stopped at the first rstx file with mismatches.
+    """
+    for mismatch in sorted(mismatches, key=lambda mismatch: mismatch['path']):
+        print('{}: {}'.format(
+            'Missing' if mismatch['status'] == 'missing' else 'Out of date',
+            os.path.relpath(mismatch['path'])))
+        for line in mismatch['diff'] or []:
+            print('    ' + line)
+
+    if not mismatches:
+        print('All outputs of {} rstx files are up to date.'.format(num_files))
+    elif fail_fast:
+        print('Stopped at the first rstx file with outputs that are not up to date.')
+    else:
+        print('{} output files are missing or not up to date.'.format(len(mismatches)))
+
+
+def print_failures(results_failures, num_files):
+    """
+    Print a report of every failure, grouped by rstx file.
+
+    Parameters
+    ----------
+    results_failures : list of (str, list of dict)
+        Path to each rstx file with failures, relative to the current directory, and its
+        failures, as in EmbedResult.failures.
+    num_files : int
+        Number of rstx files processed.
+    """
+    if not results_failures:
+        return
+
+    num_failures = 0
+    print('Failures in {} of {} processed rstx files:'.format(len(results_failures), num_files))
+    for file_path, failures in sorted(results_failures):
+        for failure in failures:
+            if failure['line'] is None:
+                print(file_path)
+            else:
+                print('{}:{} ({})'.format(file_path, failure['line'], failure['directive']))
+            for line in failure['error'].rstrip().splitlines():
+                print('    ' + line)
+        num_failures += len(failures)
+    print('{} failures.'.format(num_failures))
+
+
+def print_memory_summary(results_memory, num_directives):
+    """
+    Print the peak resident set size and the directive calls during which it grew the most.
+
+    Parameters
+    ----------
+    results_memory : list of (str, int, list of dict)
+        (rstx file path, process id, memory records) of each rstx file that was processed.
+    num_directives : int
+        Maximum number of directive calls to print.
+    """
+    # Files processed by the same process share its resident set size
+    peak_rss = {}
+    growth_records = []
+    for file_path, pid, memory_records in results_memory:
+        for record in memory_records:
+            peak_rss[pid] = max(peak_rss.get(pid, 0), record['rss'])
+            growth_records.append((file_path, record))
+
+    if not peak_rss:
+        return
+
+    print('Memory: {:.1f} MB peak resident set size{}'.format(
+        max(peak_rss.values()) / 1e6,
+        ' per process, over {} processes'.format(len(peak_rss)) if len(peak_rss) > 1 else ''))
+
+    growth_records.sort(key=lambda item: -item[1]['rss_growth'])
+    growth_records = [
+        (file_path, record) for file_path, record in growth_records[:num_directives]
+        if record['rss_growth'] >= 5e4]
+    if not growth_records:
+        return
+
+    print('Largest memory growth:')
+    for file_path, record in growth_records:
+        if record.get('peak_memory') is not None:
+            peak = ', {:.1f} MB allocated at peak'.format(record['peak_memory'] / 1e6)
+        else:
+            peak = ''
+        print('  {:+8.1f} MB resident{}  {}:{} {}'.format(
+            record['rss_growth'] / 1e6, peak, file_path, record['line'], record['directive']))
+
+
+def print_slowest_directives(file_records, num_directives):
+    """
+    Print the directive calls that took the longest.
+
+    Parameters
+    ----------
+    file_records : list of dict
+        Profiling records of the rstx files that were processed.
+    num_directives : int
+        Maximum number of directive calls to print.
+    """
+    slowest_directives = get_slowest_directives(file_records, num_directives)
+    if not slowest_directives:
+        return
+
+    print('Slowest directives:')
+    for file_path, record in slowest_directives:
+        if record['peak_memory'] is not None:
+            memory = ', {:.1f} MB peak'.format(record['peak_memory'] / 1e6)
+        else:
+            memory = ''
+        print('  {:8.3f} s wall, {:8.3f} s CPU{}  {}:{} {}'.format(
+            record['wall'], record['cpu'], memory, file_path, record['line'],
+            record['directive']))
+
+
+def write_depfiles(manifest, rstx_file_paths_list, embedrc_dir, cwd_abs_path):
+    """
+    Write the dependency file of each rst file from what the manifest recorded for it.
+
+    Each rst file depends on its rstx file, the source files of the modules its directives read
+    or executed, including custom directives, '.embedrc', and the images written with it.
+
+    Parameters
+    ----------
+    manifest : BuildManifest
+        Manifest updated with the rstx files processed in this run.
+    rstx_file_paths_list : list of (str, str)
+        (directory, file name) of each rstx file to write the dependency file of; those that
+        have no manifest entry, e.g., because processing them failed, are skipped.
+    embedrc_dir : str or None
+        Absolute path to the directory containing '.embedrc'; None if not found.
+    cwd_abs_path : str
+        Absolute path to the directory the paths in the files are relative to.
+    """
+    embedrc_paths = [embedrc_dir + '/.embedrc'] if embedrc_dir is not None else []
+
+    for file_dir, file_name in rstx_file_paths_list:
+        file_path = file_dir + '/' + file_name
+        new_file_path = file_path[:-5] + '.rst'
+
+        source_paths, output_paths = manifest.get_paths(file_path)
+        if output_paths is None:
+            continue
+
+        write_depfile(
+            new_file_path, [file_path] + source_paths + embedrc_paths,
+            [path for path in output_paths if path != new_file_path], cwd_abs_path)
+
+
+def collect_image_garbage(image_store, rstx_file_paths_list):
+    """
+    Remove the images in the image store that no rst file references, and print how many.
+
+    Parameters
+    ----------
+    image_store : ImageStore or None
+        The image store set in '.embedrc'.
+    rstx_file_paths_list : list of (str, str)
+        (directory, file name) of every rstx file; their rst files are searched for references.
+
+    Returns
+    -------
+    int
+        Exit status: 1 if there is no image store or an rst file has not been generated yet.
+    """
+    if image_store is None:
+        print('No image_store is set in .embedrc.')
+        return 1
+
+    rst_file_paths = [
+        file_dir + '/' + file_name[:-5] + '.rst' for file_dir, file_name in rstx_file_paths_list]
+
+    # Images referenced by a missing rst file are unknown, so none can safely be removed
+    missing_file_paths = [path for path in rst_file_paths if not os.path.isfile(path)]
+    if missing_file_paths:
+        print('Not removing any images, since some rst files have not been generated yet:')
+        for file_path in missing_file_paths:
+            print('  ' + os.path.relpath(file_path))
+        return 1
+
+    removed_paths = image_store.collect_garbage(rst_file_paths)
+    print('Removed {} unreferenced images from {}.'.format(
+        len(removed_paths), os.path.relpath(image_store.store_dir)))
+    return 0
 
 
 def main(args=None):
@@ -13,33 +849,208 @@ def main(args=None):
     if args is None:
         args = sys.argv[1:]
 
+    parser = get_parser()
+    options = parser.parse_args(args)
+    if options.check and options.watch:
+        parser.error('--check and --watch cannot be used together')
+    if options.serve and (options.check or options.watch or options.targets):
+        parser.error('--serve cannot be used with --check, --watch, or targets')
+    if options.gc_images and options.targets:
+        parser.error('--gc-images looks at every rst file, so it cannot be used with targets')
+
     cwd_abs_path = os.getcwd()
 
+    profiler = None
+    if options.profile is not None or options.cprofile is not None:
+        profile_path = os.path.abspath(options.profile or 'embed_profile.json')
+        cprofile_target = None
+        if options.cprofile is not None:
+            cprofile_file, cprofile_line = options.cprofile.rsplit(':', 1)
+            cprofile_target = (os.path.abspath(cprofile_file), int(cprofile_line))
+        profiler = Profiler(cprofile_target, os.path.splitext(profile_path)[0] + '.prof')
+    set_profiler(profiler)
+
     custom_directives_dir = read_embedrc(cwd_abs_path)
+    embedrc_dir, config = read_embedrc_config(cwd_abs_path)
+    set_project_dir(embedrc_dir or cwd_abs_path)
 
-    rstx_file_paths_list = get_rstx_file_paths(cwd_abs_path)
-    directives_list = get_directives(custom_directives_dir)
+    execution_cache = None
+    if not options.no_cache:
+        execution_cache = get_execution_cache_from_config(embedrc_dir, config)
+    set_execution_cache(execution_cache)
 
-    for file_dir, file_name in rstx_file_paths_list:
-        file_path = file_dir + '/' + file_name
-        new_file_path = file_path[:-5] + '.rst'
+    executor = get_executor_from_config(config, options)
+    set_executor(executor)
 
-        with open(file_path, 'r') as f:
-            old_lines = f.readlines()
+    set_default_plot_options(get_plot_options_from_config(config))
+    set_default_print_options(get_print_options_from_config(config))
+    set_default_code_options(get_code_options_from_config(config))
+
+    try:
+        image_store = get_image_store_from_config(embedrc_dir, config)
+    except ValueError as e:
+        parser.error(str(e))
+    set_image_store(image_store)
 
-        new_lines = []
-        for iline, line in enumerate(old_lines):
+    exclude_rules = get_exclude_rules(embedrc_dir, config)
 
-            stripped_line = line.replace(' ', '')
+    def find_rstx_file_paths():
+        if options.targets:
+            return get_target_rstx_file_paths(cwd_abs_path, options.targets, exclude_rules)
+        return get_rstx_file_paths(cwd_abs_path, exclude_rules)
 
-            for directive in directives_list:
-                if '..%s::' % directive.NAME in stripped_line:
-                    lines = directive(file_dir, file_name, iline, line)
-                    break
+    with profile_phase('discovery'):
+        try:
+            rstx_file_paths_list = find_rstx_file_paths()
+        except ValueError as e:
+            parser.error(str(e))
+
+    if options.gc_images:
+        return collect_image_garbage(image_store, rstx_file_paths_list)
+
+    registry_path = cwd_abs_path + '/' + REGISTRY_FILE_NAME
+
+    if options.serve:
+        num_jobs = 2 if options.jobs is None else options.jobs or multiprocessing.cpu_count()
+        cache = PreviewCache(
+            num_jobs,
+            (custom_directives_dir, registry_path, execution_cache, executor,
+             get_plot_options({}), get_print_options({}), get_code_options({}), image_store,
+             None, OutputCollector(), get_project_dir()),
+            max_documents=options.preview_cache_size)
+        serve(cwd_abs_path, cache, find_rstx_file_paths, options.bind, options.port)
+        return
+
+    with profile_phase('directives'):
+        directives_list = get_directives(custom_directives_dir, registry_path)
+
+    checkpoint = Checkpoint(cwd_abs_path + '/' + CHECKPOINT_FILE_NAME)
+    resuming = options.resume and checkpoint.load()
+    if options.resume and not resuming:
+        print('No checkpoint to resume from; selecting the rstx files as usual.')
+
+    # When resuming, only the files that changed since are processed again, even with --force
+    manifest = BuildManifest(cwd_abs_path + '/' + MANIFEST_FILE_NAME)
+    if not options.force or resuming:
+        with profile_phase('manifest'):
+            manifest.load()
+    manifest.set_directive_names([directive.NAME for directive in directives_list])
+    manifest.set_default_options({
+        'plot': get_plot_options({}),
+        'print': get_print_options({}),
+        'code': get_code_options({}),
+        'image_store': [image_store.store_dir, image_store.link_mode] if image_store else None,
+    })
+    # Entries of files outside the targets are kept, since they were not searched for
+    if not options.targets:
+        manifest.prune([
+            file_dir + '/' + file_name for file_dir, file_name in rstx_file_paths_list])
+
+    if options.watch:
+        try:
+            Watcher(cwd_abs_path, directives_list, manifest, embed_file,
+                    interval=options.watch_interval, find_rstx_file_paths=find_rstx_file_paths,
+                    prune_manifest=not options.targets).run()
+        finally:
+            if executor is not None:
+                executor.stop()
+        return
+
+    with profile_phase('manifest'):
+        stale_file_paths_list = [
+            (file_dir, file_name) for file_dir, file_name in rstx_file_paths_list
+            if not manifest.is_up_to_date(file_dir + '/' + file_name)
+            or resuming and checkpoint.is_remaining(file_dir + '/' + file_name)
+        ]
+    checkpoint.add_pending([
+        file_dir + '/' + file_name for file_dir, file_name in stale_file_paths_list])
+
+    if options.jobs is None:
+        options.jobs = 0 if options.check else 1
+    num_jobs = options.jobs if options.jobs > 0 else multiprocessing.cpu_count()
+
+    # The directives and the manifest were loaded already, so only the outputs are checked
+    if options.check:
+        set_output_checker(OutputChecker())
+
+    memory_budget = options.memory_budget
+    if memory_budget is None and config.get('memory_budget'):
+        memory_budget = float(config['memory_budget'])
+
+    cache_stats = {'hits': 0, 'misses': 0}
+    file_records = []
+    results_memory = []
+    mismatches = []
+    results_failures = []
+    completed = False
+    try:
+        for result in embed_files(
+                stale_file_paths_list, directives_list, custom_directives_dir, registry_path,
+                num_jobs, ordered=not options.check, memory_budget=memory_budget,
+                keep_going=options.keep_going):
+            file_path = result.file_dir + '/' + result.file_name
+            new_file_path = file_path[:-5] + '.rst'
+
+            # Files with failures are left out of the manifest, so they are processed again
+            if result.failures:
+                results_failures.append((os.path.relpath(file_path), result.failures))
+            elif not options.check:
+                manifest.update(file_path, result.dependencies, [new_file_path] + result.outputs)
+
+            if not options.check:
+                checkpoint.record(file_path, result.failures)
+
+            # Per-file counts also cover lookups made in worker processes
+            if result.cache_stats is not None:
+                for key in cache_stats:
+                    cache_stats[key] += result.cache_stats[key]
+
+            if result.profile is not None:
+                file_records.append(result.profile)
+
+            if result.memory:
+                results_memory.append((os.path.relpath(file_path), result.pid, result.memory))
+
+            mismatches.extend(result.mismatches)
+            if mismatches and options.fail_fast:
+                break
+        completed = True
+    finally:
+        # Files processed before a failure do not need to be processed again
+        if not options.check:
+            with profile_phase('manifest'):
+                manifest.save()
+            if completed and not results_failures:
+                checkpoint.remove()
             else:
-                lines = [line]
+                checkpoint.save()
+
+        if executor is not None:
+            executor.stop()
+
+    if options.depfiles and not options.check:
+        with profile_phase('depfiles'):
+            write_depfiles(manifest, rstx_file_paths_list, embedrc_dir, cwd_abs_path)
+
+    if execution_cache is not None:
+        execution_cache.evict()
+        print('Execution cache: {} hits, {} misses, {} evicted'.format(
+            cache_stats['hits'], cache_stats['misses'], execution_cache.evictions))
+
+    if options.verbose or profiler is not None:
+        print_memory_summary(results_memory, 5)
+
+    if profiler is not None:
+        write_report(profile_path, profiler.get_report(file_records))
+        print_slowest_directives(file_records, options.profile_top)
+        print('Profile written to {}'.format(os.path.relpath(profile_path)))
+
+    if options.check:
+        print_mismatches(mismatches, len(rstx_file_paths_list), options.fail_fast)
 
-            new_lines.extend(lines)
+    print_failures(results_failures, len(stale_file_paths_list))
+    if results_failures and not options.check:
+        print('Run again with --resume to only process the rstx files that failed.')
 
-        with open(new_file_path, 'w') as f:
-            f.writelines(new_lines)
+    if mismatches or results_failures:
+        return 1
@@ -0,0 +1,261 @@
+import os
+import json
+import hashlib
+
+from sphinx_auto_embed.utils import write_lines_if_changed
+
+
+MANIFEST_FILE_NAME = '.embed_manifest.json'
+
+
+def hash_file(file_path):
+    """
+    Compute the hash of the contents of a file.
+
+    Parameters
+    ----------
+    file_path : str
+        Absolute path to the file.
+
+    Returns
+    -------
+    str
+        Hexadecimal SHA-1 digest of the file contents.
+    """
+    hasher = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class BuildManifest(object):
+    """
+    Persistent record of the inputs and outputs of every processed rstx file.
+
+    For each rstx file, the manifest stores the hash of the rstx file itself, the source file and
+    hash of every module its directives depended on, and the hash of every file it produced.
+    An rstx file only needs to be processed again if one of these has changed.
+    """
+
+    VERSION = 1
+
+    def __init__(self, manifest_path):
+        """
+        Parameters
+        ----------
+        manifest_path : str
+            Absolute path to the manifest file; rstx and output paths are stored relative to
+            the directory containing it.
+        """
+        self.manifest_path = manifest_path
+        self.base_dir = os.path.dirname(manifest_path)
+        self.directive_names = []
+        self.default_options = None
+        self.entries = {}
+        self._hashes = {}
+
+    def _get_rel_path(self, abs_path):
+        return os.path.relpath(abs_path, self.base_dir)
+
+    def _get_abs_path(self, rel_path):
+        return os.path.normpath(os.path.join(self.base_dir, rel_path))
+
+    def _get_hash(self, abs_path):
+        # Input files are hashed at most once per run.
+        if abs_path not in self._hashes:
+            if os.path.isfile(abs_path):
+                self._hashes[abs_path] = hash_file(abs_path)
+            else:
+                self._hashes[abs_path] = None
+        return self._hashes[abs_path]
+
+    def load(self):
+        """
+        Read the manifest from disk, if it exists and was written by a compatible version.
+        """
+        if not os.path.isfile(self.manifest_path):
+            return
+
+        try:
+            with open(self.manifest_path, 'r') as f:
+                data = json.load(f)
+        except ValueError:
+            return
+
+        if data.get('version') == self.VERSION:
+            self.directive_names = data['directives']
+            self.default_options = data.get('default_options')
+            self.entries = data['files']
+
+    def save(self):
+        """
+        Write the manifest to disk.
+        """
+        data = {
+            'version': self.VERSION,
+            'directives': self.directive_names,
+            'default_options': self.default_options,
+            'files': self.entries,
+        }
+        write_lines_if_changed(self.manifest_path, [json.dumps(data, indent=1, sort_keys=True)])
+
+    def set_directive_names(self, directive_names):
+        """
+        Record the names of the available directives, invalidating everything if they changed.
+
+        A newly registered directive can change the output of an rstx file that did not change.
+
+        Parameters
+        ----------
+        directive_names : list of str
+            NAME of each directive available in this run.
+        """
+        directive_names = sorted(directive_names)
+        if directive_names != self.directive_names:
+            self.entries = {}
+        self.directive_names = directive_names
+
+    def set_default_options(self, default_options):
+        """
+        Record the default directive options, invalidating everything if they changed.
+
+        Parameters
+        ----------
+        default_options : dict
+            Default options in this run, e.g., the plot and print options.
+        """
+        # Compare in the form stored in the file, where tuples become lists
+        default_options = json.loads(json.dumps(default_options, sort_keys=True))
+        if default_options != self.default_options:
+            self.entries = {}
+        self.default_options = default_options
+
+    def get_entry(self, rstx_file_path):
+        """
+        Get the recorded inputs and outputs of an rstx file.
+
+        Parameters
+        ----------
+        rstx_file_path : str
+            Absolute path to the rstx file.
+
+        Returns
+        -------
+        dict or None
+            The 'hash' of the rstx file, the [source_path, hash] of each of its 'modules', and the
+            hash of each of its 'outputs'; None if the file has not been processed.
+        """
+        return self.entries.get(self._get_rel_path(rstx_file_path))
+
+    def get_paths(self, rstx_file_path):
+        """
+        Get the recorded module source files and outputs of an rstx file.
+
+        Parameters
+        ----------
+        rstx_file_path : str
+            Absolute path to the rstx file.
+
+        Returns
+        -------
+        list of str or None
+            Absolute paths to the source files of the modules, sorted; None if the file has not
+            been processed.
+        list of str or None
+            Absolute paths to the outputs, sorted; None if the file has not been processed.
+        """
+        entry = self.get_entry(rstx_file_path)
+        if entry is None:
+            return None, None
+
+        source_paths = sorted(set(
+            source_path for source_path, source_hash in entry['modules'].values()))
+        output_paths = sorted(
+            self._get_abs_path(rel_output_path) for rel_output_path in entry['outputs'])
+        return source_paths, output_paths
+
+    def forget_hashes(self, file_paths):
+        """
+        Discard the hashes computed earlier in this run for files that have since changed.
+
+        Parameters
+        ----------
+        file_paths : list of str
+            Absolute paths to the changed files.
+        """
+        for file_path in file_paths:
+            self._hashes.pop(file_path, None)
+
+    def is_up_to_date(self, rstx_file_path):
+        """
+        Check whether an rstx file, its module dependencies, and its outputs are unchanged.
+
+        Parameters
+        ----------
+        rstx_file_path : str
+            Absolute path to the rstx file.
+
+        Returns
+        -------
+        bool
+            True if the rstx file does not need to be processed again.
+        """
+        entry = self.get_entry(rstx_file_path)
+        if entry is None:
+            return False
+
+        if self._get_hash(rstx_file_path) != entry['hash']:
+            return False
+
+        for module_name, (source_path, source_hash) in entry['modules'].items():
+            if self._get_hash(source_path) != source_hash:
+                return False
+
+        for rel_output_path, output_hash in entry['outputs'].items():
+            if self._get_hash(self._get_abs_path(rel_output_path)) != output_hash:
+                return False
+
+        return True
+
+    def update(self, rstx_file_path, dependencies, output_paths):
+        """
+        Record the inputs and outputs of an rstx file that has just been processed.
+
+        Parameters
+        ----------
+        rstx_file_path : str
+            Absolute path to the rstx file.
+        dependencies : dict
+            Map from the name of each module the directives depended on to its source file path.
+        output_paths : list of str
+            Absolute paths to the files that were written.
+        """
+        outputs = {}
+        for output_path in output_paths:
+            # Outputs were just rewritten, so any hash computed earlier in this run is stale.
+            self._hashes.pop(output_path, None)
+            outputs[self._get_rel_path(output_path)] = self._get_hash(output_path)
+
+        self.entries[self._get_rel_path(rstx_file_path)] = {
+            'hash': self._get_hash(rstx_file_path),
+            'modules': dict(
+                (module_name, [source_path, self._get_hash(source_path)])
+                for module_name, source_path in dependencies.items()
+            ),
+            'outputs': outputs,
+        }
+
+    def prune(self, rstx_file_paths):
+        """
+        Forget about rstx files that no longer exist.
+
+        Parameters
+        ----------
+        rstx_file_paths : list of str
+            Absolute paths to all rstx files found in this run.
+        """
+        rel_paths = set(self._get_rel_path(file_path) for file_path in rstx_file_paths)
+        for rel_path in list(self.entries):
+            if rel_path not in rel_paths:
+                del self.entries[rel_path]
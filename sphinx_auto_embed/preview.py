@@ -0,0 +1,460 @@
+import os
+import time
+import threading
+import mimetypes
+import collections
+import multiprocessing
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import unquote, urlsplit
+
+from sphinx_auto_embed.utils import OutputChecker, get_output_checker
+
+
+def escape_html(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace(
+        '"', '&quot;')
+
+
+class OutputCollector(OutputChecker):
+    """
+    Collect generated files in memory instead of writing them.
+
+    Set with set_output_checker, like an OutputChecker, so that write_lines_if_changed and
+    write_bytes_if_changed hand their contents to it.
+    """
+
+    def __init__(self):
+        OutputChecker.__init__(self)
+        self.files = {}
+
+    def check_lines(self, file_path, lines):
+        self.files[file_path] = ''.join(lines).encode('utf-8')
+        return True
+
+    def check_bytes(self, file_path, data):
+        self.files[file_path] = data
+        return True
+
+    def pop_files(self):
+        """
+        Get the files collected since the last call.
+
+        Returns
+        -------
+        dict
+            Map from the absolute path of each file to its contents as bytes.
+        """
+        files = self.files
+        self.files = {}
+        return files
+
+
+# Directive instances owned by the current worker process
+_worker_directives_list = None
+
+
+def _init_worker(*initargs):
+    """
+    Set up a worker process like main._init_worker, with an OutputCollector as output checker.
+    """
+    from sphinx_auto_embed import main
+
+    global _worker_directives_list
+    main._init_worker(*initargs)
+    _worker_directives_list = main._worker_directives_list
+
+
+def _render_worker(file_path):
+    """
+    Render an rstx file in a worker process, returning the rst, other files, and dependencies.
+    """
+    from sphinx_auto_embed.main import EmbedResult, iter_embedded_lines
+
+    file_dir, file_name = os.path.split(file_path)
+    result = EmbedResult(file_dir, file_name)
+    try:
+        rst = ''.join(iter_embedded_lines(
+            file_dir, file_name, _worker_directives_list, result))
+    finally:
+        files = get_output_checker().pop_files()
+    return rst, files, result.dependencies
+
+
+def get_file_stamp(file_path):
+    """
+    Get the modification time and size of a file, or None if it does not exist.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+
+class PreviewDocument(object):
+    """
+    Everything generated for an rstx file, and what it was generated from.
+    """
+
+    def __init__(self, file_path, rst, files, dependencies, stamps):
+        """
+        Parameters
+        ----------
+        file_path : str
+            Absolute path to the rstx file.
+        rst : str
+            The generated rst.
+        files : dict
+            Map from the absolute path of each other generated file, such as images, to its
+            contents as bytes.
+        dependencies : dict
+            Map from the name of each module the directives depended on to its source file path.
+        stamps : dict
+            Map from the path of the rstx file and each module source file to its stamp, as
+            returned by get_file_stamp, when rendering started.
+        """
+        self.file_path = file_path
+        self.rst = rst
+        self.files = files
+        self.dependencies = dependencies
+        self.stamps = stamps
+
+    def get_changed_paths(self):
+        """
+        Get the source files that changed since the document was rendered.
+
+        Returns
+        -------
+        list of str
+            Absolute paths to the rstx file and module source files that changed.
+        """
+        return [
+            file_path for file_path, stamp in self.stamps.items()
+            if get_file_stamp(file_path) != stamp
+        ]
+
+
+class PreviewCache(object):
+    """
+    LRU cache of rendered documents, rendering them in a bounded pool of worker processes.
+
+    Nothing is written: the generated rst and images are kept in memory and served until the
+    rstx file or one of the modules its directives depended on changes. Rendering in worker
+    processes keeps concurrent requests from sharing the global state swapped in and out while
+    executing code, and the workers are replaced after a module changes, so that they import it
+    again.
+    """
+
+    def __init__(self, num_workers, initargs, max_documents=32):
+        """
+        Parameters
+        ----------
+        num_workers : int
+            Number of worker processes rendering documents at the same time.
+        initargs : tuple
+            Arguments of main._init_worker, with which each worker is set up; the output
+            checker should be an OutputCollector.
+        max_documents : int
+            Maximum number of documents kept in the cache.
+        """
+        self.num_workers = num_workers
+        self.initargs = initargs
+        self.max_documents = max_documents
+
+        self._documents = collections.OrderedDict()
+        # Map from the path of each generated file to the rstx file that generated it
+        self._file_owners = {}
+        # Map from the path of each rstx file being rendered to its AsyncResult and stamps
+        self._pending = {}
+        # Map from the source file of each module the workers loaded to its stamp when first
+        # seen, so that documents not in the cache are not rendered with outdated modules
+        self._module_stamps = {}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(
+                self.num_workers, initializer=_init_worker, initargs=self.initargs)
+        return self._pool
+
+    def _recycle_pool(self):
+        """
+        Replace the workers, once they finish what they are rendering, so that new workers
+        import the changed modules again.
+        """
+        old_pool = self._pool
+        self._pool = None
+        self._module_stamps = {}
+        if old_pool is not None:
+            old_pool.close()
+            thread = threading.Thread(target=old_pool.join)
+            thread.daemon = True
+            thread.start()
+
+    def _forget(self, file_path):
+        document = self._documents.pop(file_path, None)
+        if document is not None:
+            for generated_path in document.files:
+                if self._file_owners.get(generated_path) == file_path:
+                    del self._file_owners[generated_path]
+
+    def get_document(self, file_path):
+        """
+        Get a rendered document, rendering it if it is not cached or its sources changed.
+
+        Concurrent requests for the same document wait for a single rendering.
+
+        Parameters
+        ----------
+        file_path : str
+            Absolute path to the rstx file.
+
+        Returns
+        -------
+        PreviewDocument
+            The rendered document.
+        """
+        with self._lock:
+            if any(get_file_stamp(source_path) != stamp
+                   for source_path, stamp in self._module_stamps.items()):
+                self._recycle_pool()
+
+            document = self._documents.get(file_path)
+            if document is not None:
+                changed_paths = document.get_changed_paths()
+                if not changed_paths:
+                    # Move to the most recently used end
+                    del self._documents[file_path]
+                    self._documents[file_path] = document
+                    return document
+
+                self._forget(file_path)
+                if any(changed_path != file_path for changed_path in changed_paths):
+                    self._recycle_pool()
+
+            pending = self._pending.get(file_path)
+            if pending is None:
+                # Stamps are taken before rendering, so changes made meanwhile are noticed later
+                stamps = {file_path: get_file_stamp(file_path)}
+                if document is not None:
+                    for source_path in document.dependencies.values():
+                        stamps[source_path] = get_file_stamp(source_path)
+                pending = (self._get_pool().apply_async(_render_worker, (file_path,)), stamps)
+                self._pending[file_path] = pending
+
+        async_result, stamps = pending
+        try:
+            rst, files, dependencies = async_result.get()
+        finally:
+            with self._lock:
+                if self._pending.get(file_path) is pending:
+                    del self._pending[file_path]
+
+        for source_path in dependencies.values():
+            stamps.setdefault(source_path, get_file_stamp(source_path))
+        document = PreviewDocument(file_path, rst, files, dependencies, stamps)
+
+        with self._lock:
+            for source_path in dependencies.values():
+                self._module_stamps.setdefault(source_path, stamps[source_path])
+            self._forget(file_path)
+            self._documents[file_path] = document
+            for generated_path in files:
+                self._file_owners[generated_path] = file_path
+            while len(self._documents) > self.max_documents:
+                self._forget(next(iter(self._documents)))
+
+        return document
+
+    def get_file(self, file_path):
+        """
+        Get the contents of a file generated by a cached document.
+
+        Parameters
+        ----------
+        file_path : str
+            Absolute path to the file.
+
+        Returns
+        -------
+        bytes or None
+            The contents; None if no cached document generated the file.
+        """
+        with self._lock:
+            owner_path = self._file_owners.get(file_path)
+            if owner_path is None:
+                return None
+            return self._documents[owner_path].files.get(file_path)
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+def render_html(rst, title):
+    """
+    Render rst as an HTML page with docutils, if installed, or as preformatted text otherwise.
+
+    Parameters
+    ----------
+    rst : str
+        The rst.
+    title : str
+        Title of the page if docutils is not installed.
+
+    Returns
+    -------
+    bytes
+        The HTML page.
+    """
+    try:
+        from docutils.core import publish_string
+    except ImportError:
+        return '<!DOCTYPE html>\n<title>{0}</title>\n<pre>{1}</pre>\n'.format(
+            escape_html(title), escape_html(rst)).encode('utf-8')
+
+    # Sphinx-only directives and roles are reported in the page rather than failing
+    return publish_string(
+        rst, writer_name='html',
+        settings_overrides={'report_level': 3, 'halt_level': 5, 'output_encoding': 'utf-8'})
+
+
+class PreviewRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Handler serving the index, the rendered documents, and their images.
+
+    Pages are served at the path of the rstx file relative to the directory of the server, with
+    the extension replaced:
+
+    - .html: the document rendered with docutils, if installed, or the rst otherwise.
+    - .rst: the generated rst.
+
+    Images referenced by the documents are served at their paths relative to the pages.
+    """
+
+    def do_GET(self):
+        server = self.server
+        rel_path = unquote(urlsplit(self.path).path).lstrip('/')
+        abs_path = os.path.normpath(os.path.join(server.root_dir, rel_path))
+        if abs_path != server.root_dir and not abs_path.startswith(server.root_dir + os.sep):
+            self.send_error(403)
+            return
+
+        base_path, extension = os.path.splitext(abs_path)
+        rstx_path = base_path + '.rstx'
+
+        try:
+            if rel_path == '':
+                self.send_content(server.get_index_html(), 'text/html; charset=utf-8')
+            elif extension in ('.html', '.rst') and os.path.isfile(rstx_path):
+                start_time = time.time()
+                document = server.cache.get_document(rstx_path)
+                if extension == '.rst':
+                    self.send_content(document.rst.encode('utf-8'), 'text/plain; charset=utf-8')
+                else:
+                    self.send_content(
+                        render_html(document.rst, os.path.relpath(rstx_path, server.root_dir)),
+                        'text/html; charset=utf-8')
+                self.log_message('served %s in %.3f s', rel_path, time.time() - start_time)
+            else:
+                data = server.cache.get_file(abs_path)
+                if data is None and os.path.isfile(abs_path):
+                    with open(abs_path, 'rb') as f:
+                        data = f.read()
+                if data is None:
+                    self.send_error(404)
+                    return
+                self.send_content(
+                    data, mimetypes.guess_type(abs_path)[0] or 'application/octet-stream')
+        except Exception as e:
+            message = '{}: {}'.format(type(e).__name__, e)
+            self.send_content(
+                ('<!DOCTYPE html>\n<title>Error</title>\n<pre>{}</pre>\n'.format(
+                    escape_html(message))).encode('utf-8'),
+                'text/html; charset=utf-8', status=500)
+
+    def send_content(self, data, content_type, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class PreviewServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    HTTP server previewing the rstx files under a directory.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, root_dir, cache, find_rstx_file_paths):
+        """
+        Parameters
+        ----------
+        address : (str, int)
+            Host and port to listen on.
+        root_dir : str
+            Absolute path to the directory whose rstx files are served.
+        cache : PreviewCache
+            Cache rendering the documents.
+        find_rstx_file_paths : callable
+            Function returning the (directory, file name) of every rstx file to list in the
+            index.
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, address, PreviewRequestHandler)
+        self.root_dir = root_dir
+        self.cache = cache
+        self.find_rstx_file_paths = find_rstx_file_paths
+
+    def get_index_html(self):
+        """
+        Get the HTML page listing every rstx file.
+        """
+        lines = ['<!DOCTYPE html>\n<title>Preview</title>\n<ul>\n']
+        for file_dir, file_name in self.find_rstx_file_paths():
+            rel_path = os.path.relpath(file_dir + '/' + file_name, self.root_dir).replace(
+                os.sep, '/')
+            lines.append('<li><a href="/{0}.html">{1}</a> (<a href="/{0}.rst">rst</a>)</li>\n'
+                         .format(escape_html(rel_path[:-5]), escape_html(rel_path)))
+        lines.append('</ul>\n')
+        return ''.join(lines).encode('utf-8')
+
+
+def serve(root_dir, cache, find_rstx_file_paths, host='127.0.0.1', port=8000):
+    """
+    Run a preview server until interrupted.
+
+    Instead of processing the whole tree, each rstx file is only processed when its page is
+    requested.
+
+    Parameters
+    ----------
+    root_dir : str
+        Absolute path to the directory whose rstx files are served.
+    cache : PreviewCache
+        Cache rendering the documents.
+    find_rstx_file_paths : callable
+        Function returning the (directory, file name) of every rstx file.
+    host : str
+        Host to listen on.
+    port : int
+        Port to listen on.
+    """
+    server = PreviewServer((host, port), root_dir, cache, find_rstx_file_paths)
+    print('Previewing at http://{}:{}/ (press Ctrl+C to stop)'.format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        cache.close()
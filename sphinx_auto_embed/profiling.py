@@ -0,0 +1,380 @@
+import os
+import sys
+import time
+import json
+import functools
+import contextlib
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Peak memory is only measured if the peak can be reset at the start of each block
+if tracemalloc is not None and not hasattr(tracemalloc, 'reset_peak'):
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    _wall_clock = time.perf_counter
+except AttributeError:
+    _wall_clock = time.time
+
+try:
+    _cpu_clock = time.process_time
+except AttributeError:
+    _cpu_clock = time.clock
+
+
+def get_rss():
+    """
+    Get the resident set size of this process, i.e., how much physical memory it uses.
+
+    Returns
+    -------
+    int or None
+        Current resident set size in bytes, read from /proc on Linux; on other POSIX systems,
+        where only the peak is available, the peak resident set size; None if unknown.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+
+    if resource is not None:
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+    return None
+
+
+# Profiler recording timings in the current process; None when not profiling
+_profiler = None
+
+
+def set_profiler(profiler):
+    """
+    Set the profiler recording timings in this process.
+
+    Parameters
+    ----------
+    profiler : Profiler or None
+        The profiler; None to stop profiling.
+    """
+    global _profiler
+    _profiler = profiler
+    if profiler is not None:
+        profiler.start()
+
+
+def get_profiler():
+    """
+    Get the profiler recording timings in this process.
+
+    Returns
+    -------
+    Profiler or None
+        The profiler; None when not profiling.
+    """
+    return _profiler
+
+
+class _Measurement(object):
+    """
+    Wall time, CPU time, and peak memory of a block of code, filled in when the block exits.
+    """
+
+    def __init__(self):
+        self.wall = 0.
+        self.cpu = 0.
+        self.peak_memory = None
+
+    def __enter__(self):
+        self._start_wall = _wall_clock()
+        self._start_cpu = _cpu_clock()
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self._start_memory = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall = _wall_clock() - self._start_wall
+        self.cpu = _cpu_clock() - self._start_cpu
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            # Peak memory allocated on top of what was allocated when the block started
+            self.peak_memory = max(0, tracemalloc.get_traced_memory()[1] - self._start_memory)
+
+
+class Profiler(object):
+    """
+    Record where the time goes while embedding content.
+
+    Each directive call is timed and attributed to its file and line, with the phases inside it
+    (extracting the source, executing the code, rendering figures, ...) timed separately. Phases
+    outside any directive call, such as finding the rstx files, are recorded for the whole run.
+    Peak memory is measured in bytes with tracemalloc, on Python 3.9 and later, so it only
+    covers memory allocated by Python in this process, not in a fork server.
+    """
+
+    def __init__(self, cprofile_target=None, cprofile_path=None):
+        """
+        Parameters
+        ----------
+        cprofile_target : (str, int) or None
+            (rstx file path, line number) of a single directive call to profile with cProfile;
+            None to not use cProfile.
+        cprofile_path : str or None
+            Absolute path to the file to dump the cProfile statistics of that directive call to.
+        """
+        self.cprofile_target = cprofile_target
+        self.cprofile_path = cprofile_path
+
+        # Map from phase name to {'wall': float, 'cpu': float, 'count': int} for the whole run
+        self.phases = {}
+        self._directive_record = None
+
+        self._start_wall = _wall_clock()
+        self._start_cpu = _cpu_clock()
+
+    def start(self):
+        """
+        Start tracing memory allocations, if possible and not done already.
+        """
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager timing a phase of the work.
+
+        Phases can nest, e.g., rendering figures happens while executing code, in which case
+        the time of the inner phase is also included in the outer one.
+
+        Parameters
+        ----------
+        name : str
+            Name of the phase.
+        """
+        if self._directive_record is not None:
+            phases = self._directive_record['phases']
+        else:
+            phases = self.phases
+
+        start_wall = _wall_clock()
+        start_cpu = _cpu_clock()
+        try:
+            yield
+        finally:
+            phase = phases.setdefault(name, {'wall': 0., 'cpu': 0., 'count': 0})
+            phase['wall'] += _wall_clock() - start_wall
+            phase['cpu'] += _cpu_clock() - start_cpu
+            phase['count'] += 1
+
+    @contextlib.contextmanager
+    def file(self, file_path, record):
+        """
+        Context manager timing the processing of an rstx file.
+
+        Parameters
+        ----------
+        file_path : str
+            Absolute path to the rstx file.
+        record : dict
+            Dict in which 'wall', 'cpu', and 'peak_memory' are set, and to which the records of
+            the directive calls are appended under 'directives'.
+        """
+        record['file'] = os.path.relpath(file_path)
+        record['directives'] = []
+
+        try:
+            with _Measurement() as measurement:
+                yield record
+        finally:
+            record['wall'] = measurement.wall
+            record['cpu'] = measurement.cpu
+
+            # Directive calls reset the peak, so the file peak is the largest of theirs and its own
+            peak_memories = [measurement.peak_memory] + [
+                directive_record['peak_memory'] for directive_record in record['directives']]
+            peak_memories = [
+                peak_memory for peak_memory in peak_memories if peak_memory is not None]
+            record['peak_memory'] = max(peak_memories) if peak_memories else None
+
+            # Time not spent in directive calls is spent reading the rstx and writing the rst file
+            record['io_wall'] = record['wall'] - sum(
+                directive_record['wall'] for directive_record in record['directives'])
+
+    @contextlib.contextmanager
+    def directive(self, name, file_record, iline):
+        """
+        Context manager timing a directive call.
+
+        Parameters
+        ----------
+        name : str
+            NAME of the directive.
+        file_record : dict
+            Record of the rstx file containing the call, as set up by Profiler.file.
+        iline : int
+            Index of the line of the call in the rstx file.
+        """
+        record = {'directive': name, 'line': iline + 1, 'phases': {}}
+        file_record['directives'].append(record)
+
+        profile = None
+        if self.cprofile_target is not None \
+                and self.cprofile_target[0] == os.path.abspath(file_record['file']) \
+                and self.cprofile_target[1] == iline + 1:
+            import cProfile
+            profile = cProfile.Profile()
+
+        self._directive_record = record
+        try:
+            with _Measurement() as measurement:
+                if profile is not None:
+                    profile.enable()
+                try:
+                    yield record
+                finally:
+                    if profile is not None:
+                        profile.disable()
+        finally:
+            self._directive_record = None
+            record['wall'] = measurement.wall
+            record['cpu'] = measurement.cpu
+            record['peak_memory'] = measurement.peak_memory
+
+            if profile is not None:
+                profile.dump_stats(self.cprofile_path)
+
+    def get_report(self, file_records):
+        """
+        Assemble the profiling report of the run so far.
+
+        Parameters
+        ----------
+        file_records : list of dict
+            Records of the rstx files that were processed, as set up by Profiler.file, including
+            those processed in worker processes.
+
+        Returns
+        -------
+        dict
+            The report, which can be serialized to JSON. Times are in seconds, memory in bytes.
+        """
+        return {
+            'wall': _wall_clock() - self._start_wall,
+            'cpu': _cpu_clock() - self._start_cpu,
+            'phases': self.phases,
+            'files': file_records,
+        }
+
+
+def profile_phase(name):
+    """
+    Get a context manager timing a phase of the work, if profiling.
+
+    Parameters
+    ----------
+    name : str
+        Name of the phase.
+
+    Returns
+    -------
+    context manager
+        The profiler's phase, or a context manager doing nothing when not profiling.
+    """
+    if _profiler is None:
+        return _null_context()
+    return _profiler.phase(name)
+
+
+def profile_file(file_path, record):
+    """
+    Get a context manager timing the processing of an rstx file, if profiling.
+
+    See Profiler.file for the parameters.
+    """
+    if _profiler is None:
+        return _null_context()
+    return _profiler.file(file_path, record)
+
+
+def profile_directive(name, file_record, iline):
+    """
+    Get a context manager timing a directive call, if profiling.
+
+    See Profiler.directive for the parameters.
+    """
+    if _profiler is None:
+        return _null_context()
+    return _profiler.directive(name, file_record, iline)
+
+
+@contextlib.contextmanager
+def _null_context():
+    yield
+
+
+def profiled(name):
+    """
+    Decorator timing every call of a function or method as a phase of the work, if profiling.
+
+    Parameters
+    ----------
+    name : str
+        Name of the phase.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile_phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_slowest_directives(file_records, num_directives):
+    """
+    Find the directive calls that took the longest.
+
+    Parameters
+    ----------
+    file_records : list of dict
+        Records of the rstx files that were processed, as set up by Profiler.file.
+    num_directives : int
+        Maximum number of directive calls to return.
+
+    Returns
+    -------
+    list of (str, dict)
+        List of (rstx file path, directive record) tuples, slowest first.
+    """
+    directive_records = [
+        (file_record['file'], directive_record)
+        for file_record in file_records
+        for directive_record in file_record['directives']
+    ]
+    directive_records.sort(key=lambda item: -item[1]['wall'])
+    return directive_records[:num_directives]
+
+
+def write_report(report_path, report):
+    """
+    Write a profiling report to a JSON file.
+
+    Parameters
+    ----------
+    report_path : str
+        Absolute path to the report file.
+    report : dict
+        The report, as returned by Profiler.get_report.
+    """
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
@@ -0,0 +1,253 @@
+import os
+import sys
+import ast
+import json
+import inspect
+import importlib
+
+
+REGISTRY_FILE_NAME = '.embed_directives.json'
+
+ENTRY_POINT_GROUP = 'sphinx_auto_embed.directives'
+
+
+class LazyDirective(object):
+    """
+    Stand-in for a directive that imports and instantiates the directive class on first use.
+
+    Only NAME is available without importing anything; any other attribute access or a call
+    loads the directive and is forwarded to it.
+    """
+
+    def __init__(self, name, module_name, class_name, module_dir=None):
+        """
+        Parameters
+        ----------
+        name : str
+            NAME of the directive.
+        module_name : str
+            Name of the module defining the directive class.
+        class_name : str
+            Name of the directive class within that module.
+        module_dir : str or None
+            Directory to add to sys.path before importing the module; None if not needed.
+        """
+        self.NAME = name
+        self.module_name = module_name
+        self.class_name = class_name
+        self.module_dir = module_dir
+        self._directive = None
+
+    def load(self):
+        """
+        Import the module and instantiate the directive class, if not done already.
+
+        Returns
+        -------
+        Directive
+            The directive instance.
+        """
+        if self._directive is None:
+            if self.module_dir is not None and self.module_dir not in sys.path:
+                sys.path.append(self.module_dir)
+            module = importlib.import_module(self.module_name)
+            self._directive = getattr(module, self.class_name)()
+        return self._directive
+
+    def reset(self):
+        """
+        Forget the directive instance, so that the next use instantiates the class again.
+
+        This is needed after the module defining the directive class has been reloaded.
+        """
+        self._directive = None
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name == '_directive':
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __call__(self, *args):
+        return self.load()(*args)
+
+
+def scan_directive_file(file_path):
+    """
+    Find the directive classes defined in a module without importing it.
+
+    Parameters
+    ----------
+    file_path : str
+        Absolute path to the module's source file.
+
+    Returns
+    -------
+    list of (str, str) or None
+        Sorted list of (class_name, NAME) tuples; None if a class named Directive* does not set
+        NAME and NUM_ARGS as literals, so the module has to be imported to find its directives.
+    """
+    with open(file_path, 'rb') as f:
+        tree = ast.parse(f.read(), file_path)
+
+    directives = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef) or node.name[:9] != 'Directive':
+            continue
+
+        attributes = {}
+        for statement in node.body:
+            if isinstance(statement, ast.Assign) and len(statement.targets) == 1 \
+                    and isinstance(statement.targets[0], ast.Name):
+                try:
+                    attributes[statement.targets[0].id] = ast.literal_eval(statement.value)
+                except ValueError:
+                    pass
+
+        if 'NAME' not in attributes or 'NUM_ARGS' not in attributes:
+            return None
+
+        directives.append((node.name, attributes['NAME']))
+
+    return sorted(directives)
+
+
+def import_directive_file(module_name, module_dir=None):
+    """
+    Import a module and find its directive classes.
+
+    Parameters
+    ----------
+    module_name : str
+        Name of the module.
+    module_dir : str or None
+        Directory to add to sys.path before importing the module; None if not needed.
+
+    Returns
+    -------
+    list of (str, str)
+        Sorted list of (class_name, NAME) tuples.
+    """
+    if module_dir is not None and module_dir not in sys.path:
+        sys.path.append(module_dir)
+    module = importlib.import_module(module_name)
+
+    directives = []
+    for name, obj in inspect.getmembers(module):
+        if name[:9] == 'Directive':
+            if inspect.isclass(obj) and hasattr(obj, 'NAME') and hasattr(obj, 'NUM_ARGS'):
+                directives.append((name, obj.NAME))
+    return directives
+
+
+def get_entry_point_directives():
+    """
+    Get the directives registered by installed packages.
+
+    Packages register a directive with an entry point in the 'sphinx_auto_embed.directives'
+    group, named after the directive's NAME and pointing to 'module:ClassName'.
+
+    Returns
+    -------
+    list of LazyDirective
+        Directives registered by entry points, sorted by name.
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return []
+
+    all_entry_points = entry_points()
+    if hasattr(all_entry_points, 'select'):
+        group_entry_points = all_entry_points.select(group=ENTRY_POINT_GROUP)
+    else:
+        group_entry_points = all_entry_points.get(ENTRY_POINT_GROUP, [])
+
+    directives = []
+    for entry_point in sorted(group_entry_points, key=lambda entry_point: entry_point.name):
+        module_name, class_name = entry_point.value.split(':')
+        directives.append(LazyDirective(entry_point.name, module_name.strip(), class_name.strip()))
+    return directives
+
+
+class DirectiveRegistry(object):
+    """
+    Map from directive names to the modules and classes that implement them.
+
+    Directive modules are scanned with ast rather than imported, and the results are cached on
+    disk by file modification time and size, so finding the available directives never imports
+    a directive module or its dependencies.
+    """
+
+    VERSION = 1
+
+    def __init__(self, registry_path=None):
+        """
+        Parameters
+        ----------
+        registry_path : str or None
+            Absolute path to the file caching the scanned directive modules; None to not cache.
+        """
+        self.registry_path = registry_path
+        self.files = {}
+        self._modified = False
+
+        if registry_path is not None and os.path.isfile(registry_path):
+            try:
+                with open(registry_path, 'r') as f:
+                    data = json.load(f)
+            except ValueError:
+                data = {}
+            if data.get('version') == self.VERSION:
+                self.files = data['files']
+
+    def save(self):
+        """
+        Write the cache of scanned directive modules to disk, if anything changed.
+        """
+        if self.registry_path is None or not self._modified:
+            return
+
+        # Imported here because sphinx_auto_embed.utils imports this module
+        from sphinx_auto_embed.utils import write_lines_if_changed
+        data = {'version': self.VERSION, 'files': self.files}
+        write_lines_if_changed(self.registry_path, [json.dumps(data, indent=1, sort_keys=True)])
+        self._modified = False
+
+    def get_file_directives(self, file_path, module_name, module_dir=None):
+        """
+        Get lazy directives for the directive classes defined in a module.
+
+        Parameters
+        ----------
+        file_path : str
+            Absolute path to the module's source file.
+        module_name : str
+            Name of the module.
+        module_dir : str or None
+            Directory to add to sys.path before importing the module; None if not needed.
+
+        Returns
+        -------
+        list of LazyDirective
+            Directives defined in the module.
+        """
+        stat = os.stat(file_path)
+        entry = self.files.get(file_path)
+        if entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+            entry = {
+                'mtime': stat.st_mtime,
+                'size': stat.st_size,
+                'directives': scan_directive_file(file_path),
+            }
+            self.files[file_path] = entry
+            self._modified = True
+
+        directives = entry['directives']
+        if directives is None:
+            # The classes could not be found statically, so the module has to be imported.
+            directives = import_directive_file(module_name, module_dir)
+
+        return [
+            LazyDirective(name, module_name, class_name, module_dir)
+            for class_name, name in directives
+        ]
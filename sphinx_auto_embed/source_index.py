@@ -0,0 +1,243 @@
+import io
+import os
+import ast
+import inspect
+
+
+class SourceIndex(object):
+    """
+    Index of the functions, classes, and methods defined in a module's source file.
+
+    The file is read and parsed with ast once, after which the body of any 'function',
+    'Class', or 'Class.method' can be looked up directly.
+    """
+
+    def __init__(self, file_path):
+        """
+        Parameters
+        ----------
+        file_path : str
+            Absolute path to the module's source file.
+        """
+        self.file_path = file_path
+
+        with io.open(file_path, 'r', encoding='utf-8') as f:
+            self.source = f.read()
+
+        self.lines = self.source.split('\n')
+
+        # Map from qualified name to the (start, end) indices of the body in self.lines
+        self.spans = {}
+        self._index_nodes(ast.parse(self.source, file_path).body, '', len(self.lines))
+
+    def _index_nodes(self, nodes, prefix, parent_end):
+        for inode, node in enumerate(nodes):
+            if not isinstance(node, (ast.FunctionDef, ast.ClassDef)) \
+                    and type(node).__name__ != 'AsyncFunctionDef':
+                continue
+
+            name = prefix + node.name
+
+            if hasattr(node, 'end_lineno'):
+                end = node.end_lineno
+            elif inode + 1 < len(nodes):
+                end = nodes[inode + 1].lineno - 1
+            else:
+                end = parent_end
+
+            # Python versions without end_lineno can include trailing blank lines
+            while end > node.lineno and self.lines[end - 1].strip() == '':
+                end -= 1
+
+            # The body starts after the header, which may span several lines, but comments and
+            # blank lines right after the header are part of the body.
+            start = node.body[0].lineno - 1
+            while start > node.lineno and self.lines[start - 1].strip()[:1] in ('', '#'):
+                start -= 1
+
+            self.spans[name] = (start, end)
+
+            if isinstance(node, ast.ClassDef):
+                self._index_nodes(node.body, name + '.', end)
+
+    def get_body_span(self, name):
+        """
+        Get where the body of a function, class, or method is in the file.
+
+        Parameters
+        ----------
+        name : str
+            Qualified name, e.g., 'function', 'Class', or 'Class.method'.
+
+        Returns
+        -------
+        (int, int, int) or None
+            Indices of the first line and of the line after the last one in self.lines, and
+            the indentation of the first line; None if the name is not defined in the file or
+            has an empty body.
+        """
+        if name not in self.spans:
+            return None
+
+        start, end = self.spans[name]
+        if start >= end:
+            return None
+
+        first_line = self.lines[start]
+        return start, end, first_line.find(first_line.strip())
+
+    def get_body_lines(self, name):
+        """
+        Get the dedented lines of the body of a function, class, or method.
+
+        Parameters
+        ----------
+        name : str
+            Qualified name, e.g., 'function', 'Class', or 'Class.method'.
+
+        Returns
+        -------
+        list of str or None
+            Lines of the body without end-of-line characters, dedented by the indentation of the
+            first line and followed by an empty line; None if the name is not defined in the file.
+        """
+        span = self.get_body_span(name)
+        if span is None:
+            return None
+
+        start, end, num_indent = span
+        return [body_line[num_indent:] for body_line in self.lines[start:end]] + ['']
+
+
+# Map from file path to the (mtime, size, SourceIndex) of each indexed file
+_source_indices = {}
+
+
+def get_source_index(module):
+    """
+    Get the source index of a module, parsing the file only if it changed since the last call.
+
+    Parameters
+    ----------
+    module : module
+        The module.
+
+    Returns
+    -------
+    SourceIndex or None
+        The index; None if the module has no source file.
+    """
+    try:
+        file_path = inspect.getsourcefile(module)
+    except TypeError:
+        return None
+
+    if file_path is None:
+        return None
+
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+
+    cached = _source_indices.get(file_path)
+    if cached is None or cached[0] != stat.st_mtime or cached[1] != stat.st_size:
+        cached = (stat.st_mtime, stat.st_size, SourceIndex(file_path))
+        _source_indices[file_path] = cached
+
+    return cached[2]
+
+
+# Code options used when a directive does not set them
+_default_code_options = {
+    'code': 'inline',
+}
+
+
+def parse_code_mode(value):
+    """
+    Check that a way of embedding code is 'inline', to copy the code into the rst file, or
+    'include', to reference it with a literalinclude directive.
+    """
+    value = value.lower()
+    if value not in ('inline', 'include'):
+        raise ValueError('the code should be embedded with inline or include, not {}'.format(
+            value))
+    return value
+
+
+# Keyword options accepted by directives embedding code, mapped to the functions converting them
+CODE_OPTIONS = {
+    'code': parse_code_mode,
+}
+
+
+def set_default_code_options(code_options):
+    """
+    Set the code options used in this process when a directive does not set them.
+
+    Parameters
+    ----------
+    code_options : dict
+        Optionally, 'code': 'inline' to copy the code into the rst file, or 'include' to
+        reference the lines of the source file with a literalinclude directive.
+    """
+    _default_code_options.update(code_options)
+
+
+def get_code_options(options):
+    """
+    Get the complete code options for a directive call.
+
+    Parameters
+    ----------
+    options : dict
+        Code options given in the directive call.
+
+    Returns
+    -------
+    dict
+        The given options, completed with the default code options.
+    """
+    code_options = dict(_default_code_options)
+    code_options.update(
+        (name, value) for name, value in options.items() if name in CODE_OPTIONS)
+    return code_options
+
+
+def get_literalinclude_lines(embed_num_indent, file_dir, file_path, span=None):
+    """
+    Get the lines of a literalinclude directive referencing code in a source file.
+
+    Sphinx reads the file itself, so large code shared by many pages is neither copied into
+    each rst file nor parsed as part of it.
+
+    Parameters
+    ----------
+    embed_num_indent : int
+        Number of spaces to indent the directive by.
+    file_dir : str
+        Absolute path to the directory containing the document, which the path to the source
+        file is made relative to.
+    file_path : str
+        Absolute path to the source file.
+    span : (int, int, int) or None
+        Lines to include and their indentation, as returned by SourceIndex.get_body_span; None
+        to include the whole file.
+
+    Returns
+    -------
+    list of str
+        Lines of the directive, including end-of-line characters and a trailing blank line.
+    """
+    indent = ' ' * embed_num_indent
+    lines = [
+        indent + '.. literalinclude:: {}\n'.format(
+            os.path.relpath(file_path, file_dir).replace(os.sep, '/')),
+        indent + '  :language: python\n',
+    ]
+    if span is not None:
+        start, end, num_indent = span
+        lines.append(indent + '  :lines: {}-{}\n'.format(start + 1, end))
+        if num_indent:
+            lines.append(indent + '  :dedent: {}\n'.format(num_indent))
+    lines.append('\n')
+    return lines
@@ -1,16 +1,241 @@
 import os
+import re
 import sys
-import importlib
-import pkgutil
-import inspect
+import glob
+import difflib
+import fnmatch
+import filecmp
+import itertools
 
+from sphinx_auto_embed.registry import DirectiveRegistry, get_entry_point_directives
 
-def read_embedrc(cwd_abs_path):
+
+# Atomically replaces the destination, which os.rename does not do on Windows.
+_replace = getattr(os, 'replace', os.rename)
+
+
+class OutputChecker(object):
     """
-    Find and read '.embedrc'.
+    Compare generated files to the existing ones instead of writing them.
+
+    While an output checker is set with set_output_checker, write_lines_if_changed and
+    write_bytes_if_changed write nothing; they record every file that is missing or whose
+    contents differ from what would have been written.
+    """
+
+    def __init__(self, max_diff_lines=20):
+        """
+        Parameters
+        ----------
+        max_diff_lines : int
+            Maximum number of lines of unified diff recorded for each text file that differs.
+        """
+        self.max_diff_lines = max_diff_lines
+        self.mismatches = []
+
+    def check_lines(self, file_path, lines):
+        """
+        Compare the lines of a text file to the existing file.
+
+        Returns
+        -------
+        bool
+            True if the file is missing or differs.
+        """
+        new_lines = list(lines)
+
+        if not os.path.isfile(file_path):
+            self.mismatches.append({'path': file_path, 'status': 'missing', 'diff': None})
+            return True
+
+        with open(file_path, 'r') as f:
+            old_lines = f.readlines()
+
+        if old_lines == new_lines:
+            return False
+
+        rel_path = os.path.relpath(file_path)
+        diff = list(itertools.islice(difflib.unified_diff(
+            old_lines, new_lines, rel_path + ' (existing)', rel_path + ' (generated)', n=1),
+            self.max_diff_lines))
+        self.mismatches.append({
+            'path': file_path, 'status': 'differs', 'diff': [line.rstrip('\n') for line in diff]})
+        return True
+
+    def check_bytes(self, file_path, data):
+        """
+        Compare the contents of a binary file to the existing file.
+
+        Returns
+        -------
+        bool
+            True if the file is missing or differs.
+        """
+        if not os.path.isfile(file_path):
+            self.mismatches.append({'path': file_path, 'status': 'missing', 'diff': None})
+            return True
+
+        with open(file_path, 'rb') as f:
+            old_data = f.read()
+
+        if old_data == data:
+            return False
+
+        self.mismatches.append({'path': file_path, 'status': 'differs', 'diff': [
+            '{} bytes existing, {} bytes generated'.format(len(old_data), len(data))]})
+        return True
+
+    def pop_mismatches(self):
+        """
+        Get the mismatches recorded since the last call.
+
+        Returns
+        -------
+        list of dict
+            Dicts with the absolute 'path' of the file, its 'status', 'missing' or 'differs',
+            and a short 'diff' as a list of lines, or None if the file is missing.
+        """
+        mismatches = self.mismatches
+        self.mismatches = []
+        return mismatches
+
+
+# Output checker in use in this process; None when files are written
+_output_checker = None
+
+
+def set_output_checker(output_checker):
+    """
+    Set the output checker that replaces writing files in this process.
+
+    Parameters
+    ----------
+    output_checker : OutputChecker or None
+        The output checker; None to write files.
+    """
+    global _output_checker
+    _output_checker = output_checker
+
+
+def get_output_checker():
+    """
+    Get the output checker that replaces writing files in this process.
+
+    Returns
+    -------
+    OutputChecker or None
+        The output checker; None if files are written.
+    """
+    return _output_checker
+
+
+def write_lines_if_changed(file_path, lines):
+    """
+    Write lines to a file, leaving the file untouched if its contents would not change.
+
+    The lines are streamed to a temporary file next to the destination, which is compared to
+    the existing file and then renamed over it, so the file is never left partially written,
+    even if generating the lines fails midway.
+
+    Parameters
+    ----------
+    file_path : str
+        Absolute path to the file.
+    lines : iterable of str
+        Lines to write, including end-of-line characters; may be a generator.
+
+    Returns
+    -------
+    bool
+        True if the file was written, or would have been with an output checker set; False if
+        it already had these contents.
+    """
+    if _output_checker is not None:
+        return _output_checker.check_lines(file_path, lines)
+
+    tmp_file_path = '{}.{}.tmp'.format(file_path, os.getpid())
+    try:
+        with open(tmp_file_path, 'w') as f:
+            f.writelines(lines)
+
+        if os.path.isfile(file_path) and filecmp.cmp(tmp_file_path, file_path, shallow=False):
+            os.remove(tmp_file_path)
+            return False
+
+        _replace(tmp_file_path, file_path)
+        return True
+    except:
+        if os.path.isfile(tmp_file_path):
+            os.remove(tmp_file_path)
+        raise
+
+
+def write_bytes_if_changed(file_path, data):
+    """
+    Write bytes to a file, leaving the file untouched if its contents would not change.
+
+    Parameters
+    ----------
+    file_path : str
+        Absolute path to the file.
+    data : bytes
+        Contents to write.
+
+    Returns
+    -------
+    bool
+        True if the file was written, or would have been with an output checker set; False if
+        it already had these contents.
+    """
+    if _output_checker is not None:
+        return _output_checker.check_bytes(file_path, data)
+
+    if os.path.isfile(file_path) and os.path.getsize(file_path) == len(data):
+        with open(file_path, 'rb') as f:
+            if f.read() == data:
+                return False
+
+    tmp_file_path = '{}.{}.tmp'.format(file_path, os.getpid())
+    with open(tmp_file_path, 'wb') as f:
+        f.write(data)
+    _replace(tmp_file_path, file_path)
+    return True
+
+
+def read_embedrc_config(cwd_abs_path):
+    """
+    Find and read all settings in '.embedrc'.
 
     From the current working directory (where the script was called), look for '.embedrc' in it
-    and all parent directories.
+    and all parent directories. Each non-empty line of the file has the form 'key = value'.
+    The recognized keys are:
+
+    - custom_directives_dir: directory containing custom directives.
+    - cache_dir: directory for the execution cache; caching is disabled if not set.
+    - cache_max_size: maximum total size of the execution cache in MB.
+    - cache_max_age: number of days after which unused cache entries are evicted.
+    - executor: 'inline' to run embedded code in this process, or 'fork-server'.
+    - preload: comma-separated modules the fork server imports once, in addition to numpy and
+      matplotlib.pyplot.
+    - timeout: number of seconds after which the fork server kills embedded code.
+    - memory_limit: maximum memory in MB of embedded code run by the fork server.
+    - memory_budget: resident set size in MB above which the process running embedded code is
+      replaced by a fresh one; the rstx files are then processed in worker processes.
+    - plot_format: default image format of plots, 'png' (the default), 'svg', or 'webp'.
+    - plot_dpi: default resolution of plots in dots per inch.
+    - plot_figsize: default size of plots in inches, as 'WIDTHxHEIGHT'; '8x6' if not set.
+    - print_head: default number of lines kept at the start of truncated print output.
+    - print_tail: default number of lines kept at the end of truncated print output; print
+      output is only truncated if print_head or print_tail is set.
+    - code: 'inline' (the default) to copy embedded code into the rst files, or 'include' to
+      reference the lines of the source files with literalinclude directives instead.
+    - exclude: comma-separated patterns of files and directories not to search for rstx
+      files, with the syntax of '.gitignore' and relative to the directory of '.embedrc'.
+    - image_store: directory, relative to that of '.embedrc', in which plot images are stored
+      once under the hash of their contents and from which documents reference them; images
+      are written next to the documents if not set.
+    - image_store_links: how images in the store are made available at the paths they would
+      have without it: 'hardlink' (the default), 'symlink', or 'none'.
 
     Parameters
     ----------
@@ -20,11 +245,12 @@ def read_embedrc(cwd_abs_path):
     Returns
     -------
     str or None
-        Absolute path to the directory containing the custom directives; None if not found.
+        Absolute path to the directory containing '.embedrc'; None if not found.
+    dict
+        Map from each key to its value as a str; empty if not found.
     """
     parent_dirs = cwd_abs_path.split('/')
 
-    custom_directives_dir = None
     for i in range(len(parent_dirs)):
         candidate_dir = '/'.join(parent_dirs[:len(parent_dirs)-i])
         candidate_name = candidate_dir + '/.embedrc'
@@ -36,79 +262,477 @@ def read_embedrc(cwd_abs_path):
             with open(candidate_name, 'r') as f:
                 lines = f.readlines()
 
-            # Read in custom_directives_dir
+            config = {}
             for iline, line in enumerate(lines):
-                stripped_line = line.replace(' ', '')
-                if stripped_line[:22] == 'custom_directives_dir=':
-                    custom_directives_dir = candidate_dir + '/' + stripped_line[22:]
-            break
+                if '=' in line:
+                    key, value = line.split('=', 1)
+                    config[key.strip()] = value.strip()
+            return candidate_dir, config
 
-    return custom_directives_dir.replace('\n', '')
+    return None, {}
 
 
-def get_rstx_file_paths(cwd_abs_path):
+def read_embedrc(cwd_abs_path):
     """
-    Get a list of files in this directory and all sub-directories.
+    Find and read '.embedrc'.
+
+    From the current working directory (where the script was called), look for '.embedrc' in it
+    and all parent directories.
 
     Parameters
     ----------
     cwd_abs_path : str
         Absolute path for the current working directory.
 
+    Returns
+    -------
+    str or None
+        Absolute path to the directory containing the custom directives; None if not found.
+    """
+    embedrc_dir, config = read_embedrc_config(cwd_abs_path)
+
+    if 'custom_directives_dir' not in config:
+        return None
+
+    return embedrc_dir + '/' + config['custom_directives_dir']
+
+
+# Directories that never contain documentation sources, skipped without looking inside
+DEFAULT_EXCLUDE_PATTERNS = [
+    '.git/', '.hg/', '.svn/', '.tox/', '.nox/', '__pycache__/', 'node_modules/', '_build/',
+    '*.egg-info/',
+]
+
+
+class ExcludeRule(object):
+    """
+    A single exclude pattern, with the semantics of a line of a '.gitignore' file.
+
+    A pattern ending with '/' only matches directories. A pattern containing another '/' is
+    matched against the path relative to the base directory; otherwise, it is matched against
+    the name of the file or directory at any depth. A pattern starting with '!' re-includes
+    what earlier patterns excluded.
+    """
+
+    def __init__(self, pattern, base_dir):
+        """
+        Parameters
+        ----------
+        pattern : str
+            The pattern, using fnmatch wildcards.
+        base_dir : str
+            Absolute path to the directory the pattern is relative to.
+        """
+        self.base_dir = base_dir
+
+        self.negate = pattern.startswith('!')
+        if self.negate:
+            pattern = pattern[1:]
+
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+
+        if pattern.startswith('**/'):
+            pattern = pattern[3:]
+        self.anchored = '/' in pattern
+        self.pattern = pattern.lstrip('/')
+        self._match = re.compile(fnmatch.translate(self.pattern)).match
+
+    def matches(self, abs_path, name, is_dir):
+        """
+        Check whether the rule matches a file or directory.
+
+        Parameters
+        ----------
+        abs_path : str
+            Absolute path to the file or directory.
+        name : str
+            Name of the file or directory.
+        is_dir : bool
+            Whether it is a directory.
+
+        Returns
+        -------
+        bool
+            True if the pattern matches.
+        """
+        if self.dir_only and not is_dir:
+            return False
+        if self.anchored:
+            if not abs_path.startswith(self.base_dir + '/'):
+                return False
+            return self._match(abs_path[len(self.base_dir) + 1:]) is not None
+        return self._match(name) is not None
+
+
+def read_gitignore_rules(dir_path):
+    """
+    Read the exclude rules of the '.gitignore' file in a directory.
+
+    Parameters
+    ----------
+    dir_path : str
+        Absolute path to the directory.
+
+    Returns
+    -------
+    list of ExcludeRule
+        The rules, in the order of the file; empty if there is no '.gitignore' file.
+    """
+    file_path = dir_path + '/.gitignore'
+    if not os.path.isfile(file_path):
+        return []
+
+    rules = []
+    with open(file_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                rules.append(ExcludeRule(line, dir_path))
+    return rules
+
+
+def get_exclude_rules(embedrc_dir, config):
+    """
+    Get the exclude rules set in '.embedrc', in addition to the default ones.
+
+    Parameters
+    ----------
+    embedrc_dir : str or None
+        Absolute path to the directory containing '.embedrc'.
+    config : dict
+        Settings read from '.embedrc'.
+
+    Returns
+    -------
+    list of ExcludeRule
+        The default rules followed by the rules from the 'exclude' setting.
+    """
+    patterns = list(DEFAULT_EXCLUDE_PATTERNS)
+    if config.get('exclude'):
+        patterns.extend(pattern.strip() for pattern in config['exclude'].split(','))
+
+    return [ExcludeRule(pattern, embedrc_dir or '') for pattern in patterns if pattern]
+
+
+def is_excluded(abs_path, name, is_dir, rules):
+    """
+    Check whether a file or directory is excluded; the last matching rule decides.
+    """
+    excluded = False
+    for rule in rules:
+        if rule.negate == excluded and rule.matches(abs_path, name, is_dir):
+            excluded = not rule.negate
+    return excluded
+
+
+def get_exclude_matcher(rules):
+    """
+    Get a function checking whether a file or directory is excluded by any of the rules.
+
+    Unless a rule re-includes paths, the patterns matched against names are combined into a
+    single regular expression, so the cost barely grows with the number of rules.
+
+    Parameters
+    ----------
+    rules : list of ExcludeRule
+        The rules.
+
+    Returns
+    -------
+    func
+        Function taking the absolute path, the name, and whether it is a directory, and
+        returning True if it is excluded, like is_excluded.
+    """
+    if any(rule.negate for rule in rules):
+        return lambda abs_path, name, is_dir: is_excluded(abs_path, name, is_dir, rules)
+
+    def get_names_match(rules):
+        patterns = [fnmatch.translate(rule.pattern) for rule in rules if not rule.anchored]
+        if not patterns:
+            return lambda name: None
+        return re.compile('|'.join('(?:{})'.format(pattern) for pattern in patterns)).match
+
+    dir_match = get_names_match(rules)
+    file_match = get_names_match([rule for rule in rules if not rule.dir_only])
+    anchored_rules = [rule for rule in rules if rule.anchored]
+
+    def matcher(abs_path, name, is_dir):
+        if (dir_match if is_dir else file_match)(name) is not None:
+            return True
+        return any(rule.matches(abs_path, name, is_dir) for rule in anchored_rules)
+
+    return matcher
+
+
+def is_path_excluded(abs_path, cwd_abs_path, rules):
+    """
+    Check whether a file or directory, or any directory between it and the current working
+    directory, is excluded.
+    """
+    if rules is None:
+        rules = get_exclude_rules(None, {})
+
+    rel_path = os.path.relpath(abs_path, cwd_abs_path)
+    if rel_path.startswith('..'):
+        rel_path = abs_path.lstrip('/')
+        cwd_abs_path = ''
+
+    names = rel_path.split(os.sep)
+    for iname, name in enumerate(names):
+        path = cwd_abs_path + '/' + '/'.join(names[:iname + 1])
+        if is_excluded(path, name, iname + 1 < len(names) or os.path.isdir(abs_path), rules):
+            return True
+    return False
+
+
+def _list_dir(dir_path):
+    """
+    List the files and subdirectories of a directory, without following symbolic links.
+
+    Returns
+    -------
+    list of str
+        Sorted names of the files.
+    list of str
+        Sorted names of the subdirectories.
+    """
+    file_names = []
+    dir_names = []
+    try:
+        if hasattr(os, 'scandir'):
+            for entry in os.scandir(dir_path):
+                if entry.is_dir(follow_symlinks=False):
+                    dir_names.append(entry.name)
+                else:
+                    file_names.append(entry.name)
+        else:
+            for name in os.listdir(dir_path):
+                if os.path.isdir(dir_path + '/' + name) \
+                        and not os.path.islink(dir_path + '/' + name):
+                    dir_names.append(name)
+                else:
+                    file_names.append(name)
+    except OSError:
+        # Unreadable directories are skipped, as os.walk does
+        pass
+
+    return sorted(file_names), sorted(dir_names)
+
+
+def get_rstx_file_paths(cwd_abs_path, exclude_rules=None, use_gitignore=True):
+    """
+    Get a list of rstx files in this directory and all sub-directories.
+
+    Excluded directories are pruned without being listed, as are virtual environments, which
+    are recognized by their 'pyvenv.cfg' file.
+
+    Parameters
+    ----------
+    cwd_abs_path : str
+        Absolute path for the current working directory.
+    exclude_rules : list of ExcludeRule or None
+        Rules excluding files and directories, as returned by get_exclude_rules; None for
+        only the default rules.
+    use_gitignore : bool
+        Whether to also exclude what the '.gitignore' files found along the way exclude.
+
     Returns
     -------
     list of (str, str)
         List of (file_dir, file_name) tuples where file_dir is the directory containing the
-        file and file_name is the name of the file within that directory.
+        file and file_name is the name of the file within that directory, in sorted order.
     """
+    if exclude_rules is None:
+        exclude_rules = get_exclude_rules(None, {})
+
     rstx_file_paths_list = []
 
-    for file_dir, dirs, files in os.walk(cwd_abs_path):
-        for file_name in files:
-            if file_name[-5:] == '.rstx':
+    # Directories are visited depth first, in sorted order, so that the output does not depend
+    # on the file system; each carries the rules of the '.gitignore' files above it.
+    stack = [(cwd_abs_path, exclude_rules, get_exclude_matcher(exclude_rules))]
+    while stack:
+        file_dir, rules, matcher = stack.pop()
+        file_names, dir_names = _list_dir(file_dir)
+
+        if 'pyvenv.cfg' in file_names and file_dir != cwd_abs_path:
+            continue
+
+        if use_gitignore and '.gitignore' in file_names:
+            gitignore_rules = read_gitignore_rules(file_dir)
+            if gitignore_rules:
+                rules = rules + gitignore_rules
+                matcher = get_exclude_matcher(rules)
+
+        for file_name in file_names:
+            if file_name[-5:] == '.rstx' and not matcher(
+                    file_dir + '/' + file_name, file_name, False):
                 rstx_file_paths_list.append((file_dir, file_name))
 
+        for dir_name in reversed(dir_names):
+            if not matcher(file_dir + '/' + dir_name, dir_name, True):
+                stack.append((file_dir + '/' + dir_name, rules, matcher))
+
     return rstx_file_paths_list
 
 
-def get_directives(custom_directives_dir):
+def _get_dir_rules(dir_path, cwd_abs_path, exclude_rules, use_gitignore, memo):
+    """
+    Get the rules that the walk of get_rstx_file_paths from the current working directory
+    applies to the contents of a directory below it, and whether the walk skips the directory.
+
+    Returns
+    -------
+    list of ExcludeRule
+        The exclude rules followed by those of the '.gitignore' files in the current working
+        directory and every directory down to this one, if use_gitignore.
+    bool
+        True if the directory or one above it is excluded or is a virtual environment.
+    """
+    if dir_path not in memo:
+        if dir_path == cwd_abs_path:
+            rules, excluded = exclude_rules, False
+        else:
+            parent_dir, name = os.path.split(dir_path)
+            rules, excluded = _get_dir_rules(
+                parent_dir, cwd_abs_path, exclude_rules, use_gitignore, memo)
+            excluded = excluded or is_excluded(dir_path, name, True, rules) \
+                or os.path.isfile(dir_path + '/pyvenv.cfg')
+
+        if use_gitignore:
+            rules = rules + read_gitignore_rules(dir_path)
+        memo[dir_path] = (rules, excluded)
+
+    return memo[dir_path]
+
+
+def get_target_rstx_file_paths(cwd_abs_path, targets, exclude_rules=None, use_gitignore=True):
     """
-    Get a list of custom directives that ship with sphinx_auto_embed.
+    Get a list of the rstx files selected on the command line.
+
+    Parameters
+    ----------
+    cwd_abs_path : str
+        Absolute path for the current working directory, relative to which targets are given.
+    targets : list of str
+        rstx files, directories to search for rstx files, or glob patterns matching either.
+        Files and directories given explicitly are included even if they match an exclude
+        rule.
+    exclude_rules : list of ExcludeRule or None
+        Rules applied when searching directories and to the paths matched by glob patterns,
+        as in get_rstx_file_paths.
+    use_gitignore : bool
+        Whether to also apply '.gitignore' files, including those in the directories above
+        each target up to the current working directory. Below it, paths matched by glob
+        patterns are left out if get_rstx_file_paths would skip them, which includes those
+        in virtual environments.
+
+    Returns
+    -------
+    list of (str, str)
+        List of (file_dir, file_name) tuples, in sorted order and without duplicates.
+
+    Raises
+    ------
+    ValueError
+        If a target does not exist, matches nothing, or is a file that is not an rstx file.
+    """
+    if exclude_rules is None:
+        exclude_rules = get_exclude_rules(None, {})
+
+    # Rules of the directories below the current working directory, read once for all targets
+    memo = {}
+
+    def get_parent_rules(abs_path):
+        # Rules and exclusion of the directory containing a path, as the walk would find them
+        if not abs_path.startswith(cwd_abs_path + '/'):
+            return exclude_rules, False
+        return _get_dir_rules(
+            os.path.dirname(abs_path), cwd_abs_path, exclude_rules, use_gitignore, memo)
+
+    def is_matched_path_excluded(abs_path):
+        if not abs_path.startswith(cwd_abs_path + '/'):
+            return is_path_excluded(abs_path, cwd_abs_path, exclude_rules)
+
+        is_dir = os.path.isdir(abs_path)
+        rules, excluded = get_parent_rules(abs_path)
+        return excluded or is_excluded(abs_path, os.path.basename(abs_path), is_dir, rules) \
+            or is_dir and os.path.isfile(abs_path + '/pyvenv.cfg')
+
+    rstx_file_paths = set()
+
+    for target in targets:
+        target_path = os.path.normpath(os.path.join(cwd_abs_path, target))
+
+        if glob.has_magic(target):
+            if sys.version_info >= (3, 5):
+                matched_paths = glob.glob(target_path, recursive=True)
+            else:
+                matched_paths = glob.glob(target_path)
+            matched_paths = [
+                matched_path for matched_path in matched_paths
+                if (os.path.isdir(matched_path) or matched_path[-5:] == '.rstx')
+                and not is_matched_path_excluded(matched_path)]
+            if not matched_paths:
+                raise ValueError('no rstx files or directories match {}'.format(target))
+        else:
+            matched_paths = [target_path]
+
+        for matched_path in matched_paths:
+            if os.path.isdir(matched_path):
+                rstx_file_paths.update(get_rstx_file_paths(
+                    matched_path, get_parent_rules(matched_path)[0], use_gitignore))
+            elif not os.path.isfile(matched_path):
+                raise ValueError('{} does not exist'.format(target))
+            elif matched_path[-5:] != '.rstx':
+                raise ValueError('{} is not an rstx file'.format(target))
+            else:
+                rstx_file_paths.add(os.path.split(matched_path))
+
+    return sorted(rstx_file_paths)
+
+
+def get_directives(custom_directives_dir, registry_path=None):
+    """
+    Get a list of the directives that ship with sphinx_auto_embed, custom directives for the
+    current project, and directives registered by installed packages through entry points.
+
+    The directives are returned as lazy stand-ins: a directive module, along with anything it
+    imports, is only imported once a directive from it is actually used.
 
     Parameters
     ----------
     custom_directives_dir : str
         Absolute path to the directory containing custom directives for the current project.
+    registry_path : str or None
+        Absolute path to the file caching the directive classes found in each module.
 
     Returns
     -------
     list of func
         List of functions that process directives.
     """
+    registry = DirectiveRegistry(registry_path)
     directives = []
 
-    directives_module = importlib.import_module('sphinx_auto_embed.directives')
-    directives_dir = os.path.dirname(directives_module.__file__)
+    directives_dir = os.path.dirname(os.path.abspath(__file__)) + '/directives'
 
-    for file_name in os.listdir(directives_dir):
+    for file_name in sorted(os.listdir(directives_dir)):
         if file_name[:9] == 'directive' and file_name[-3:] == '.py':
-            module = importlib.import_module('sphinx_auto_embed.directives.%s' % file_name[:-3])
-
-            for name, obj in inspect.getmembers(module):
-                if name[:9] == 'Directive':
-                    if inspect.isclass(obj) and hasattr(obj, 'NAME') and hasattr(obj, 'NUM_ARGS'):
-                        directives.append(obj())
+            directives.extend(registry.get_file_directives(
+                directives_dir + '/' + file_name,
+                'sphinx_auto_embed.directives.%s' % file_name[:-3]))
 
     if custom_directives_dir is not None:
         for file_dir, dirs, files in os.walk(custom_directives_dir):
-            for file_name in files:
+            dirs.sort()
+            for file_name in sorted(files):
                 if file_name[:9] == 'directive' and file_name[-3:] == '.py':
-                    sys.path.append(file_dir)
-                    module = importlib.import_module(file_name[:-3])
+                    directives.extend(registry.get_file_directives(
+                        file_dir + '/' + file_name, file_name[:-3], file_dir))
+
+    directives.extend(get_entry_point_directives())
 
-                    for name, obj in inspect.getmembers(module):
-                        if name[:9] == 'Directive':
-                            if inspect.isclass(obj) and hasattr(obj, 'NAME') and hasattr(obj, 'NUM_ARGS'):
-                                directives.append(obj())
+    registry.save()
 
     return directives
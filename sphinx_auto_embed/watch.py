@@ -0,0 +1,230 @@
+import os
+import sys
+import time
+
+from six.moves import reload_module
+
+from sphinx_auto_embed.directive import EmbedError, clear_instances
+from sphinx_auto_embed.execution import get_executor
+from sphinx_auto_embed.registry import LazyDirective
+from sphinx_auto_embed.utils import get_rstx_file_paths
+
+
+class Watcher(object):
+    """
+    Keep the process warm and re-embed documents as soon as their inputs change.
+
+    The rstx files and the modules their directives depended on, as recorded in the manifest,
+    are polled for changes to their modification times. Changed modules are reloaded in place,
+    and only the documents whose rstx file or module dependencies changed are processed again,
+    so matplotlib, the directives, and every unchanged module stay imported between edits.
+    """
+
+    def __init__(self, cwd_abs_path, directives_list, manifest, embed_file,
+                 interval=0.2, rescan_interval=2., find_rstx_file_paths=None,
+                 prune_manifest=True):
+        """
+        Parameters
+        ----------
+        cwd_abs_path : str
+            Absolute path for the current working directory, which is searched for rstx files.
+        directives_list : list of Directive
+            Directive instances to apply to the documents.
+        manifest : BuildManifest
+            Manifest recording the module dependencies of each document; kept up to date.
+        embed_file : func
+            Function processing a single rstx file, with the signature of main.embed_file.
+        interval : float
+            Number of seconds between checks for modified files.
+        rescan_interval : float
+            Number of seconds between searches of the directory tree for new or deleted
+            rstx files, which is slower than checking known files.
+        find_rstx_file_paths : func or None
+            Function returning the list of (file_dir, file_name) tuples of the rstx files to
+            watch; None to watch every rstx file under the current working directory.
+        prune_manifest : bool
+            Whether to forget about the manifest entries of rstx files that are not found,
+            which is only correct if every rstx file is searched for.
+        """
+        self.cwd_abs_path = cwd_abs_path
+        self.directives_list = directives_list
+        self.manifest = manifest
+        self.embed_file = embed_file
+        self.interval = interval
+        self.rescan_interval = rescan_interval
+        self.find_rstx_file_paths = find_rstx_file_paths
+        self.prune_manifest = prune_manifest
+
+        self.rstx_file_paths_list = []
+        self.mtimes = {}
+        self.last_scan_time = None
+
+    def scan(self):
+        """
+        Search the directory tree for rstx files, forgetting about those that were deleted.
+        """
+        if self.find_rstx_file_paths is not None:
+            self.rstx_file_paths_list = self.find_rstx_file_paths()
+        else:
+            self.rstx_file_paths_list = get_rstx_file_paths(self.cwd_abs_path)
+        self.last_scan_time = time.time()
+
+        if self.prune_manifest:
+            self.manifest.prune([
+                file_dir + '/' + file_name for file_dir, file_name in self.rstx_file_paths_list])
+
+    def get_module_dependencies(self):
+        """
+        Get the source files of the modules the documents depend on.
+
+        Returns
+        -------
+        dict
+            Map from each source file path to the set of names of the modules loaded from it.
+        """
+        module_dependencies = {}
+        for entry in self.manifest.entries.values():
+            for module_name, (source_path, source_hash) in entry['modules'].items():
+                module_dependencies.setdefault(source_path, set()).add(module_name)
+        return module_dependencies
+
+    def poll(self):
+        """
+        Find the watched files that were modified, created, or deleted since the last poll.
+
+        Returns
+        -------
+        list of str
+            Absolute paths to the changed files.
+        """
+        if time.time() - self.last_scan_time > self.rescan_interval:
+            self.scan()
+
+        watched_paths = set(
+            file_dir + '/' + file_name for file_dir, file_name in self.rstx_file_paths_list)
+        watched_paths.update(self.get_module_dependencies())
+
+        changed_paths = []
+        for file_path in sorted(watched_paths | set(self.mtimes)):
+            try:
+                mtime = os.stat(file_path).st_mtime
+            except OSError:
+                mtime = None
+
+            if mtime != self.mtimes.get(file_path):
+                changed_paths.append(file_path)
+
+            if mtime is None or file_path not in watched_paths:
+                self.mtimes.pop(file_path, None)
+            else:
+                self.mtimes[file_path] = mtime
+
+        return changed_paths
+
+    def reload_modules(self, changed_paths):
+        """
+        Reload the already imported modules whose source files changed.
+
+        Parameters
+        ----------
+        changed_paths : list of str
+            Absolute paths to the changed files.
+        """
+        module_dependencies = self.get_module_dependencies()
+
+        reloaded_module_names = set()
+        for file_path in changed_paths:
+            for module_name in sorted(module_dependencies.get(file_path, [])):
+                module = sys.modules.get(module_name)
+                if module is None:
+                    continue
+
+                try:
+                    reload_module(module)
+                except Exception as e:
+                    print('Failed to reload {}: {}: {}'.format(module_name, type(e).__name__, e))
+                else:
+                    reloaded_module_names.add(module_name)
+
+        # Objects constructed from the old classes are constructed again from the new ones
+        clear_instances(reloaded_module_names)
+
+        # A fork server has its own copies of the modules, so it has to be started again
+        executor = get_executor()
+        if executor is not None and any(
+                file_path in module_dependencies for file_path in changed_paths):
+            executor.stop()
+
+        # Directives defined in a reloaded module are instantiated again from the new class
+        for directive in self.directives_list:
+            if isinstance(directive, LazyDirective) \
+                    and directive.module_name in reloaded_module_names:
+                directive.reset()
+
+    def rebuild(self, file_paths):
+        """
+        Process rstx files, reporting failures instead of raising them.
+
+        Parameters
+        ----------
+        file_paths : list of str
+            Absolute paths to the rstx files.
+        """
+        for file_path in file_paths:
+            file_dir, file_name = os.path.split(file_path)
+            new_file_path = file_path[:-5] + '.rst'
+
+            start_time = time.time()
+            try:
+                result = self.embed_file(file_dir, file_name, self.directives_list)
+            except EmbedError as e:
+                print(e)
+                continue
+            except Exception as e:
+                # E.g., a half-saved module that fails to import; it is fixed by the next save
+                print('In file {}: {}: {}'.format(file_path, type(e).__name__, e))
+                continue
+
+            self.manifest.update(file_path, result.dependencies, [new_file_path] + result.outputs)
+            print('{} {} ({:.2f} s)'.format(
+                'Updated' if result.rst_written else 'Unchanged',
+                os.path.relpath(new_file_path, self.cwd_abs_path), time.time() - start_time))
+
+        self.manifest.save()
+
+    def run(self):
+        """
+        Process all out-of-date documents, then watch for changes until interrupted.
+        """
+        self.scan()
+        self.rebuild([
+            file_dir + '/' + file_name for file_dir, file_name in self.rstx_file_paths_list
+            if not self.manifest.is_up_to_date(file_dir + '/' + file_name)
+        ])
+        self.poll()
+
+        print('Watching for changes; press Ctrl+C to stop.')
+        try:
+            while True:
+                time.sleep(self.interval)
+
+                changed_paths = self.poll()
+                if not changed_paths:
+                    continue
+
+                self.manifest.forget_hashes(changed_paths)
+                self.reload_modules(changed_paths)
+
+                changed_paths = set(changed_paths)
+                affected_file_paths = []
+                for file_dir, file_name in self.rstx_file_paths_list:
+                    file_path = file_dir + '/' + file_name
+                    entry = self.manifest.get_entry(file_path)
+                    if file_path in changed_paths or entry is None or any(
+                            source_path in changed_paths
+                            for source_path, source_hash in entry['modules'].values()):
+                        affected_file_paths.append(file_path)
+
+                self.rebuild(affected_file_paths)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,184 @@
+import os
+import pickle
+import traceback
+import multiprocessing
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from sphinx_auto_embed.profiling import get_rss
+
+
+# Number of seconds between checks that the workers are still alive while waiting for results
+POLL_INTERVAL = 1.
+
+
+class WorkerError(Exception):
+    """
+    Error raised when a worker process dies, or raises an exception that cannot be pickled.
+    """
+    pass
+
+
+def _run_worker(task_queue, result_queue, func, memory_budget, initializer, initargs):
+    """
+    Main loop of a worker: call func on each task until told to stop or over the memory budget.
+    """
+    if initializer is not None:
+        initializer(*initargs)
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+
+        index, item = task
+        try:
+            message = ('ok', func(item))
+        except BaseException as e:
+            try:
+                pickle.dumps(e)
+                message = ('error', e)
+            except Exception:
+                message = ('error', WorkerError('{}: {}\n{}'.format(
+                    type(e).__name__, e, traceback.format_exc())))
+
+        # The worker only exits after sending its result and before taking another task, so
+        # no task is lost when it is replaced.
+        rss = get_rss()
+        recycle = memory_budget is not None and rss is not None and rss > memory_budget
+        result_queue.put((os.getpid(), index, message, recycle))
+        if recycle:
+            return
+
+
+class RecyclingPool(object):
+    """
+    Pool of worker processes, each replaced by a fresh one once it uses more memory than a budget.
+
+    Figures, caches, and modules left behind by embedded code accumulate in the process that
+    runs it. With a memory budget, a worker whose resident set size exceeds the budget after a
+    task exits, and a new worker, set up with the same initializer, takes over the next tasks.
+    """
+
+    def __init__(self, num_workers, memory_budget=None, initializer=None, initargs=()):
+        """
+        Parameters
+        ----------
+        num_workers : int
+            Number of worker processes working at the same time.
+        memory_budget : float or None
+            Resident set size in bytes above which a worker is replaced; None for no limit.
+        initializer : callable or None
+            Function called with initargs at the start of each worker.
+        initargs : tuple
+            Arguments of the initializer.
+        """
+        self.num_workers = num_workers
+        self.memory_budget = memory_budget
+        self.initializer = initializer
+        self.initargs = initargs
+        self.num_recycled = 0
+        self._workers = {}
+
+    def _start_worker(self, func, task_queue, result_queue):
+        worker = multiprocessing.Process(
+            target=_run_worker,
+            args=(task_queue, result_queue, func, self.memory_budget, self.initializer,
+                  self.initargs))
+        worker.daemon = True
+        worker.start()
+        self._workers[worker.pid] = worker
+
+    def imap(self, func, items, ordered=True):
+        """
+        Call a function on each item in the worker processes.
+
+        Parameters
+        ----------
+        func : callable
+            Function taking a single item, defined at the top level of a module.
+        items : list
+            The items.
+        ordered : bool
+            Whether to yield the results in the order of the items; otherwise, each result is
+            yielded as soon as it is ready.
+
+        Yields
+        ------
+        object
+            The return value of func for each item. An exception raised by func is raised
+            again here, stopping the iteration.
+        """
+        task_queue = multiprocessing.Queue()
+        result_queue = multiprocessing.Queue()
+        for index, item in enumerate(items):
+            task_queue.put((index, item))
+
+        try:
+            for i in range(min(self.num_workers, len(items))):
+                self._start_worker(func, task_queue, result_queue)
+
+            results = {}
+            next_index = 0
+            num_received = 0
+            # Ids of the workers seen to have exited normally before their last result arrived
+            exited_pids = set()
+            while num_received < len(items):
+                try:
+                    pid, index, message, recycle = result_queue.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    for worker_pid, worker in self._workers.items():
+                        if worker.exitcode is None:
+                            continue
+
+                        # A worker over the memory budget exits right after sending its result,
+                        # which may not have been received yet; it is only considered dead if
+                        # the result has still not arrived by the next poll.
+                        if worker.exitcode == 0 and worker_pid not in exited_pids:
+                            exited_pids.add(worker_pid)
+                            continue
+
+                        raise WorkerError(
+                            'a worker process died with exit code {}'.format(worker.exitcode))
+                    continue
+
+                num_received += 1
+                if recycle:
+                    self._workers.pop(pid).join()
+                    self.num_recycled += 1
+                    if num_received + len(self._workers) < len(items):
+                        self._start_worker(func, task_queue, result_queue)
+
+                status, value = message
+                if status == 'error':
+                    raise value
+
+                if not ordered:
+                    yield value
+                    continue
+
+                results[index] = value
+                while next_index in results:
+                    yield results.pop(next_index)
+                    next_index += 1
+
+            for worker in self._workers.values():
+                task_queue.put(None)
+            for worker in self._workers.values():
+                worker.join()
+            self._workers = {}
+        finally:
+            self.terminate()
+
+    def terminate(self):
+        """
+        Stop all worker processes immediately.
+        """
+        for worker in self._workers.values():
+            worker.terminate()
+        for worker in self._workers.values():
+            worker.join()
+        self._workers = {}
@@ -7,20 +7,26 @@ class DirectiveEmbedOptions(Directive):
     """
     Directive for embedding a table from an OptionsDictionary instance.
 
-    The 3 arguments are the module name, class name, and attribute name.
+    The 3 arguments are the module name, class name, and attribute name. Several attribute
+    names separated by spaces embed one table for each, all from the same instance.
     """
 
     NAME = 'embed-options-table'
     NUM_ARGS = 3
 
     def run(self, file_dir, file_name, embed_num_indent, args):
-        module_path, class_name, attribute_name = args
+        module_path, class_name, attribute_names = args
 
-        exec('from {} import {}'.format(module_path, class_name), globals())
-        exec('obj = {}()'.format(class_name), globals())
+        obj = self.get_instance(module_path, class_name)
 
-        options = getattr(obj, attribute_name)
+        lines = []
+        for attribute_name in attribute_names.split():
+            if lines:
+                lines.append('\n')
+            lines.extend(self.get_table_lines(embed_num_indent, getattr(obj, attribute_name)))
+        return lines
 
+    def get_table_lines(self, embed_num_indent, options):
         outputs = []
         for option_name, option_data in iteritems(options._declared_entries):
             name = option_name
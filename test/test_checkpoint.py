@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from sphinx_auto_embed.checkpoint import Checkpoint, CHECKPOINT_FILE_NAME
+
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EXAMPLES_SOURCE = '''import os
+
+
+def log(name):
+    with open('runs.log', 'a') as f:
+        f.write(name + '\\n')
+
+
+class Examples(object):
+
+    def a(self):
+        from pkg.examples import log
+        log('a')
+        print('a')
+
+    def b(self):
+        from pkg.examples import log
+        log('b')
+        if os.path.exists('fail'):
+            raise ValueError('b failed')
+        print('b')
+
+    def c(self):
+        from pkg.examples import log
+        log('c')
+        print('c')
+'''
+
+DOCUMENT_SOURCE = '''Page
+====
+
+.. embed-test-print :: pkg.examples, Examples, {}
+'''
+
+
+class TestCheckpoint(unittest.TestCase):
+    """
+    The checkpoint records which of the files to process were completed, failed, or not reached.
+    """
+
+    def setUp(self):
+        self.temp_dir = os.path.realpath(tempfile.mkdtemp())
+        self.checkpoint_path = self.temp_dir + '/' + CHECKPOINT_FILE_NAME
+        self.file_paths = [self.temp_dir + '/docs/{}.rstx'.format(name) for name in 'abc']
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_remaining_files(self):
+        checkpoint = Checkpoint(self.checkpoint_path)
+        checkpoint.add_pending(self.file_paths)
+        checkpoint.record(self.file_paths[0], [])
+        checkpoint.record(self.file_paths[1], [{'line': 4, 'directive': 'x', 'error': 'e'}])
+
+        self.assertFalse(checkpoint.is_remaining(self.file_paths[0]))
+        self.assertTrue(checkpoint.is_remaining(self.file_paths[1]))
+        self.assertTrue(checkpoint.is_remaining(self.file_paths[2]))
+        self.assertFalse(checkpoint.is_remaining(self.temp_dir + '/docs/other.rstx'))
+
+    def test_failed_file_completed_later(self):
+        checkpoint = Checkpoint(self.checkpoint_path)
+        checkpoint.add_pending(self.file_paths[:1])
+        checkpoint.record(self.file_paths[0], [{'line': 4, 'directive': 'x', 'error': 'e'}])
+        checkpoint.record(self.file_paths[0], [])
+        self.assertFalse(checkpoint.is_remaining(self.file_paths[0]))
+        self.assertEqual(checkpoint.failed, {})
+
+    def test_pending_again_after_completion(self):
+        checkpoint = Checkpoint(self.checkpoint_path)
+        checkpoint.add_pending(self.file_paths[:1])
+        checkpoint.record(self.file_paths[0], [])
+        checkpoint.add_pending(self.file_paths[:1])
+        self.assertTrue(checkpoint.is_remaining(self.file_paths[0]))
+
+    def test_save_and_load(self):
+        checkpoint = Checkpoint(self.checkpoint_path)
+        checkpoint.add_pending(self.file_paths)
+        checkpoint.record(self.file_paths[0], [])
+        checkpoint.record(self.file_paths[1], [{'line': 4, 'directive': 'x', 'error': 'e'}])
+        checkpoint.save()
+
+        loaded = Checkpoint(self.checkpoint_path)
+        self.assertTrue(loaded.load())
+        self.assertEqual(
+            [loaded.is_remaining(file_path) for file_path in self.file_paths],
+            [False, True, True])
+        self.assertEqual(loaded.failed, {
+            os.path.join('docs', 'b.rstx'): [{'line': 4, 'directive': 'x', 'error': 'e'}]})
+
+        checkpoint.remove()
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+        self.assertFalse(Checkpoint(self.checkpoint_path).load())
+
+    def test_record_saves_when_due(self):
+        checkpoint = Checkpoint(self.checkpoint_path, save_interval=0.)
+        checkpoint.add_pending(self.file_paths)
+        checkpoint.record(self.file_paths[0], [])
+        self.assertTrue(os.path.isfile(self.checkpoint_path))
+
+        checkpoint = Checkpoint(self.checkpoint_path + '.2', save_interval=3600.)
+        checkpoint.add_pending(self.file_paths)
+        checkpoint.record(self.file_paths[0], [])
+        self.assertFalse(os.path.isfile(self.checkpoint_path + '.2'))
+
+    def test_incompatible_checkpoint_is_ignored(self):
+        with open(self.checkpoint_path, 'w') as f:
+            json.dump({'version': Checkpoint.VERSION + 1, 'pending': [], 'completed': [],
+                       'failed': {}}, f)
+        self.assertFalse(Checkpoint(self.checkpoint_path).load())
+
+        with open(self.checkpoint_path, 'w') as f:
+            f.write('{"version": ')
+        self.assertFalse(Checkpoint(self.checkpoint_path).load())
+
+
+class TestResume(unittest.TestCase):
+    """
+    A run resumed after a failure only processes the files that failed or were not reached.
+    """
+
+    def setUp(self):
+        self.project_dir = os.path.realpath(tempfile.mkdtemp())
+        os.makedirs(self.project_dir + '/pkg')
+        os.makedirs(self.project_dir + '/docs')
+        self.write('.embedrc', '')
+        self.write('pkg/__init__.py', '')
+        self.write('pkg/examples.py', EXAMPLES_SOURCE)
+        for name in 'abc':
+            self.write('docs/{}.rstx'.format(name), DOCUMENT_SOURCE.format(name))
+
+    def tearDown(self):
+        shutil.rmtree(self.project_dir)
+
+    def write(self, rel_path, text):
+        with open(self.project_dir + '/' + rel_path, 'w') as f:
+            f.write(text)
+
+    def pop_runs(self):
+        log_path = self.project_dir + '/runs.log'
+        if not os.path.isfile(log_path):
+            return []
+        with open(log_path, 'r') as f:
+            runs = f.read().split()
+        os.remove(log_path)
+        return runs
+
+    def embed(self, *args):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([self.project_dir, PACKAGE_DIR])
+        process = subprocess.Popen(
+            [sys.executable, '-c',
+             'import sys; from sphinx_auto_embed.main import main; sys.exit(main())'] +
+            list(args),
+            cwd=self.project_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        process.communicate()
+        return process.returncode
+
+    def test_resume_after_failure(self):
+        self.write('fail', '')
+        self.assertEqual(self.embed('--keep-going'), 1)
+        self.assertEqual(self.pop_runs(), ['a', 'b', 'c'])
+        self.assertTrue(os.path.isfile(self.project_dir + '/docs/a.rst'))
+        self.assertFalse(os.path.isfile(self.project_dir + '/docs/b.rst'))
+        self.assertTrue(os.path.isfile(self.project_dir + '/' + CHECKPOINT_FILE_NAME))
+
+        # Even with --force, only the failed file is processed again
+        os.remove(self.project_dir + '/fail')
+        self.assertEqual(self.embed('--force', '--resume'), 0)
+        self.assertEqual(self.pop_runs(), ['b'])
+        self.assertTrue(os.path.isfile(self.project_dir + '/docs/b.rst'))
+        self.assertFalse(os.path.isfile(self.project_dir + '/' + CHECKPOINT_FILE_NAME))
+
+    def test_resume_after_stopping_at_failure(self):
+        self.write('fail', '')
+        self.assertEqual(self.embed(), 1)
+        self.assertEqual(self.pop_runs(), ['a', 'b'])
+
+        os.remove(self.project_dir + '/fail')
+        self.assertEqual(self.embed('--force', '--resume'), 0)
+        self.assertEqual(self.pop_runs(), ['b', 'c'])
+
+    def test_resume_without_checkpoint(self):
+        self.assertEqual(self.embed('--resume'), 0)
+        self.assertEqual(self.pop_runs(), ['a', 'b', 'c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EXAMPLES_SOURCE = '''class Examples(object):
+
+    def value(self):
+        from pkg.helper import VALUE
+        print(VALUE)
+'''
+
+DOCUMENT_SOURCE = '''Page
+====
+
+.. embed-test-print :: pkg.examples, Examples, value
+'''
+
+
+class TestSnippetDependencies(unittest.TestCase):
+    """
+    Documents are processed again when a project module imported by their embedded code changes.
+    """
+
+    def setUp(self):
+        self.project_dir = os.path.realpath(tempfile.mkdtemp())
+        os.makedirs(self.project_dir + '/pkg')
+        os.makedirs(self.project_dir + '/docs')
+        self.write('.embedrc', '')
+        self.write('pkg/__init__.py', '')
+        self.write('pkg/helper.py', 'VALUE = 8\n')
+        self.write('pkg/examples.py', EXAMPLES_SOURCE)
+        self.write('docs/c.rstx', DOCUMENT_SOURCE)
+
+    def tearDown(self):
+        shutil.rmtree(self.project_dir)
+
+    def write(self, rel_path, text):
+        with open(self.project_dir + '/' + rel_path, 'w') as f:
+            f.write(text)
+
+    def read(self, rel_path):
+        with open(self.project_dir + '/' + rel_path, 'r') as f:
+            return f.read()
+
+    def embed(self, *args):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([self.project_dir, PACKAGE_DIR])
+        subprocess.check_call(
+            [sys.executable, '-c',
+             'import sys; from sphinx_auto_embed.main import main; sys.exit(main())'] +
+            list(args),
+            cwd=self.project_dir, env=env, stdout=subprocess.PIPE)
+
+    def test_edited_helper_module(self):
+        self.embed()
+        self.assertIn('  8\n', self.read('docs/c.rst'))
+
+        self.write('pkg/helper.py', 'VALUE = 9\n')
+        self.embed()
+        self.assertIn('  9\n', self.read('docs/c.rst'))
+
+    def test_depfile_lists_helper_module(self):
+        self.embed('--depfiles')
+        # The first rule has the rst file as target and one dependency per line
+        rule = self.read('docs/c.rst.d').split('\n\n')[0]
+        dependency_paths = [line.strip(' \\') for line in rule.split('\n')[1:]]
+        self.assertIn('pkg/helper.py', dependency_paths)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+
+from sphinx_auto_embed.directive import Directive, EmbedError
+from sphinx_auto_embed.execution import PLOT_OPTIONS, get_plot_options
+
+
+class DirectiveRecordArgs(Directive):
+    """
+    Directive replacing its line with the positional arguments and options it was called with.
+    """
+
+    NAME = 'record-args'
+    NUM_ARGS = 2
+    OPTIONS = dict(PLOT_OPTIONS, count=int)
+
+    def run(self, file_dir, file_name, embed_num_indent, args):
+        return [' ' * embed_num_indent + repr((args, sorted(self.options.items()))) + '\n']
+
+
+class DirectiveFail(Directive):
+    """
+    Directive whose task fails with an error other than an EmbedError.
+    """
+
+    NAME = 'fail'
+    NUM_ARGS = 0
+
+    def run(self, file_dir, file_name, embed_num_indent, args):
+        return {}['missing']
+
+
+class TestDirectiveCall(unittest.TestCase):
+    """
+    Directive calls are split into positional arguments and 'name=value' options, and
+    incorrect calls raise an EmbedError with the file name and line number.
+    """
+
+    def call(self, line, directive_class=DirectiveRecordArgs):
+        return directive_class()('/project/docs', 'index.rstx', 6, line)
+
+    def get_error(self, line, directive_class=DirectiveRecordArgs):
+        with self.assertRaises(EmbedError) as context:
+            self.call(line, directive_class)
+        return context.exception
+
+    def test_positional_args(self):
+        self.assertEqual(
+            self.call('.. record-args :: a, b\n'), [repr((['a', 'b'], [])) + '\n'])
+
+    def test_indentation(self):
+        self.assertEqual(
+            self.call('    .. record-args :: a, b\n'), ['    ' + repr((['a', 'b'], [])) + '\n'])
+
+    def test_options(self):
+        self.assertEqual(
+            self.call('.. record-args :: a, figsize = 4x3, b, dpi=150, count=2\n'),
+            [repr((['a', 'b'], [('count', 2), ('dpi', 150.), ('figsize', (4., 3.))])) + '\n'])
+
+    def test_option_value_containing_equals_sign(self):
+        error = self.get_error('.. record-args :: a, b, count=1=2\n')
+        self.assertIn('invalid value "1=2" for option "count"', error.reason)
+
+    def test_unknown_option(self):
+        error = self.get_error('.. record-args :: a, b, size=2\n')
+        self.assertEqual(error.reason, 'unknown option "size" for directive "record-args".')
+        self.assertEqual(
+            str(error), 'In file /project/docs/index.rstx line 7: ' + error.reason)
+
+    def test_invalid_option_value(self):
+        error = self.get_error('.. record-args :: a, b, figsize=4\n')
+        self.assertIn('invalid value "4" for option "figsize"', error.reason)
+
+        error = self.get_error('.. record-args :: a, b, format=gif\n')
+        self.assertIn('invalid value "gif" for option "format"', error.reason)
+
+    def test_options_are_not_counted_as_args(self):
+        error = self.get_error('.. record-args :: a, dpi=100\n')
+        self.assertEqual(
+            error.reason,
+            'there should be 2 arguments for directive "record-args", separated by commas.')
+
+    def test_too_many_args(self):
+        error = self.get_error('.. record-args :: a, b, c\n')
+        self.assertIn('there should be 2 arguments', error.reason)
+
+    def test_no_args(self):
+        error = self.get_error('.. record-args ::\n')
+        self.assertIn('there should be 2 arguments', error.reason)
+
+    def test_text_before_directive(self):
+        error = self.get_error('text .. record-args :: a, b\n')
+        self.assertIn('there should only be white spaces before the directive', error.reason)
+
+    def test_double_colons_twice(self):
+        error = self.get_error('.. record-args :: a :: b\n')
+        self.assertEqual(error.reason, '"::" should only appear once.')
+
+    def test_other_errors_are_wrapped(self):
+        error = self.get_error('.. fail ::\n', DirectiveFail)
+        self.assertEqual(error.reason, "KeyError: 'missing'")
+        # The KeyError is not printed again as the context of the EmbedError
+        self.assertTrue(getattr(error, '__suppress_context__', True))
+
+    def test_default_plot_options_are_completed(self):
+        plot_options = get_plot_options({'dpi': 150.})
+        self.assertEqual(plot_options['dpi'], 150.)
+        self.assertEqual(plot_options['format'], 'png')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sphinx_auto_embed.utils import ExcludeRule, is_excluded, get_exclude_matcher, \
+    get_exclude_rules, get_rstx_file_paths, get_target_rstx_file_paths
+
+
+class TestExcludeRule(unittest.TestCase):
+    """
+    Exclude patterns follow the semantics of the lines of a '.gitignore' file.
+    """
+
+    def matches(self, pattern, rel_path, is_dir=False):
+        rule = ExcludeRule(pattern, '/project')
+        return rule.matches('/project/' + rel_path, rel_path.split('/')[-1], is_dir)
+
+    def test_name_pattern_matches_at_any_depth(self):
+        self.assertTrue(self.matches('*.rstx', 'a.rstx'))
+        self.assertTrue(self.matches('*.rstx', 'docs/api/a.rstx'))
+        self.assertFalse(self.matches('*.rstx', 'docs/a.rst'))
+
+    def test_dir_only_pattern(self):
+        self.assertTrue(self.matches('build/', 'docs/build', is_dir=True))
+        self.assertFalse(self.matches('build/', 'docs/build', is_dir=False))
+
+    def test_pattern_with_slash_is_anchored(self):
+        self.assertTrue(self.matches('docs/build', 'docs/build', is_dir=True))
+        self.assertFalse(self.matches('docs/build', 'sub/docs/build', is_dir=True))
+
+    def test_leading_slash_is_anchored(self):
+        self.assertTrue(self.matches('/build', 'build', is_dir=True))
+        self.assertFalse(self.matches('/build', 'docs/build', is_dir=True))
+
+    def test_leading_double_star_is_not_anchored(self):
+        self.assertTrue(self.matches('**/build', 'build', is_dir=True))
+        self.assertTrue(self.matches('**/build', 'docs/build', is_dir=True))
+
+    def test_anchored_pattern_outside_base_dir(self):
+        rule = ExcludeRule('docs/*.rstx', '/project')
+        self.assertFalse(rule.matches('/other/docs/a.rstx', 'a.rstx', False))
+
+    def test_negation_re_includes(self):
+        rules = [ExcludeRule('*.rstx', '/project'), ExcludeRule('!keep.rstx', '/project')]
+        self.assertTrue(is_excluded('/project/a.rstx', 'a.rstx', False, rules))
+        self.assertFalse(is_excluded('/project/keep.rstx', 'keep.rstx', False, rules))
+
+    def test_last_matching_rule_decides(self):
+        rules = [ExcludeRule('!keep.rstx', '/project'), ExcludeRule('*.rstx', '/project')]
+        self.assertTrue(is_excluded('/project/keep.rstx', 'keep.rstx', False, rules))
+
+    def test_matcher_agrees_with_is_excluded(self):
+        rules = get_exclude_rules('/project', {'exclude': 'drafts/, docs/old/*, *.tmp.rstx'})
+        matcher = get_exclude_matcher(rules)
+        for rel_path, is_dir in [
+                ('drafts', True), ('drafts', False), ('docs/old/a.rstx', False),
+                ('old/a.rstx', False), ('a.tmp.rstx', False), ('a.rstx', False),
+                ('_build', True), ('sub/.git', True), ('pkg.egg-info', True)]:
+            abs_path = '/project/' + rel_path
+            name = rel_path.split('/')[-1]
+            self.assertEqual(
+                matcher(abs_path, name, is_dir), is_excluded(abs_path, name, is_dir, rules),
+                rel_path)
+
+
+class TestDiscovery(unittest.TestCase):
+    """
+    Discovery skips what exclude rules, '.gitignore' files, and virtual environments exclude.
+    """
+
+    def setUp(self):
+        self.project_dir = os.path.realpath(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.project_dir)
+
+    def write(self, rel_path, text=''):
+        abs_path = self.project_dir + '/' + rel_path
+        if not os.path.isdir(os.path.dirname(abs_path)):
+            os.makedirs(os.path.dirname(abs_path))
+        with open(abs_path, 'w') as f:
+            f.write(text)
+
+    def get_rel_paths(self, file_paths):
+        return [os.path.relpath(file_dir + '/' + file_name, self.project_dir)
+                for file_dir, file_name in file_paths]
+
+    def find(self, **kwargs):
+        return self.get_rel_paths(get_rstx_file_paths(self.project_dir, **kwargs))
+
+    def find_targets(self, targets):
+        return self.get_rel_paths(get_target_rstx_file_paths(self.project_dir, targets))
+
+    def test_default_rules(self):
+        self.write('a.rstx')
+        self.write('_build/b.rstx')
+        self.write('.git/c.rstx')
+        self.assertEqual(self.find(), ['a.rstx'])
+
+    def test_nested_gitignore_is_relative_to_its_directory(self):
+        self.write('docs/a.rstx')
+        self.write('docs/gen/b.rstx')
+        self.write('gen/c.rstx')
+        self.write('docs/.gitignore', '# generated\n\n/gen/\n')
+        self.assertEqual(self.find(), ['docs/a.rstx', 'gen/c.rstx'])
+
+    def test_gitignore_negation(self):
+        self.write('a.rstx')
+        self.write('b.rstx')
+        self.write('.gitignore', '*.rstx\n!b.rstx\n')
+        self.assertEqual(self.find(), ['b.rstx'])
+
+    def test_negation_cannot_re_include_file_in_excluded_directory(self):
+        self.write('build/keep.rstx')
+        self.write('.gitignore', 'build/\n!build/keep.rstx\n')
+        self.assertEqual(self.find(), [])
+
+    def test_gitignore_can_be_disabled(self):
+        self.write('a.rstx')
+        self.write('.gitignore', '*.rstx\n')
+        self.assertEqual(self.find(), [])
+        self.assertEqual(self.find(use_gitignore=False), ['a.rstx'])
+
+    def test_virtualenv_is_skipped(self):
+        self.write('a.rstx')
+        self.write('env/pyvenv.cfg')
+        self.write('env/lib/b.rstx')
+        self.assertEqual(self.find(), ['a.rstx'])
+
+    def test_glob_target_applies_gitignore_of_parent_directories(self):
+        self.write('docs/a.rstx')
+        self.write('docs/draft.rstx')
+        self.write('.gitignore', 'draft.rstx\n')
+        self.assertEqual(self.find_targets(['docs/*.rstx']), ['docs/a.rstx'])
+
+    def test_glob_target_skips_virtualenv(self):
+        self.write('docs/a.rstx')
+        self.write('env/pyvenv.cfg')
+        self.write('env/docs/b.rstx')
+        self.assertEqual(self.find_targets(['**/*.rstx']), ['docs/a.rstx'])
+        self.assertRaises(ValueError, self.find_targets, ['env/**/*.rstx'])
+
+    def test_explicit_target_is_included_even_if_ignored(self):
+        self.write('draft.rstx')
+        self.write('.gitignore', 'draft.rstx\n')
+        self.assertEqual(self.find_targets(['draft.rstx']), ['draft.rstx'])
+
+    def test_directory_target_inherits_parent_gitignore(self):
+        self.write('docs/api/a.rstx')
+        self.write('docs/api/gen/b.rstx')
+        self.write('docs/.gitignore', 'gen/\n')
+        self.assertEqual(self.find_targets(['docs/api']), ['docs/api/a.rstx'])
+
+    def test_missing_target(self):
+        self.assertRaises(ValueError, self.find_targets, ['missing.rstx'])
+
+
+if __name__ == '__main__':
+    unittest.main()
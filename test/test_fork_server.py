@@ -0,0 +1,101 @@
+import os
+import unittest
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from sphinx_auto_embed.fork_server import ForkServerExecutor, SnippetError
+
+
+def get_address_space_size():
+    """
+    Get the size of the address space of this process in MB, or None if it cannot be read.
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmSize:'):
+                    return int(line.split()[1]) / 1e3
+    except IOError:
+        pass
+    return None
+
+
+@unittest.skipIf(not hasattr(os, 'fork'), 'the fork server needs os.fork')
+class TestForkServerExecutor(unittest.TestCase):
+    """
+    Snippets run in forked children, which are killed after the timeout and limited in memory.
+    """
+
+    def setUp(self):
+        self.executor = None
+
+    def tearDown(self):
+        if self.executor is not None:
+            self.executor.stop()
+
+    def start(self, **kwargs):
+        self.executor = ForkServerExecutor(**kwargs)
+        self.executor.start()
+        return self.executor
+
+    def test_output(self):
+        executor = self.start()
+        self.assertEqual(executor.execute(['print(6 * 7)']).stdout, '42\n')
+
+    def test_globals_do_not_leak_between_snippets(self):
+        executor = self.start()
+        executor.execute(['leaked = 1'])
+        with self.assertRaises(SnippetError) as context:
+            executor.execute(['print(leaked)'])
+        self.assertIn('NameError', str(context.exception))
+
+    def test_timeout(self):
+        executor = self.start(timeout=0.5)
+        with self.assertRaises(SnippetError) as context:
+            executor.execute(['while True:', '    pass'])
+        self.assertIn('TimeoutError', str(context.exception))
+
+        # The server goes on with the next snippets
+        self.assertEqual(executor.execute(['print(1)']).stdout, '1\n')
+
+    @unittest.skipIf(
+        resource is None or get_address_space_size() is None,
+        'address space limits cannot be set or measured on this platform')
+    def test_memory_limit(self):
+        # The children start with the address space of this process
+        executor = self.start(memory_limit=get_address_space_size() + 200)
+        with self.assertRaises(SnippetError) as context:
+            executor.execute(['data = bytearray(2 * 10 ** 9)'])
+        self.assertIn('MemoryError', str(context.exception))
+
+        self.assertEqual(executor.execute(['print(len(bytearray(10 ** 6)))']).stdout, '1000000\n')
+
+    def test_crash(self):
+        executor = self.start()
+        with self.assertRaises(SnippetError) as context:
+            executor.execute(['import os', 'os._exit(3)'])
+        self.assertIn('crashed', str(context.exception))
+
+        self.assertEqual(executor.execute(['print(1)']).stdout, '1\n')
+
+    def test_traceback_of_snippet_code(self):
+        executor = self.start()
+        with self.assertRaises(SnippetError) as context:
+            executor.execute(['x = 1', 'x / 0'], source_location=('/project/examples.py', 10))
+        message = str(context.exception)
+        self.assertIn('ZeroDivisionError', message)
+        self.assertIn('File "/project/examples.py", line 12, in <module>', message)
+        # The frames of sphinx_auto_embed are left out
+        self.assertNotIn('fork_server.py', message)
+
+    def test_stop_and_restart(self):
+        executor = self.start()
+        executor.stop()
+        self.assertEqual(executor.execute(['print(1)']).stdout, '1\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
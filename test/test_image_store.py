@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sphinx_auto_embed.image_store import ImageStore
+
+
+class TestImageStore(unittest.TestCase):
+    """
+    Images are stored once under the hash of their contents, and garbage collection only
+    removes those that no rst file references.
+    """
+
+    def setUp(self):
+        self.temp_dir = os.path.realpath(tempfile.mkdtemp())
+        self.store = ImageStore(self.temp_dir + '/_images')
+        os.makedirs(self.temp_dir + '/docs/api')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_rst(self, rel_path, text):
+        file_path = self.temp_dir + '/' + rel_path
+        with open(file_path, 'w') as f:
+            f.write(text)
+        return file_path
+
+    def get_reference(self, rst_rel_path, store_path):
+        rst_dir = os.path.dirname(self.temp_dir + '/' + rst_rel_path)
+        return os.path.relpath(store_path, rst_dir)
+
+    def test_identical_images_are_stored_once(self):
+        path_1 = self.store.add(b'image', 'png')
+        path_2 = self.store.add(b'image', 'png')
+        path_3 = self.store.add(b'other image', 'png')
+        self.assertEqual(path_1, path_2)
+        self.assertNotEqual(path_1, path_3)
+        self.assertEqual(sorted(os.listdir(self.store.store_dir)), sorted(
+            [os.path.basename(path_1), os.path.basename(path_3)]))
+
+    def test_collect_garbage_keeps_referenced_images(self):
+        figure_path = self.store.add(b'figure', 'png')
+        image_path = self.store.add(b'image', 'svg')
+        unused_path = self.store.add(b'unused', 'png')
+
+        rst_file_paths = [
+            self.write_rst('docs/index.rst', 'Title\n\n  .. figure:: {}\n    :scale: 80 %\n'.format(
+                self.get_reference('docs/index.rst', figure_path))),
+            self.write_rst('docs/api/page.rst', '.. image::{}\n'.format(
+                self.get_reference('docs/api/page.rst', image_path))),
+        ]
+
+        self.assertEqual(self.store.collect_garbage(rst_file_paths), [unused_path])
+        self.assertTrue(os.path.isfile(figure_path))
+        self.assertTrue(os.path.isfile(image_path))
+        self.assertFalse(os.path.exists(unused_path))
+
+    def test_collect_garbage_without_references(self):
+        image_path = self.store.add(b'image', 'png')
+        rst_file_path = self.write_rst('docs/index.rst', 'Nothing here\n')
+        self.assertEqual(self.store.collect_garbage([rst_file_path]), [image_path])
+
+    def test_collect_garbage_without_store(self):
+        self.assertEqual(self.store.collect_garbage([]), [])
+
+    def test_hardlink(self):
+        store_path = self.store.add(b'image', 'png')
+        legacy_path = self.temp_dir + '/docs/plot.png'
+        self.store.link(store_path, legacy_path, b'image')
+        self.assertTrue(os.path.samefile(store_path, legacy_path))
+
+        # A legacy path left from an older image is replaced
+        new_store_path = self.store.add(b'new image', 'png')
+        self.store.link(new_store_path, legacy_path, b'new image')
+        self.assertTrue(os.path.samefile(new_store_path, legacy_path))
+        with open(store_path, 'rb') as f:
+            self.assertEqual(f.read(), b'image')
+
+    def test_no_link(self):
+        store = ImageStore(self.temp_dir + '/_images', link_mode='none')
+        store_path = store.add(b'image', 'png')
+        legacy_path = self.temp_dir + '/docs/plot.png'
+        store.link(store_path, legacy_path, b'image')
+        self.assertFalse(os.path.exists(legacy_path))
+
+    def test_invalid_link_mode(self):
+        self.assertRaises(ValueError, ImageStore, self.temp_dir + '/_images', 'copy')
+
+
+if __name__ == '__main__':
+    unittest.main()
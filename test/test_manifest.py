@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sphinx_auto_embed.manifest import BuildManifest, MANIFEST_FILE_NAME
+
+
+class TestBuildManifest(unittest.TestCase):
+    """
+    An rstx file is up to date until it, a module it depends on, or one of its outputs changes.
+    """
+
+    def setUp(self):
+        self.temp_dir = os.path.realpath(tempfile.mkdtemp())
+        self.rstx_path = self.write('docs/index.rstx', 'rstx')
+        self.rst_path = self.write('docs/index.rst', 'rst')
+        self.module_path = self.write('pkg/helper.py', 'VALUE = 8\n')
+
+        manifest = self.get_manifest()
+        manifest.update(self.rstx_path, {'pkg.helper': self.module_path}, [self.rst_path])
+        manifest.save()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, rel_path, text):
+        file_path = self.temp_dir + '/' + rel_path
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        with open(file_path, 'w') as f:
+            f.write(text)
+        return file_path
+
+    def get_manifest(self):
+        # Each run reads the manifest in a new instance, which hashes each file once
+        manifest = BuildManifest(self.temp_dir + '/' + MANIFEST_FILE_NAME)
+        manifest.load()
+        return manifest
+
+    def is_up_to_date(self):
+        return self.get_manifest().is_up_to_date(self.rstx_path)
+
+    def test_unchanged(self):
+        self.assertTrue(self.is_up_to_date())
+
+    def test_unprocessed_file(self):
+        other_rstx_path = self.write('docs/other.rstx', 'rstx')
+        self.assertFalse(self.get_manifest().is_up_to_date(other_rstx_path))
+
+    def test_changed_rstx_file(self):
+        self.write('docs/index.rstx', 'changed rstx')
+        self.assertFalse(self.is_up_to_date())
+
+    def test_changed_dependency_module(self):
+        self.write('pkg/helper.py', 'VALUE = 9\n')
+        self.assertFalse(self.is_up_to_date())
+
+    def test_removed_dependency_module(self):
+        os.remove(self.module_path)
+        self.assertFalse(self.is_up_to_date())
+
+    def test_changed_output(self):
+        self.write('docs/index.rst', 'edited by hand')
+        self.assertFalse(self.is_up_to_date())
+
+    def test_removed_output(self):
+        os.remove(self.rst_path)
+        self.assertFalse(self.is_up_to_date())
+
+    def test_forget_hashes_of_changed_module(self):
+        manifest = self.get_manifest()
+        self.assertTrue(manifest.is_up_to_date(self.rstx_path))
+
+        # Within a run, e.g., in watch mode, the hash is only computed again once forgotten
+        self.write('pkg/helper.py', 'VALUE = 9\n')
+        self.assertTrue(manifest.is_up_to_date(self.rstx_path))
+        manifest.forget_hashes([self.module_path])
+        self.assertFalse(manifest.is_up_to_date(self.rstx_path))
+
+    def test_paths(self):
+        self.assertEqual(
+            self.get_manifest().get_paths(self.rstx_path), ([self.module_path], [self.rst_path]))
+
+    def test_changed_directives(self):
+        manifest = self.get_manifest()
+        manifest.set_directive_names(['embed-test'])
+        manifest.update(self.rstx_path, {}, [self.rst_path])
+        manifest.save()
+
+        manifest = self.get_manifest()
+        manifest.set_directive_names(['embed-test'])
+        self.assertTrue(manifest.is_up_to_date(self.rstx_path))
+        manifest.set_directive_names(['embed-test', 'embed-new'])
+        self.assertFalse(manifest.is_up_to_date(self.rstx_path))
+
+    def test_changed_default_options(self):
+        manifest = self.get_manifest()
+        manifest.set_default_options({'plot': {'figsize': (8., 6.)}})
+        manifest.update(self.rstx_path, {}, [self.rst_path])
+        manifest.save()
+
+        # Tuples are stored as lists, which does not count as a change
+        manifest = self.get_manifest()
+        manifest.set_default_options({'plot': {'figsize': (8., 6.)}})
+        self.assertTrue(manifest.is_up_to_date(self.rstx_path))
+        manifest.set_default_options({'plot': {'figsize': (4., 3.)}})
+        self.assertFalse(manifest.is_up_to_date(self.rstx_path))
+
+    def test_prune(self):
+        manifest = self.get_manifest()
+        manifest.prune([])
+        self.assertIsNone(manifest.get_entry(self.rstx_path))
+
+    def test_incompatible_manifest_is_ignored(self):
+        self.write(MANIFEST_FILE_NAME, '{"version": 0, "files": {}}')
+        self.assertFalse(self.is_up_to_date())
+
+
+if __name__ == '__main__':
+    unittest.main()
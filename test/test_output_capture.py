@@ -0,0 +1,87 @@
+import unittest
+
+from sphinx_auto_embed.execution import OutputCapture
+
+
+class TestOutputCapture(unittest.TestCase):
+    """
+    Captured print output is read back in full or truncated to its first and last lines.
+    """
+
+    def capture(self, text, head=None, tail=None, spool_size=1024):
+        capture = OutputCapture(head, tail, spool_size)
+        try:
+            capture.write(text)
+            return capture.getvalue()
+        finally:
+            capture.close()
+
+    def get_lines(self, num_lines):
+        return ''.join('line {}\n'.format(iline) for iline in range(num_lines))
+
+    def test_no_limit(self):
+        text = self.get_lines(100)
+        self.assertEqual(self.capture(text), text)
+
+    def test_as_many_lines_as_kept(self):
+        text = self.get_lines(4)
+        self.assertEqual(self.capture(text, head=2, tail=2), text)
+
+    def test_fewer_lines_than_kept(self):
+        text = self.get_lines(3)
+        self.assertEqual(self.capture(text, head=2, tail=2), text)
+
+    def test_one_line_elided(self):
+        self.assertEqual(
+            self.capture(self.get_lines(5), head=2, tail=2),
+            'line 0\nline 1\n... [1 line elided] ...\nline 3\nline 4\n')
+
+    def test_several_lines_elided(self):
+        self.assertEqual(
+            self.capture(self.get_lines(7), head=2, tail=2),
+            'line 0\nline 1\n... [3 lines elided] ...\nline 5\nline 6\n')
+
+    def test_head_only(self):
+        self.assertEqual(
+            self.capture(self.get_lines(5), head=2),
+            'line 0\nline 1\n... [3 lines elided] ...\n')
+
+    def test_tail_only(self):
+        self.assertEqual(
+            self.capture(self.get_lines(5), tail=2),
+            '... [3 lines elided] ...\nline 3\nline 4\n')
+
+    def test_zero_lines_kept(self):
+        self.assertEqual(
+            self.capture(self.get_lines(3), head=0, tail=0), '... [3 lines elided] ...\n')
+
+    def test_last_line_without_newline(self):
+        self.assertEqual(
+            self.capture('a\nb\nc', head=1, tail=1), 'a\n... [1 line elided] ...\nc')
+
+    def test_spooled_to_disk(self):
+        # Much more output than is held in memory
+        text = self.get_lines(1000)
+        self.assertEqual(self.capture(text, spool_size=100), text)
+        self.assertEqual(
+            self.capture(text, head=1, tail=1, spool_size=100),
+            'line 0\n... [998 lines elided] ...\nline 999\n')
+
+    def test_non_ascii_output(self):
+        text = u'caf\xe9 \u2603\n'
+        self.assertEqual(self.capture(text, spool_size=4), text)
+
+    def test_text_stream_attributes(self):
+        capture = OutputCapture()
+        try:
+            self.assertEqual(capture.encoding, 'utf-8')
+            self.assertFalse(capture.isatty())
+            capture.writelines(['a\n', 'b\n'])
+            capture.flush()
+            self.assertEqual(capture.getvalue(), 'a\nb\n')
+        finally:
+            capture.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
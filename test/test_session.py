@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sphinx_auto_embed.cache import ExecutionCache
+from sphinx_auto_embed.execution import Session, set_session, set_execution_cache, \
+    execute_snippet, get_num_executed_snippets
+
+
+class TestSession(unittest.TestCase):
+    """
+    Snippets of a session share a namespace, and code skipped thanks to cached results is only
+    replayed when a later snippet has to run.
+    """
+
+    def setUp(self):
+        self.temp_dir = os.path.realpath(tempfile.mkdtemp())
+        self.log_path = self.temp_dir + '/setup.log'
+        # The setup code logs each time it runs
+        self.setup_lines = [
+            'with open({!r}, "a") as f:'.format(self.log_path),
+            '    f.write("setup\\n")',
+            'x = 1',
+        ]
+
+    def tearDown(self):
+        set_session(None)
+        set_execution_cache(None)
+        shutil.rmtree(self.temp_dir)
+
+    def get_num_setup_runs(self):
+        if not os.path.isfile(self.log_path):
+            return 0
+        with open(self.log_path, 'r') as f:
+            return len(f.readlines())
+
+    def start_session(self, cached=True):
+        if cached:
+            set_execution_cache(ExecutionCache(self.temp_dir + '/cache', self.temp_dir))
+        session = Session()
+        session.add(self.setup_lines, executed=False)
+        set_session(session)
+
+    def run_document(self, snippets):
+        return [execute_snippet([line]).stdout for line in snippets]
+
+    def test_snippets_share_namespace(self):
+        self.start_session(cached=False)
+        self.assertEqual(
+            self.run_document(['x += 1; print(x)', 'print(x * 10)']), ['2\n', '20\n'])
+        self.assertEqual(self.get_num_setup_runs(), 1)
+
+    def test_all_cached_executes_nothing(self):
+        snippets = ['x += 1; print(x)', 'print(x * 10)']
+        self.start_session()
+        self.run_document(snippets)
+        self.assertEqual(self.get_num_setup_runs(), 1)
+
+        num_executed_snippets = get_num_executed_snippets()
+        self.start_session()
+        self.assertEqual(self.run_document(snippets), ['2\n', '20\n'])
+        self.assertEqual(get_num_executed_snippets(), num_executed_snippets)
+        self.assertEqual(self.get_num_setup_runs(), 1)
+
+    def test_cache_hit_then_miss_replays_skipped_code(self):
+        self.start_session()
+        self.run_document(['x += 1; print(x)', 'print(x * 10)'])
+
+        # The first snippet is cached, so setup and it are replayed before the changed one
+        self.start_session()
+        self.assertEqual(
+            self.run_document(['x += 1; print(x)', 'print(x * 100)']), ['2\n', '200\n'])
+        self.assertEqual(self.get_num_setup_runs(), 2)
+
+    def test_replayed_output_is_discarded(self):
+        self.start_session()
+        self.run_document(['print("first")'])
+
+        self.start_session()
+        self.assertEqual(
+            self.run_document(['print("first")', 'print("second")']), ['first\n', 'second\n'])
+
+    def test_results_depend_on_code_before(self):
+        self.start_session()
+        self.assertEqual(self.run_document(['print(x)']), ['1\n'])
+
+        self.setup_lines[-1] = 'x = 5'
+        self.start_session()
+        self.assertEqual(self.run_document(['print(x)']), ['5\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
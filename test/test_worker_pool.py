@@ -0,0 +1,139 @@
+import os
+import time
+import unittest
+import multiprocessing
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from sphinx_auto_embed import worker_pool
+from sphinx_auto_embed.worker_pool import RecyclingPool, WorkerError
+from sphinx_auto_embed.profiling import get_rss
+
+
+def square(item):
+    return item * item
+
+
+def square_slowly(item):
+    time.sleep(0.01)
+    return item * item
+
+
+def fail_on_three(item):
+    if item == 3:
+        raise ValueError('three')
+    return item
+
+
+class UnpicklableError(Exception):
+
+    def __init__(self, lock):
+        Exception.__init__(self, 'unpicklable')
+        self.lock = lock
+
+
+def raise_unpicklable(item):
+    import threading
+    raise UnpicklableError(threading.Lock())
+
+
+def crash(item):
+    os._exit(1)
+
+
+def exit_silently(item):
+    os._exit(0)
+
+
+_Queue = multiprocessing.Queue
+
+
+class LateQueue(object):
+    """
+    Queue whose first get in the process that created it times out, after waiting long enough
+    for a worker that sent a result and then exited to be seen as exited.
+    """
+
+    def __init__(self):
+        self._queue = _Queue()
+        self._pid = os.getpid()
+        self._timed_out = False
+
+    def put(self, item):
+        self._queue.put(item)
+
+    def get(self, block=True, timeout=None):
+        if os.getpid() == self._pid and not self._timed_out:
+            self._timed_out = True
+            time.sleep(0.5)
+            raise queue.Empty
+        return self._queue.get(block, timeout)
+
+
+@unittest.skipIf(get_rss() is None, 'the resident set size cannot be read on this platform')
+class TestRecyclingPool(unittest.TestCase):
+    """
+    Workers over the memory budget are replaced without losing tasks, while workers that die
+    are reported.
+    """
+
+    def setUp(self):
+        # Poll often, so that dead workers are found quickly
+        self.poll_interval = worker_pool.POLL_INTERVAL
+        worker_pool.POLL_INTERVAL = 0.001
+
+    def tearDown(self):
+        worker_pool.POLL_INTERVAL = self.poll_interval
+
+    def test_ordered_results(self):
+        pool = RecyclingPool(3)
+        self.assertEqual(list(pool.imap(square, range(20))), [i * i for i in range(20)])
+        self.assertEqual(pool.num_recycled, 0)
+
+    def test_unordered_results(self):
+        pool = RecyclingPool(3)
+        results = list(pool.imap(square_slowly, range(20), ordered=False))
+        self.assertEqual(sorted(results), [i * i for i in range(20)])
+
+    def test_recycling_after_every_task(self):
+        # Any worker is over a budget of one byte after its first task
+        pool = RecyclingPool(2, memory_budget=1)
+        self.assertEqual(
+            list(pool.imap(square_slowly, range(20))), [i * i for i in range(20)])
+        self.assertEqual(pool.num_recycled, 20)
+
+    def test_recycled_worker_exiting_before_its_result_is_received(self):
+        multiprocessing.Queue = LateQueue
+        try:
+            pool = RecyclingPool(1, memory_budget=1)
+            self.assertEqual(list(pool.imap(square, range(1))), [0])
+        finally:
+            multiprocessing.Queue = _Queue
+
+    def test_exception_is_raised_again(self):
+        pool = RecyclingPool(2)
+        with self.assertRaises(ValueError):
+            list(pool.imap(fail_on_three, range(10)))
+
+    def test_unpicklable_exception(self):
+        pool = RecyclingPool(1)
+        with self.assertRaises(WorkerError):
+            list(pool.imap(raise_unpicklable, range(1)))
+
+    def test_crashed_worker(self):
+        pool = RecyclingPool(2)
+        with self.assertRaises(WorkerError):
+            list(pool.imap(crash, range(4)))
+
+    def test_worker_exiting_without_result(self):
+        # Exits normally like a recycled worker, but never sends its result
+        pool = RecyclingPool(1, memory_budget=1)
+        with self.assertRaises(WorkerError):
+            list(pool.imap(exit_silently, range(1)))
+
+
+if __name__ == '__main__':
+    unittest.main()